@@ -0,0 +1,72 @@
+"""Compare /api/v1 responses with the HTML pages they mirror.
+
+Loads a GTFS zip offline as bench/tables.py does, with stop pages
+answered from the local estimate, then requests each page and its API
+counterpart. Reports the median request time and the body size raw,
+gzipped and (with the brotli package) as br.
+
+usage: python bench/api.py GTFS_full.zip [vehicles] [repeats]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from offline import importRti
+from tables import handlerFor, timed
+
+
+def encodedSize(client, url, encoding):
+    resp = client.get(url, headers={"Accept-Encoding": encoding})
+    if resp.headers.get("Content-Encoding", "identity") != encoding:
+        return None
+    return len(resp.data)
+
+
+if __name__ == "__main__":
+    zpath = sys.argv[1]
+    nvehicles = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    workdir = tempfile.mkdtemp(prefix="rti-bench-")
+    shutil.copy(zpath, os.path.join(workdir, "GTFS_full.zip"))
+    rti = importRti(handlerFor(zpath, nvehicles), workdir)
+    rti.LOCAL_PREDICTIONS = "only"
+    ds = rti.data
+    if "feed_version" not in ds.zipinfo:
+        sys.exit("Could not load {}".format(zpath))
+    print("Waiting for the timetable prerender to finish")
+    while not rti.timetables.done:
+        time.sleep(0.5)
+
+    # The busiest stop and route, a week into the feed
+    offsets = ds.trip_stop_times.stop_offsets
+    stop = max(ds.stopids, key=lambda s: offsets[ds.stopids[s] + 1] -
+               offsets[ds.stopids[s]])
+    route = max(ds.routelist, key=lambda r: len(
+        ds.routetrips.get(ds.routelist[r]["route_id"], [])))
+    day = ds.cal_start + rti.dt.timedelta(days=7)
+    pairs = [
+        ("stop " + stop, "/stop/{}/".format(stop),
+         "/api/v1/stop/{}".format(stop)),
+        ("route " + route, "/route/{}/".format(route),
+         "/api/v1/route/{}".format(route)),
+        ("vehicles", "/vehicles/", "/api/v1/vehicles"),
+        ("timetable " + route, "/timetable/{}/?date={}&stops=all".format(
+            route, day), "/api/v1/timetable/{}?date={}&stops=all".format(
+            route, day)),
+    ]
+    client = rti.app.test_client()
+    encodings = ["gzip"] + (["br"] if rti.brotli is not None else [])
+    print("{:20s} {:5s} {:>9s} {:>9s}".format("page", "", "ms", "bytes") +
+          "".join(" {:>9s}".format(e) for e in encodings))
+    for name, page, api in pairs:
+        for kind, url in (("html", page), ("json", api)):
+            resp, ms = timed(lambda: client.get(url), repeats)
+            if resp.status_code != 200:
+                print("{} gave {}".format(url, resp.status_code))
+                continue
+            print("{:20s} {:5s} {:>9.2f} {:>9d}".format(
+                name, kind, ms, len(resp.data)) + "".join(
+                " {:>9}".format(str(encodedSize(client, url, e))) for e in
+                encodings))
@@ -0,0 +1,163 @@
+"""A stand-in for the Metlink API, serving fixtures over HTTP.
+
+Serves stop-predictions, feed_info, the GTFS-RT feeds and full.zip from
+a fixture directory (as written by bench/makegtfs.py or bench/record.py;
+feeds with a .pb fixture alongside are served as protobuf when asked
+for, and stops with no recorded predictions have no departures). Point rti.py at it with
+
+    RTI_API_URL=http://127.0.0.1:8081/v1 RTI_STATIC_URL=http://127.0.0.1:8081/v1
+
+Latency and failures can be injected, optionally only for some
+endpoints: each response is delayed by --latency ms plus up to --jitter
+ms, answered with --error-status at rate --errors, or held for
+--hang-seconds (longer than rti's timeouts) at rate --hangs. Request
+counts per endpoint are printed on exit.
+
+usage: python bench/fakemetlink.py datadir [--port 8081] [--latency ms]
+           [--jitter ms] [--errors rate] [--error-status 503]
+           [--hangs rate] [--hang-seconds 30] [--endpoints name,...]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import signal
+import threading
+import time
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+paths = {"/v1/gtfs/feed_info": "feed_info",
+         "/v1/gtfs-rt/vehiclepositions": "vehiclepositions",
+         "/v1/gtfs-rt/tripupdates": "tripupdates",
+         "/v1/gtfs-rt/servicealerts": "servicealerts",
+         "/v1/stop-predictions": "stop-predictions",
+         "/v1/gtfs/full.zip": "full.zip"}
+
+
+def loadFixtures(datadir):
+    fixtures = {}
+    for name in paths.values():
+        for ext, ctype in ((".json", "application/json"),
+                           (".pb", "application/x-protobuf")):
+            path = os.path.join(datadir, name + ext)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    fixtures[name, ctype] = f.read()
+    zpath = os.path.join(datadir, "GTFS_full.zip")
+    with open(zpath, "rb") as f:
+        fixtures["full.zip", "application/zip"] = f.read()
+    # Stops without a recorded answer get no departures, as Metlink gives
+    # for quiet stops
+    with zipfile.ZipFile(zpath) as zf:
+        with io.TextIOWrapper(zf.open("stops.txt"),
+                              encoding="utf-8-sig") as f:
+            predictions = {row["stop_id"]: json.dumps(
+                {"farezone": row["zone_id"], "closed": False,
+                 "departures": []}).encode("utf-8") for row in
+                csv.DictReader(f)}
+    recorded = json.loads(fixtures.pop(("stop-predictions",
+                                        "application/json"), b"{}"))
+    predictions.update((stop, json.dumps(answer).encode("utf-8")) for
+                       stop, answer in recorded.items())
+    return fixtures, predictions, len(recorded)
+
+
+class FakeMetlink(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, ctype="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        config = self.server.config
+        url = urlsplit(self.path)
+        name = paths.get(url.path.rstrip("/"))
+        with self.server.lock:
+            self.server.counts[name or "unknown"] += 1
+        if name is None:
+            return self.reply(404, b'{"message": "Not found"}')
+        injected = (config.endpoints is None or name in config.endpoints)
+        if injected:
+            delay = config.latency + random.uniform(0, config.jitter)
+            time.sleep(delay / 1000)
+            roll = random.random()
+            if roll < config.hangs:
+                with self.server.lock:
+                    self.server.counts[name + " hung"] += 1
+                time.sleep(config.hang_seconds)
+                return self.reply(504, b'{"message": "Gateway timeout"}')
+            if roll < config.hangs + config.errors:
+                with self.server.lock:
+                    self.server.counts[name + " failed"] += 1
+                return self.reply(config.error_status,
+                                  b'{"message": "Injected error"}')
+        if name == "stop-predictions":
+            stop = parse_qs(url.query).get("stop_id", [""])[0]
+            body = self.server.predictions.get(stop)
+            if body is None:
+                return self.reply(404, b'{"message": "No such stop"}')
+            return self.reply(200, body)
+        if name == "full.zip":
+            return self.reply(200, self.server.fixtures[name,
+                                                        "application/zip"],
+                              "application/zip")
+        accept = self.headers.get("accept", "")
+        for ctype in ("application/x-protobuf", "application/json"):
+            if ((ctype in accept or ctype == "application/json") and
+                    (name, ctype) in self.server.fixtures):
+                return self.reply(200, self.server.fixtures[name, ctype],
+                                  ctype)
+        return self.reply(404, b'{"message": "No fixture"}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve Metlink API fixtures with injected faults")
+    parser.add_argument("datadir")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="added delay in ms")
+    parser.add_argument("--jitter", type=float, default=0,
+                        help="random extra delay of up to this many ms")
+    parser.add_argument("--errors", type=float, default=0,
+                        help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hangs", type=float, default=0,
+                        help="fraction of requests held for --hang-seconds")
+    parser.add_argument("--hang-seconds", type=float, default=30)
+    parser.add_argument("--endpoints", default=None,
+                        help="comma-separated endpoints to inject faults "
+                        "into, e.g. stop-predictions (default all)")
+    config = parser.parse_args()
+    if config.endpoints is not None:
+        config.endpoints = set(config.endpoints.split(","))
+    server = ThreadingHTTPServer(("127.0.0.1", config.port), FakeMetlink)
+    server.daemon_threads = True
+    server.config = config
+    server.fixtures, server.predictions, recorded = loadFixtures(
+        config.datadir)
+    server.lock = threading.Lock()
+    server.counts = Counter()
+    print("Serving {} on http://127.0.0.1:{}/v1 ({} stops with "
+          "departures)".format(config.datadir, config.port, recorded))
+    # Print the counts on SIGTERM too, and on SIGINT when backgrounded
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for name, count in sorted(server.counts.items()):
+        print("{:32s} {:>8d}".format(name, count))
@@ -0,0 +1,500 @@
+
+
+2.0
+A0*
+Ћ**2571**1113**3053**2043**1493**2174**2063**1101**3316**1345**2329**3561*1*"
+77__0__626__TZM__201__30108R
+
+Route 1 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A1*
+Ћ**1331**1698**2865**2523**2633*2*"
+23__0__752__TZM__201__3010
+8R
+
+Route 2 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A2*
+Ћ**3719**1420**3304**3001**3304**1341**3745**1139**1242**1076**2141*3*"
+38__1__137__TZM__202__30208	R
+
+Route 3 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A3*
+Ћ**3202**2955**3530*4*"
+15__0__834__TZM__206__30608R
+
+Route 4 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A4*
+Ћ**2400**1972**1927**2416**3919**1237**1093**2804*5*"
+75__0__624__TZM__206__30608R
+
+Route 5 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A5*
+Ћ**1734**1950**1333*6*"
+45__0__504__TZM__205__30508R
+
+Route 6 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A6*
+Ћ**1019**2860**3205**3539**3156**1665*7*"
+40__1__139__TZM__204__3040
+8R
+
+Route 7 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A7*
+Ћ**3758**3126**2793**1773**1166*8*"
+80__1__719__TZM__203__3030
+8	R
+
+Route 8 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A8*
+Ћ**3094**2745**2113**2813**2380**3313**1097*9*"
+81__0__180__TZM__203__30308	R
+
+Route 9 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A9*
+Ћ**2763**1656**3225*10*"
+72__1__621__TZM__203__30308	R
+
+Route 10 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A10*
+Ћ**2971**2169**2422**3898**2870**2628**3258*11*"
+26__1__485__TZM__200__30008R
+
+Route 11 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A11*
+Ћ**3220**3231**3934**3883**3175**1923*12*"
+2__1__371__TZM__205__3050
+8R
+
+Route 12 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A12*
+Ћ**3904**2596**1657**2081**3408*13*"
+79__0__358__TZM__206__30608R
+
+Route 13 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A13*
+Ћ**2980**1452**1899*14*"
+66__1__255__TZM__201__30108	R
+
+Route 14 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A14*
+Ћ**1706*15*"
+70__1__169__TZM__206__30608R
+
+Route 15 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A15*
+Ћ**3988**3681**2918**1102**1237**2111**1210**3167**2934*16*"
+11__0__1010__TZM__200__30008R
+
+Route 16 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A16*
+Ћ**2793**1452**2387**2304**2565**3677**2593**2188**1338**1938*17*"
+28__1__937__TZM__204__30408R
+
+Route 17 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A17*
+Ћ**2766**3904**3982**2785**3404**2091**1764*18*"
+65__0__254__TZM__200__30008	R
+
+Route 18 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A18*
+Ћ**2542**1275**3585**3428**2302**3358*19*"
+25__0__1024__TZM__200__30008R
+
+Route 19 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A19*
+Ћ**3560**1469**3176**1836**2954**3885**1954**2468**3525**3160**3565**3913*20*"
+76__1__265__TZM__204__3040
+8R
+
+Route 20 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A20*
+Ћ**1566**3649**2638*21*"
+76__1__535__TZM__201__30108R
+
+Route 21 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A21*
+Ћ**1139**3179**1308**1099**2507**2019**1637**1874**2622**2817**3089**3413*22*"
+10__1__379__TZM__206__30608	R
+
+Route 22 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A22*
+Ћ**2395**1332**3425**3502**1224**1570**3278**2924*23*"
+71__0__1070__TZM__204__30408	R
+
+Route 23 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A23*
+Ћ**1266*24*"
+25__0__124__TZM__203__30308R
+
+Route 24 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A24*
+Ћ**3950**2886**2647**3922*25*"
+15__0__654__TZM__201__30108R
+
+Route 25 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A25*
+Ћ**2574**1431**3899**2619**2897**1988**1291**3976**2280*26*"
+48__1__237__TZM__204__30408R
+
+Route 26 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A26*
+Ћ**1230**2189**2413**3694**1069**3844**3543**2798**2299**3395**1041*27*"
+61__0__880__TZM__203__30308R
+
+Route 27 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A27*
+Ћ**3997**1209**3391**3799**2829**3811**3827**3665**1398**2734**2663**1504*28*"
+69__0__978__TZM__203__30308R
+
+Route 28 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A28*
+Ћ**3439**2673**2426**1719**2656**1166**1586**2169**3115*29*"
+88__1__817__TZM__203__30308R
+
+Route 29 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A29*
+Ћ**2921**3961**2202**3387**3439**2049**3782**1143**2600**3208*30*"
+63__0__1062__TZM__203__3030
+8	R
+
+Route 30 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A30*
+Ћ**1697**2856**2610**3365**3278**3716*31*"
+39__0__228__TZM__202__3020
+8	R
+
+Route 31 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A31*
+Ћ**2604**3003**3986**1137**3565*32*"
+38__1__857__TZM__201__30108R
+
+Route 32 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A32*
+Ћ**2101**2590**2122**1511**2046**1036**1489**3751**1437**2916**1619*33*"
+28__1__577__TZM__201__3010
+8R
+
+Route 33 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A33*
+Ћ**1920*34*"
+82__1__181__TZM__204__3040
+8R
+
+Route 34 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A34*
+Ћ**1153**3371**3693**1467**1179**2033**2699**1600**2420**1467**1204**2595*35*"
+9__0__1098__TZM__204__30408R
+
+Route 35 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A35*
+Ћ**3351**3004**1702**2442**3477**2630**3099**3314**3737*36*"
+86__1__275__TZM__200__3000
+8R
+
+Route 36 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A36*
+Ћ**1203**1062**3357**2220**1407**2845**1356**1002**3714**1194**2151*37*"
+22__1__661__TZM__201__30108R
+
+Route 37 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A37*
+Ћ**2569**1480**3641**1915**2253**3626**3725**1514*38*"
+72__1__621__TZM__203__30308R
+
+Route 38 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A38*
+Ћ**2828**1386**2765**3753**1636**2125**1466**2528**2033**1864**2345**3541*39*"
+55__0__244__TZM__204__30408R
+
+Route 39 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A39*
+Ћ**3899**2976**2469**3626*40*"
+41__0__230__TZM__204__30408R
+
+Route 40 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A40*
+Ћ**3555**2802**1458**2025**1217**3160**2209*41*"
+15__0__834__TZM__206__30608	R
+
+Route 41 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A41*
+Ћ**1939**1991**2540**2421*42*"
+83__0__362__TZM__203__3030
+8R
+
+Route 42 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A42*
+Ћ**1575**2751**2981**1370**3115**2130**1409**1898**1444*43*"
+77__0__536__TZM__202__30208R
+
+Route 43 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A43*
+Ћ**3731**2800*44*"
+33__0__942__TZM__202__3020
+8	R
+
+Route 44 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A44*
+Ћ**2116**2497**3880**2337*45*"
+86__1__455__TZM__205__3050
+8R
+
+Route 45 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A45*
+Ћ**1906*46*"
+84__1__363__TZM__204__3040
+8R
+
+Route 46 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A46*
+Ћ**1068**1714**3858**1822**2063**3632*47*"
+31__0__1030__TZM__206__30608	R
+
+Route 47 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A47*
+Ћ**3818**2511**3818**2516**1776**1432**1018*48*"
+56__1__1055__TZM__203__30308R
+
+Route 48 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A48*
+Ћ**2350**3802**2680**2405**3410**3830**2054**2648**3517**2129*49*"
+72__1__891__TZM__200__30008	R
+
+Route 49 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A49*
+Ћ**1913**3509**2933**2417**2158**3936**1119*50*"
+19__0__208__TZM__203__30308R
+
+Route 50 disruptionenZ7
+5
+/Buses are running late
+because of other cause.enp
+A50*
+Ћ**1922**3193**2799**2203**2733**2632**3544**1018**1278**2625*51*"
+67__0__256__TZM__202__3020
+8R
+
+Route 51 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A51*
+Ћ**2612**3022**1404**2679**3647**1675**3924**3701**3018**1880**3687*52*"
+47__0__416__TZM__201__30108R
+
+Route 52 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A52*
+Ћ**1568**2028**3654**3106**2244*53*"
+38__1__587__TZM__204__30408R
+
+Route 53 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A53*
+Ћ**3135**2315**1863**2138**1162**2272*54*"
+65__0__614__TZM__203__30308R
+
+Route 54 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A54*
+Ћ**2082**1654**2186**2077**2368*55*"
+8__1__1097__TZM__203__30308R
+
+Route 55 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A55*
+Ћ**3758**2810**3692**3027**3952**1690**2571*56*"
+41__0__140__TZM__205__30508R
+
+Route 56 disruptionenZ4
+2
+,Buses are running late
+because of accident.enp
+A56*
+Ћ**1209**3141**2251**1164**2701**1445*57*"
+79__0__1078__TZM__205__3050
+8R
+
+Route 57 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A57*
+Ћ**2410*58*"
+68__1__347__TZM__202__3020
+8R
+
+Route 58 disruptionenZ8
+6
+0Buses are running late
+because of construction.enp
+A58*
+Ћ**1986**3131**1342**1133**2371**1077**3673**2816**1106**1690**2151**3745*59*"
+2__1__731__TZM__201__30108R
+
+Route 59 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
+A59*
+Ћ**3578**1675**1179**1159**3036*60*"
+40__1__499__TZM__200__30008R
+
+Route 60 disruptionenZ3
+1
++Buses are running late
+because of weather.enp
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""Closed-loop load generator for a running rti.py.
+
+Each of --concurrency clients requests pages back to back for
+--duration seconds, after --warmup seconds whose requests are not
+counted. Pages follow a traffic mix that is mostly stop pages, with
+the targets taken from the same fixture directory the (fake) upstream
+serves. Reports throughput and p50/p95/p99 latency per page type, and
+optionally writes them as JSON.
+
+usage: python bench/loadgen.py http://127.0.0.1:5000 datadir
+           [--concurrency 8] [--duration 30] [--warmup 5]
+           [--mix stop=50,route=15,...] [--out results.json]
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+
+import requests
+
+# Relative weights of each page type
+MIX = {"stop": 50, "route": 12, "trip": 5, "timetable": 10, "vehicles": 5,
+       "search": 10, "nearby": 8}
+# Share of stop pages for the busy stops with recorded predictions; the
+# rest are spread over every stop and mostly miss the prediction cache
+POPULAR = 0.8
+
+
+def zipRows(zf, name):
+    with io.TextIOWrapper(zf.open(name), encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def loadTargets(datadir):
+    with zipfile.ZipFile(os.path.join(datadir, "GTFS_full.zip")) as zf:
+        stops = zipRows(zf, "stops.txt")
+        routes = zipRows(zf, "routes.txt")
+    shortnames = {r["route_id"]: r["route_short_name"] for r in routes}
+    predicted = []
+    path = os.path.join(datadir, "stop-predictions.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            predicted = sorted(json.load(f))
+    trips = []
+    path = os.path.join(datadir, "vehiclepositions.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            for entity in json.load(f).get("entity", []):
+                trip = entity["vehicle"]["trip"]
+                route = shortnames.get(str(trip.get("route_id")))
+                if route is not None:
+                    trips.append((route, trip["trip_id"]))
+    words = sorted(set(word for stop in stops for word in
+                       stop["stop_name"].split() if len(word) > 3))
+    return {"stops": predicted or [s["stop_id"] for s in stops],
+            "allstops": [s["stop_id"] for s in stops],
+            "routes": sorted(shortnames.values()),
+            "trips": trips, "words": words}
+
+
+def pageUrl(kind, targets, rnd):
+    if kind == "stop":
+        return "/stop/{}/".format(rnd.choice(
+            targets["stops"] if rnd.random() < POPULAR else
+            targets["allstops"]))
+    if kind == "route":
+        return "/route/{}/".format(rnd.choice(targets["routes"]))
+    if kind == "trip" and len(targets["trips"]) > 0:
+        return "/route/{}/?trip={}".format(*rnd.choice(targets["trips"]))
+    if kind == "timetable":
+        return "/timetable/{}/{}".format(rnd.choice(targets["routes"]),
+                                         rnd.choice(["", "?stops=all"]))
+    if kind == "search":
+        return "/search/?q={}".format(" ".join(rnd.sample(targets["words"],
+                                                          rnd.randint(1, 2))))
+    if kind == "nearby":
+        return "/stop/{}/nearby/".format(rnd.choice(targets["allstops"]))
+    return "/vehicles/"
+
+
+def client(baseurl, targets, mix, start, stop, seed, records, lock):
+    rnd = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    session = requests.Session()
+    mine = []
+    while True:
+        now = time.perf_counter()
+        if now >= stop:
+            break
+        kind = rnd.choices(kinds, weights)[0]
+        url = baseurl + pageUrl(kind, targets, rnd)
+        try:
+            resp = session.get(url, timeout=60)
+            status = resp.status_code
+        except requests.RequestException:
+            status = None
+        finished = time.perf_counter()
+        if now >= start:
+            mine.append((kind, status, finished - now))
+    with lock:
+        records.extend(mine)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(records, duration):
+    kinds = sorted(set(kind for kind, status, latency in records))
+    summary = {}
+    for kind in kinds + ["all"]:
+        rows = [r for r in records if kind == "all" or r[0] == kind]
+        latencies = sorted(latency for k, status, latency in rows)
+        summary[kind] = {
+            "requests": len(rows),
+            "errors": sum(1 for k, status, latency in rows if status is None
+                          or status >= 500),
+            "rps": len(rows) / duration,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000}
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running rti")
+    parser.add_argument("baseurl")
+    parser.add_argument("datadir")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--mix", default=None,
+                        help="page=weight,... replacing the default mix")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    mix = MIX
+    if args.mix is not None:
+        mix = {kind: float(weight) for kind, weight in
+               (part.split("=") for part in args.mix.split(","))}
+    targets = loadTargets(args.datadir)
+    records = []
+    lock = threading.Lock()
+    start = time.perf_counter() + args.warmup
+    stop = start + args.duration
+    threads = [threading.Thread(target=client, args=(
+        args.baseurl.rstrip("/"), targets, mix, start, stop, args.seed + i,
+        records, lock)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = report(records, args.duration)
+    print("{:10s} {:>9s} {:>7s} {:>8s} {:>9s} {:>9s} {:>9s}".format(
+        "page", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"))
+    for kind, row in summary.items():
+        print("{:10s} {:>9d} {:>7d} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            kind, row["requests"], row["errors"], row["rps"], row["p50_ms"],
+            row["p95_ms"], row["p99_ms"]))
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({"baseurl": args.baseurl, "concurrency": args.concurrency,
+                       "duration": args.duration, "mix": mix,
+                       "results": summary}, f, indent=1)
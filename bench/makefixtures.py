@@ -0,0 +1,143 @@
+"""Write synthetic GTFS-RT fixtures in both encodings.
+
+Each feed is written as Metlink-style JSON and as the standard protobuf
+encoding of the same content, so the two ingestion modes can be run and
+compared offline. Needs gtfs-realtime-bindings.
+
+usage: python bench/makefixtures.py [vehicles] [alerts]
+"""
+import json
+import os
+import random
+import sys
+
+from google.transit import gtfs_realtime_pb2
+
+fixturedir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "fixtures")
+NOW = 1792300000
+
+effects = ["REDUCED_SERVICE", "DETOUR", "SIGNIFICANT_DELAYS", "STOP_MOVED"]
+causes = ["OTHER_CAUSE", "CONSTRUCTION", "ACCIDENT", "WEATHER"]
+
+
+def tripId(i):
+    return "{}__{}__{}__TZM__{}__{}".format(1 + i % 90, i % 2, 100 + i,
+                                              200 + i % 7, 300 + i % 7)
+
+
+def vehiclePositions(rnd, n):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = NOW
+    entities = []
+    for i in range(n):
+        e = feed.entity.add(id=str(i))
+        v = e.vehicle
+        v.trip.trip_id = tripId(i)
+        v.trip.direction_id = i % 2
+        v.trip.route_id = str(1 + i % 90)
+        v.trip.start_time = "{:02d}:{:02d}:00".format(6 + i % 16, i % 60)
+        v.position.bearing = rnd.randrange(360)
+        v.position.latitude = round(-41.3 + rnd.uniform(-0.15, 0.15), 6)
+        v.position.longitude = round(174.78 + rnd.uniform(-0.15, 0.15), 6)
+        v.position.speed = round(rnd.uniform(0, 20), 1)
+        v.vehicle.id = str(2000 + i)
+        v.timestamp = NOW - rnd.randrange(90)
+        entities.append({"id": str(i), "vehicle": {
+            "trip": {"trip_id": v.trip.trip_id,
+                     "direction_id": v.trip.direction_id,
+                     "route_id": int(v.trip.route_id),
+                     "start_time": v.trip.start_time},
+            "position": {"bearing": v.position.bearing,
+                         "latitude": v.position.latitude,
+                         "longitude": v.position.longitude,
+                         "speed": v.position.speed},
+            "vehicle": {"id": v.vehicle.id},
+            "timestamp": v.timestamp}})
+    return feed, {"header": {"gtfs_realtime_version": "2.0",
+                             "timestamp": NOW}, "entity": entities}
+
+
+def tripUpdates(rnd, n):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = NOW
+    entities = []
+    for i in range(n):
+        e = feed.entity.add(id=str(i))
+        t = e.trip_update
+        t.trip.trip_id = tripId(i)
+        t.trip.schedule_relationship = 0
+        stu = t.stop_time_update.add(stop_sequence=1 + rnd.randrange(40))
+        stu.arrival.delay = rnd.randint(-200, 900)
+        t.vehicle.id = str(2000 + i)
+        t.timestamp = NOW - rnd.randrange(120)
+        # Metlink's JSON gives stop_time_update as a single object
+        entities.append({"id": str(i), "trip_update": {
+            "trip": {"trip_id": t.trip.trip_id,
+                     "schedule_relationship": "SCHEDULED"},
+            "stop_time_update": {"stop_sequence": stu.stop_sequence,
+                                 "arrival": {"delay": stu.arrival.delay}},
+            "vehicle": {"id": t.vehicle.id},
+            "timestamp": t.timestamp}})
+    return feed, {"header": {"gtfs_realtime_version": "2.0",
+                             "timestamp": NOW}, "entity": entities}
+
+
+def serviceAlerts(rnd, n):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = NOW
+    entities = []
+    for i in range(n):
+        e = feed.entity.add(id="A{}".format(i))
+        a = e.alert
+        effect = rnd.choice(effects)
+        cause = rnd.choice(causes)
+        a.effect = gtfs_realtime_pb2.Alert.Effect.Value(effect)
+        a.cause = gtfs_realtime_pb2.Alert.Cause.Value(cause)
+        a.severity_level = gtfs_realtime_pb2.Alert.WARNING
+        head = "Route {} disruption".format(1 + i % 90)
+        desc = "Buses are running late\r\nbecause of {}.".format(
+            cause.lower().replace("_", " "))
+        a.header_text.translation.add(text=head, language="en")
+        a.description_text.translation.add(text=desc, language="en")
+        a.active_period.add(start=NOW - 3600, end=NOW + 86400)
+        informed = []
+        for j in range(rnd.randint(1, 12)):
+            stop_id = str(1000 + rnd.randrange(3000))
+            a.informed_entity.add(stop_id=stop_id)
+            informed.append({"stop_id": stop_id})
+        route_id = str(1 + i % 90)
+        a.informed_entity.add(route_id=route_id)
+        informed.append({"route_id": route_id})
+        entity = a.informed_entity.add()
+        entity.trip.trip_id = tripId(rnd.randrange(1000))
+        informed.append({"trip": {"trip_id": entity.trip.trip_id}})
+        entities.append({"id": e.id, "timestamp": "2026-10-18T08:00:00+13:00",
+                         "alert": {
+            "effect": effect, "cause": cause, "severity_level": "WARNING",
+            "header_text": {"translation": [{"text": head,
+                                             "language": "en"}]},
+            "description_text": {"translation": [{"text": desc,
+                                                  "language": "en"}]},
+            "active_period": [{"start": NOW - 3600, "end": NOW + 86400}],
+            "informed_entity": informed}})
+    return feed, {"header": {"gtfs_realtime_version": "2.0",
+                             "timestamp": NOW}, "entity": entities}
+
+
+if __name__ == "__main__":
+    nveh = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    nalerts = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    rnd = random.Random(1)
+    os.makedirs(fixturedir, exist_ok=True)
+    for name, (feed, jfeed) in (("vehiclepositions", vehiclePositions(rnd, nveh)),
+                                ("tripupdates", tripUpdates(rnd, nveh)),
+                                ("servicealerts", serviceAlerts(rnd, nalerts))):
+        with open(os.path.join(fixturedir, name + ".pb"), "wb") as f:
+            f.write(feed.SerializeToString())
+        with open(os.path.join(fixturedir, name + ".json"), "w") as f:
+            json.dump(jfeed, f)
+        print("{}: {} entities".format(name, len(feed.entity)))
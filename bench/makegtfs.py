@@ -0,0 +1,267 @@
+"""Write a synthetic GTFS zip and matching upstream fixtures.
+
+The zip has the files and quirks rti.py relies on: Metlink-style trip
+ids, calendar_dates only, stop patterns with timepoints, trip variants
+that skip or add stops and some routes that loop back through their
+first stops. Alongside it go JSON responses for feed_info, vehicle
+positions, trip updates, service alerts and stop-predictions, all
+consistent with the zip, so bench/suite.py can replay them offline.
+The same seed and sizes always give the same feed.
+
+usage: python bench/makegtfs.py outdir [stops] [routes] [trips per route]
+                                [days] [seed]
+"""
+import csv
+import datetime as dt
+import io
+import json
+import os
+import random
+import sys
+import zipfile
+
+WORDS = ["Courtenay", "Manners", "Willis", "Lambton", "Kent", "Cambridge",
+         "Adelaide", "Karori", "Kelburn", "Brooklyn", "Island Bay",
+         "Newtown", "Kilbirnie", "Miramar", "Seatoun", "Johnsonville",
+         "Khandallah", "Ngaio", "Wadestown", "Northland", "Hataitai",
+         "Lyall Bay", "Strathmore", "Melrose", "Houghton", "Owhiro", "Aro",
+         "Mount Cook", "Thorndon", "Tawa", "Porirua", "Petone", "Lower Hutt",
+         "Naenae", "Stokes Valley", "Upper Hutt", "Eastbourne"]
+KINDS = ["Road", "Street", "Terrace", "Crescent", "Parade", "Avenue", "Drive",
+         "Place"]
+START = dt.date(2026, 10, 1)
+NZDT = dt.timezone(dt.timedelta(hours=13))
+# Fixtures are as seen at 08:00 a week into the feed
+NOW = int(dt.datetime(2026, 10, 8, 8, 0, tzinfo=NZDT).timestamp())
+NVEHICLES = 400
+NALERTS = 60
+NPREDICTED = 50
+
+
+def secsToTime(secs):
+    return "{:02d}:{:02d}:{:02d}".format(secs // 3600, secs // 60 % 60,
+                                         secs % 60)
+
+
+def isoTime(secs):
+    return dt.datetime.fromtimestamp(secs, NZDT).isoformat()
+
+
+def csvText(header, rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return "﻿" + out.getvalue()
+
+
+def makeFeed(nstops, nroutes, tripsper, days, rnd):
+    files = {}
+    files["agency.txt"] = csvText(["agency_id", "agency_name"],
+                                  [["TZM", "Tranzurban"], ["RAIL", "Rail"]])
+    stops = []
+    for i in range(nstops):
+        sid = str(1000 + i)
+        name = "{} {} at {}".format(rnd.choice(WORDS), rnd.choice(KINDS),
+                                    rnd.choice(WORDS))
+        if i % 5 == 0:
+            name += " - Stop {}".format(i % 7)
+        stops.append([sid, sid, name,
+                      "{:.6f}".format(-41.3 + rnd.uniform(-0.15, 0.15)),
+                      "{:.6f}".format(174.78 + rnd.uniform(-0.15, 0.15)),
+                      str(1 + i % 14), ""])
+    files["stops.txt"] = csvText(["stop_id", "stop_code", "stop_name",
+                                  "stop_lat", "stop_lon", "zone_id",
+                                  "parent_station"], stops)
+
+    # Weekday, Saturday and Sunday services, each missing the odd day
+    services = {}
+    for s in range(12):
+        dates = []
+        for d in range(days):
+            day = START + dt.timedelta(days=d)
+            wd = day.weekday()
+            if ((s % 3 == 0 and wd < 5) or (s % 3 == 1 and wd == 5) or
+                    (s % 3 == 2 and wd == 6)) and rnd.random() > 0.03:
+                dates.append(day)
+        services["SVC{}".format(s)] = dates
+    files["calendar_dates.txt"] = csvText(
+        ["service_id", "date", "exception_type"],
+        [[svc, d.strftime("%Y%m%d"), "1"] for svc, dates in
+         services.items() for d in dates] +
+        [["SVC0", (START + dt.timedelta(days=3)).strftime("%Y%m%d"), "2"]])
+
+    routes, trips, stop_times, patterns, pattern_trips = [], [], [], [], []
+    pid = 0
+    for r in range(nroutes):
+        rid = str(100 + r)
+        short = str(r + 1) if r % 9 else "{}e".format(r + 1)
+        routes.append([rid, "TZM", short, "Route {} via {}".format(
+            short, rnd.choice(WORDS)), "3"])
+        base = rnd.sample(range(nstops), rnd.randint(15, min(60, nstops)))
+        if r % 7 == 0:
+            base = base + base[:3]
+        tpset = set(range(0, len(base), 5)) | {0, len(base) - 1}
+        for d in (0, 1):
+            seqs = base if d == 0 else list(reversed(base))
+            variants = [seqs, seqs[:-5],
+                        seqs[:4] + [rnd.randrange(nstops)] + seqs[4:]]
+            pids = []
+            for variant in variants:
+                patterns.extend([["P{}".format(pid), stops[s][0], str(i + 1),
+                                  "1" if i in tpset else "0"] for i, s in
+                                 enumerate(variant)])
+                pids.append(("P{}".format(pid), variant))
+                pid += 1
+            for t in range(tripsper // 2):
+                svc = "SVC{}".format(rnd.randrange(12))
+                pname, variant = pids[0] if t % 4 else pids[1 + t % 2]
+                tid = "{}__{}__{}__TZM__{}__{}".format(rid, d, t, svc, svc)
+                trips.append([rid, svc, tid, str(d), str(t)])
+                pattern_trips.append([pname, tid, str(t)])
+                secs = 5 * 3600 + t * (18 * 3600 // max(tripsper // 2, 1)) + \
+                    rnd.randrange(300)
+                for i, s in enumerate(variant):
+                    secs += rnd.randint(40, 150)
+                    stop_times.append([tid, secsToTime(secs), secsToTime(secs),
+                                       stops[s][0], str(i + 1),
+                                       "1" if i in tpset else "0"])
+    files["routes.txt"] = csvText(["route_id", "agency_id",
+                                   "route_short_name", "route_long_name",
+                                   "route_type"], routes)
+    files["trips.txt"] = csvText(["route_id", "service_id", "trip_id",
+                                  "direction_id", "block_id"], trips)
+    files["stop_times.txt"] = csvText(["trip_id", "arrival_time",
+                                       "departure_time", "stop_id",
+                                       "stop_sequence", "timepoint"],
+                                      stop_times)
+    files["stop_patterns.txt"] = csvText(["stop_pattern_id", "stop_id",
+                                          "stop_sequence", "timepoint"],
+                                         patterns)
+    files["stop_pattern_trips.txt"] = csvText(["stop_pattern_id", "trip_id",
+                                               "trip_sequence"],
+                                              pattern_trips)
+    feedinfo = {"feed_publisher_name": "Metlink",
+                "feed_version": "{}.{}".format(START.strftime("%Y%m%d"),
+                                               nstops),
+                "feed_start_date": START.strftime("%Y%m%d"),
+                "feed_end_date": (START + dt.timedelta(days=days - 1)
+                                  ).strftime("%Y%m%d")}
+    files["feed_info.txt"] = csvText(list(feedinfo),
+                                     [list(feedinfo.values())])
+    return files, feedinfo, stops, routes, trips, stop_times
+
+
+def makeFixtures(feedinfo, stops, routes, trips, stop_times, rnd):
+    day = dt.datetime.fromtimestamp(NOW, NZDT).date()
+    base = int(dt.datetime(day.year, day.month, day.day,
+                           tzinfo=NZDT).timestamp())
+    running = rnd.sample(trips, min(NVEHICLES, len(trips)))
+    first = {}
+    for tid, arr, dep, stop_id, seq, tp in stop_times:
+        first.setdefault(tid, dep)
+    positions = {"header": {"gtfs_realtime_version": "2.0",
+                            "timestamp": NOW}, "entity": []}
+    updates = {"header": {"gtfs_realtime_version": "2.0", "timestamp": NOW},
+               "entity": []}
+    for i, (rid, svc, tid, direction, block) in enumerate(running):
+        stop = stops[rnd.randrange(len(stops))]
+        positions["entity"].append({"id": str(i), "vehicle": {
+            "trip": {"trip_id": tid, "direction_id": int(direction),
+                     "route_id": int(rid), "start_time": first[tid]},
+            "position": {"bearing": rnd.randrange(360),
+                         "latitude": float(stop[3]) + 0.0005,
+                         "longitude": float(stop[4]) - 0.0005,
+                         "speed": round(rnd.uniform(0, 20), 1)},
+            "vehicle": {"id": str(2000 + i)},
+            "timestamp": NOW - rnd.randrange(90)}})
+        delay = rnd.randint(-200, 900)
+        updates["entity"].append({"id": str(i), "trip_update": {
+            "trip": {"trip_id": tid, "schedule_relationship": "SCHEDULED"},
+            "stop_time_update": {"stop_sequence": 1 + rnd.randrange(10),
+                                 "arrival": {"delay": delay}},
+            "vehicle": {"id": str(2000 + i)},
+            "timestamp": NOW - rnd.randrange(120)}})
+
+    alerts = {"header": {"gtfs_realtime_version": "2.0", "timestamp": NOW},
+              "entity": []}
+    for i in range(NALERTS):
+        rid, svc, tid, direction, block = trips[rnd.randrange(len(trips))]
+        informed = ([{"stop_id": stops[rnd.randrange(len(stops))][0]} for
+                     j in range(rnd.randint(1, 12))] +
+                    [{"route_id": rid}, {"trip": {"trip_id": tid}}])
+        alerts["entity"].append({
+            "id": "A{}".format(i), "timestamp": isoTime(NOW - 3600),
+            "alert": {
+                "effect": rnd.choice(["REDUCED_SERVICE", "DETOUR",
+                                      "SIGNIFICANT_DELAYS"]),
+                "cause": rnd.choice(["OTHER_CAUSE", "CONSTRUCTION",
+                                     "WEATHER"]),
+                "severity_level": "WARNING",
+                "header_text": {"translation": [
+                    {"text": "Route {} disruption".format(rid),
+                     "language": "en"}]},
+                "description_text": {"translation": [
+                    {"text": "Buses are running late\r\nnear stop {}.".format(
+                        informed[0]["stop_id"]), "language": "en"}]},
+                "active_period": [{"start": NOW - 3600, "end": NOW + 86400}],
+                "informed_entity": informed}})
+
+    # stop-predictions for the stops with the most departures
+    shorts = {route[0]: route[2] for route in routes}
+    shorts = {trip[2]: shorts[trip[0]] for trip in trips}
+    departures = {}
+    for tid, arr, dep, stop_id, seq, tp in stop_times:
+        hours, mins, secs = (int(x) for x in dep.split(":"))
+        when = base + hours * 3600 + mins * 60 + secs
+        if NOW <= when < NOW + 3 * 3600:
+            departures.setdefault(stop_id, []).append((when, tid))
+    predictions = {}
+    for stop_id in sorted(departures, key=lambda s: -len(departures[s])
+                          )[:NPREDICTED]:
+        deps = []
+        for when, tid in sorted(departures[stop_id])[:20]:
+            delay = rnd.choice([0, 0, 60, 240, -60, None])
+            deps.append({
+                "stop_id": stop_id, "service_id": shorts[tid],
+                "direction": "outbound", "operator": "TZM",
+                "origin": {"stop_id": stop_id, "name": "Origin"},
+                "destination": {"stop_id": stop_id, "name": "Destination"},
+                "delay": "PT0S", "vehicle_id": None,
+                "name": stop_id, "arrival": {"aimed": isoTime(when),
+                                             "expected": None},
+                "departure": {"aimed": isoTime(when),
+                              "expected": None if delay is None else
+                              isoTime(when + delay)},
+                "status": None if delay is None else
+                ("ontime" if abs(delay) < 120 else
+                 "delayed" if delay > 0 else "early"),
+                "monitored": delay is not None, "wheelchair_accessible": True,
+                "trip_id": tid})
+        predictions[stop_id] = {"farezone": "1", "closed": False,
+                                "departures": deps}
+    return {"feed_info": [feedinfo], "vehiclepositions": positions,
+            "tripupdates": updates, "servicealerts": alerts,
+            "stop-predictions": predictions}
+
+
+if __name__ == "__main__":
+    outdir = sys.argv[1]
+    sizes = [int(a) for a in sys.argv[2:7]]
+    nstops, nroutes, tripsper, days, seed = sizes + [3000, 120, 60, 60, 1][
+        len(sizes):]
+    rnd = random.Random(seed)
+    files, feedinfo, stops, routes, trips, stop_times = makeFeed(
+        nstops, nroutes, tripsper, days, rnd)
+    os.makedirs(outdir, exist_ok=True)
+    with zipfile.ZipFile(os.path.join(outdir, "GTFS_full.zip"), "w",
+                         zipfile.ZIP_DEFLATED) as zf:
+        for name, text in files.items():
+            zf.writestr(zipfile.ZipInfo(name, (2026, 10, 1, 0, 0, 0)), text,
+                        zipfile.ZIP_DEFLATED)
+    for name, fixture in makeFixtures(feedinfo, stops, routes, trips,
+                                      stop_times, rnd).items():
+        with open(os.path.join(outdir, name + ".json"), "w") as f:
+            json.dump(fixture, f)
+    print("{}: {} stops, {} routes, {} trips, {} stop times".format(
+        outdir, len(stops), nroutes, len(trips), len(stop_times)))
@@ -0,0 +1,123 @@
+"""Memory accounting for rti.py, from a running server or offline.
+
+Prints the deep size of each dataset structure and live store, with a
+column for each report taken after a dataset load so growth across
+reloads stands out. With --trace, prints a tracemalloc diff around a
+dataset reload or one timetable render instead.
+
+A server is asked through /admin/memory, with the token in
+RTI_ADMIN_TOKEN. --offline loads a fixture directory (as written by
+bench/makegtfs.py) in this process instead, reloading it --reloads
+times first.
+
+usage: python bench/memory.py http://127.0.0.1:5000
+           [--trace reload|render] [--route 1] [--date 2026-10-08]
+           [--all-stops] [--top 25]
+       python bench/memory.py --offline datadir [--reloads 2] [--trace ...]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import requests
+
+
+def printReport(current, history):
+    reports = history + [current]
+    print("{:24s}".format("bytes") + "".join(
+        "{:>14s}".format("load {}".format(report["loads"]) if
+                         report.get("trigger") == "load" else "now")
+        for report in reports))
+    for section in ("dataset", "live"):
+        names = sorted(current[section], key=lambda name:
+                       -current[section][name])
+        for name in names + [section + "_bytes"]:
+            print("{:24s}".format(name) + "".join("{:>14,d}".format(
+                report[section].get(name, 0) if name in current[section]
+                else report[name]) for report in reports))
+    for name, value in sorted(current["process"].items()):
+        print("{:24s}{:>14,d}".format(name, value))
+    print("feed_version {}, measured in {:.2f}s".format(
+        current["feed_version"], current["seconds"]))
+
+
+def printTrace(trace):
+    print("{} took {:.2f}s, peak {:,d} bytes, net {:+,d} bytes".format(
+        trace["what"], trace["seconds"], trace["peak_bytes"],
+        trace["net_bytes"]))
+    for row in trace["top"]:
+        print("{:>+14,d} {:>+9d}  {}".format(row["size_diff"],
+                                             row["count_diff"], row["where"]))
+
+
+def offline(args):
+    from offline import importRti
+    from suite import fixtureHandler
+    datadir = os.path.abspath(args.offline)
+    handler, predicted = fixtureHandler(datadir)
+    workdir = tempfile.mkdtemp(prefix="rti-bench-")
+    shutil.copy(os.path.join(datadir, "GTFS_full.zip"), workdir)
+    rti = importRti(handler, workdir)
+    if "feed_version" not in rti.data.zipinfo:
+        sys.exit("Could not load {}".format(datadir))
+    # Each load's report is taken in the background once its prerender is
+    # done, and only while it is still the current dataset
+    for i in range(0, args.reloads + 1):
+        while len(rti.memhistory) < min(i + 1, rti.MEMORY_HISTORY):
+            time.sleep(0.1)
+        if i < args.reloads:
+            rti.loadZipDataset()
+    client = rti.app.test_client()
+    rti.ADMIN_TOKEN = "offline"
+    return client, {"Authorization": "Bearer offline"}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report rti memory use")
+    parser.add_argument("baseurl", nargs="?")
+    parser.add_argument("--offline", metavar="datadir", default=None)
+    parser.add_argument("--reloads", type=int, default=1)
+    parser.add_argument("--trace", choices=("reload", "render"), default=None)
+    parser.add_argument("--route", default=None)
+    parser.add_argument("--date", default=None)
+    parser.add_argument("--all-stops", action="store_true")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    if args.offline is not None:
+        client, headers = offline(args)
+        get, post = client.get, client.post
+    elif args.baseurl is not None:
+        session = requests.Session()
+        headers = {"Authorization": "Bearer {}".format(
+            os.environ.get("RTI_ADMIN_TOKEN", ""))}
+        base = args.baseurl.rstrip("/")
+        get = lambda path, **kw: session.get(base + path, timeout=600, **kw)
+        post = lambda path, **kw: session.post(base + path, timeout=600, **kw)
+    else:
+        parser.error("give a baseurl or --offline datadir")
+    if args.trace is None:
+        resp = get("/admin/memory", headers=headers)
+    else:
+        params = {"what": args.trace, "top": args.top}
+        if args.route is not None:
+            params["route"] = args.route
+        if args.date is not None:
+            params["date"] = args.date
+        if args.all_stops:
+            params["stops"] = "all"
+        if args.offline is not None:
+            resp = post("/admin/memory/trace", query_string=params,
+                        headers=headers)
+        else:
+            resp = post("/admin/memory/trace", params=params, headers=headers)
+    if resp.status_code != 200:
+        sys.exit("{}: {}".format(resp.status_code, resp.get_data(
+            as_text=True) if args.offline is not None else resp.text))
+    answer = resp.get_json() if args.offline is not None else resp.json()
+    if args.trace is None:
+        printReport(answer["current"], answer["history"])
+    else:
+        printTrace(answer)
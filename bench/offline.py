@@ -0,0 +1,50 @@
+"""Import rti.py without network access or a Metlink API key.
+
+rti.py reads api.key and polls Metlink at import time. importRti() runs
+the import in a working directory of its own, with every upstream
+request answered by a handler instead of the network.
+"""
+import os
+import sys
+import tempfile
+
+import requests
+
+repodir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def response(url, status=200, content=b""):
+    resp = requests.Response()
+    resp.url = url
+    resp.status_code = status
+    resp._content = content
+    resp._content_consumed = True
+    return resp
+
+
+def importRti(handler=None, workdir=None):
+    """Import rti with handler(url, params) answering upstream calls.
+
+    The handler returns (status, content bytes), or None for a 404. The
+    working directory (a fresh temporary one by default) is where
+    api.key, GTFS_full.zip and the snapshot are looked for. Returns once
+    rti's background warm-up has tried loading everything.
+    """
+    def request(session, method, url, params=None, **kwargs):
+        answer = handler(url, params) if handler is not None else None
+        if answer is None:
+            return response(url, 404)
+        return response(url, *answer)
+
+    requests.sessions.Session.request = request
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="rti-bench-")
+    os.chdir(workdir)
+    if not os.path.exists("api.key"):
+        with open("api.key", "w") as f:
+            f.write("offline")
+    if repodir not in sys.path:
+        sys.path.insert(0, repodir)
+    import rti
+    rti.warmedup.wait()
+    return rti
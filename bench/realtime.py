@@ -0,0 +1,88 @@
+"""Compare JSON and protobuf ingestion of the GTFS-RT feeds.
+
+Parses the fixtures in bench/fixtures (see makefixtures.py) with both
+decoders, checks they give the same records and reports median parse
+time and tracemalloc peak memory for each. Needs gtfs-realtime-bindings.
+
+usage: python bench/realtime.py [repeats]
+"""
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from offline import importRti
+
+fixturedir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "fixtures")
+
+
+def sameRecords(a, b):
+    # Protobuf positions are float32, so compare floats loosely
+    if isinstance(a, float) or isinstance(b, float):
+        return abs(a - b) < 1e-4
+    if isinstance(a, dict):
+        return (isinstance(b, dict) and a.keys() == b.keys() and
+                all(sameRecords(a[k], b[k]) for k in a))
+    if isinstance(a, (list, tuple)):
+        return (len(a) == len(b) and
+                all(sameRecords(x, y) for x, y in zip(a, b)))
+    return a == b
+
+
+def measure(parse, raw, repeats):
+    times = []
+    for i in range(0, repeats):
+        starttime = time.perf_counter()
+        parse(raw)
+        times.append(time.perf_counter() - starttime)
+    tracemalloc.start()
+    parse(raw)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rti = importRti()
+    if rti.gtfs_realtime_pb2 is None:
+        sys.exit("gtfs-realtime-bindings is not installed")
+    ds = rti.data
+
+    def fromProto(parse):
+        def decode(raw):
+            feed = rti.gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(raw)
+            return parse(feed)
+        return decode
+
+    feeds = [
+        ("vehiclepositions", lambda raw: rti.positionsFromJson(json.loads(raw)),
+         fromProto(rti.positionsFromProto)),
+        ("tripupdates", lambda raw: rti.tripUpdatesFromJson(json.loads(raw)),
+         fromProto(rti.tripUpdatesFromProto)),
+        ("servicealerts",
+         lambda raw: rti.alertsFromJson(ds, json.loads(raw)),
+         fromProto(lambda feed: rti.alertsFromProto(ds, feed)))
+    ]
+    print("{:18s} {:>6s} {:>10s} {:>10s} {:>10s}".format(
+        "feed", "mode", "bytes", "parse ms", "peak KB"))
+    for name, fromjson, fromproto in feeds:
+        records = []
+        for mode, parse in (("json", fromjson), ("pb", fromproto)):
+            ext = ".json" if mode == "json" else ".pb"
+            with open(os.path.join(fixturedir, name + ext), "rb") as f:
+                raw = f.read()
+            parsed, peak = measure(parse, raw, repeats)
+            records.append(parse(raw))
+            print("{:18s} {:>6s} {:>10d} {:>10.2f} {:>10.1f}".format(
+                name, mode, len(raw), parsed * 1000, peak / 1024))
+        if name == "servicealerts":
+            # The per-alert timestamp only exists in Metlink's JSON
+            for alert in records[0]:
+                alert["timestamp"] = None
+        if not sameRecords(records[0], records[1]):
+            print("{}: JSON and protobuf records differ".format(name))
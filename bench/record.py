@@ -0,0 +1,54 @@
+"""Record real Metlink responses as fixtures for bench/suite.py.
+
+Saves the GTFS zip, feed_info, the three GTFS-RT feeds (JSON) and
+stop-predictions for the given stops into outdir, in the layout
+bench/makegtfs.py writes. Reads the API key from api.key in the
+current directory.
+
+usage: python bench/record.py outdir stop [stop ...]
+"""
+import json
+import os
+import sys
+
+import requests
+
+apiurl = "https://api.opendata.metlink.org.nz/v1/"
+feeds = {"feed_info": "gtfs/feed_info",
+         "vehiclepositions": "gtfs-rt/vehiclepositions",
+         "tripupdates": "gtfs-rt/tripupdates",
+         "servicealerts": "gtfs-rt/servicealerts"}
+zipurl = "https://static.opendata.metlink.org.nz/v1/gtfs/full.zip"
+
+
+if __name__ == "__main__":
+    outdir = sys.argv[1]
+    stops = sys.argv[2:]
+    with open("api.key") as f:
+        apikey = f.read().strip()
+    session = requests.Session()
+    session.headers.update({"accept": "application/json",
+                            "x-api-key": apikey})
+    os.makedirs(outdir, exist_ok=True)
+    for name, path in feeds.items():
+        req = session.get(apiurl + path, timeout=20)
+        req.raise_for_status()
+        with open(os.path.join(outdir, name + ".json"), "wb") as f:
+            f.write(req.content)
+        print("{}: {} bytes".format(name, len(req.content)))
+    predictions = {}
+    for stop in stops:
+        req = session.get(apiurl + "stop-predictions",
+                          params={"stop_id": stop}, timeout=20)
+        if req.status_code == 200:
+            predictions[stop] = req.json()
+        else:
+            print("stop {}: {}".format(stop, req.status_code))
+    with open(os.path.join(outdir, "stop-predictions.json"), "w") as f:
+        json.dump(predictions, f)
+    print("stop-predictions: {} stops".format(len(predictions)))
+    req = requests.get(zipurl, timeout=60)
+    req.raise_for_status()
+    with open(os.path.join(outdir, "GTFS_full.zip"), "wb") as f:
+        f.write(req.content)
+    print("GTFS_full.zip: {} bytes".format(len(req.content)))
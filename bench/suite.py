@@ -0,0 +1,259 @@
+"""Offline benchmark suite for rti.py's hot paths.
+
+Replays a directory of upstream fixtures, either synthetic ones from
+bench/makegtfs.py or real ones saved by bench/record.py, and times
+dataset loading, timetable rendering, the search, nearby, route, stop
+and vehicles pages and the alerts refresh. Pages are requested through
+Flask's test client over a fixed sample of stops, routes and queries.
+
+Results go to a JSON file (results-<commit>.json in the fixture
+directory by default). compare prints the change between two of those
+and exits non-zero if any median slowed by more than REGRESSION.
+
+usage: python bench/suite.py datadir [repeats] [out.json]
+       python bench/suite.py compare old.json new.json
+"""
+import datetime as dt
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import exists
+
+from offline import importRti, repodir
+
+REGRESSION = 0.10
+SAMPLES = 20
+LOAD_REPEATS = 3
+
+
+def fixtureHandler(datadir):
+    fixtures = {}
+    for name in ("feed_info", "vehiclepositions", "tripupdates",
+                 "servicealerts"):
+        path = os.path.join(datadir, name + ".json")
+        if exists(path):
+            with open(path, "rb") as f:
+                fixtures[name] = f.read()
+    predictions = {}
+    path = os.path.join(datadir, "stop-predictions.json")
+    if exists(path):
+        with open(path) as f:
+            predictions = json.load(f)
+    with open(os.path.join(datadir, "GTFS_full.zip"), "rb") as f:
+        fixtures["full.zip"] = f.read()
+
+    def handler(url, params):
+        if "stop-predictions" in url:
+            answer = predictions.get((params or {}).get("stop_id"))
+            if answer is None:
+                return None
+            return 200, json.dumps(answer).encode("utf-8")
+        for name, content in fixtures.items():
+            if name in url:
+                return 200, content
+        return None
+    return handler, sorted(predictions)
+
+
+def gitCommit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repodir,
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "rti.py"],
+                               cwd=repodir, capture_output=True, text=True,
+                               check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def summary(times):
+    times = sorted(times)
+    return {"calls": len(times),
+            "median_ms": statistics.median(times) * 1000,
+            "p90_ms": times[min(len(times) - 1, int(len(times) * 0.9))] * 1000,
+            "mean_ms": statistics.mean(times) * 1000,
+            "min_ms": times[0] * 1000}
+
+
+def timeCalls(func, items, repeats):
+    times = []
+    for i in range(0, repeats):
+        for item in items:
+            starttime = time.perf_counter()
+            func(item)
+            times.append(time.perf_counter() - starttime)
+    return summary(times)
+
+
+def waitPrerender(rti, previous):
+    while rti.timetables is previous or not rti.timetables.done:
+        time.sleep(0.1)
+
+
+def getPage(client, url):
+    resp = client.get(url)
+    if resp.status_code != 200:
+        raise RuntimeError("{} gave {}".format(url, resp.status_code))
+    return resp
+
+
+def runSuite(datadir, repeats):
+    handler, predicted = fixtureHandler(datadir)
+    workdir = tempfile.mkdtemp(prefix="rti-bench-")
+    shutil.copy(os.path.join(datadir, "GTFS_full.zip"), workdir)
+    rti = importRti(handler, workdir)
+    # No memory reports in the background of the timings
+    rti.MEMORY_HISTORY = 0
+    ds = rti.data
+    if "feed_version" not in ds.zipinfo:
+        sys.exit("Could not load {}".format(datadir))
+    waitPrerender(rti, None)
+    results = {}
+
+    def load(snapshot):
+        def run(item):
+            previous = rti.timetables
+            if not snapshot and exists(rti.snapshotfile):
+                os.remove(rti.snapshotfile)
+            starttime = time.perf_counter()
+            rti.loadZipDataset()
+            elapsed = time.perf_counter() - starttime
+            waitPrerender(rti, previous)
+            return elapsed
+        times = [run(None) for i in range(0, LOAD_REPEATS)]
+        return summary(times)
+    results["loadZipDataset (parse)"] = load(False)
+    results["loadZipDataset (snapshot)"] = load(True)
+    ds = rti.data
+    results["prerenderTimetables"] = timeCalls(rti.prerenderTimetables, [ds],
+                                               1)
+
+    rnd = random.Random(0)
+    stops = rnd.sample(sorted(ds.stopids), min(SAMPLES, len(ds.stopids)))
+    routes = rnd.sample(sorted(ds.routelist), min(SAMPLES, len(ds.routelist)))
+    names = [ds.stopinfo[ds.stopids[s]]["stop_name"] for s in stops]
+    queries = ([name.split()[0] for name in names[:SAMPLES // 4]] +
+               [" ".join(name.split()[:2]) for name in
+                names[SAMPLES // 4:SAMPLES // 2]] +
+               [name[:3] + name[4:] for name in names[SAMPLES // 2:]])
+    trips = rnd.sample(sorted(rti.trip_positions),
+                       min(SAMPLES, len(rti.trip_positions)))
+    trip_pages = ["{}/?trip={}".format(
+        ds.servroute[ds.trip_index[t]["route_id"]], t) for t in trips if t in
+        ds.trip_index]
+
+    # Route timetables a week into the feed, and the largest one
+    day = ds.cal_start + dt.timedelta(days=7)
+    route_days = []
+    for rquery in routes:
+        day_trips = rti.routeDayTrips(ds, ds.routelist[rquery], day)
+        route_days.append((rquery, [trip for trip in day_trips if
+                                    trip.get("direction_id") != "1"]))
+    largest = max(((rquery, [trip for trip in rti.routeDayTrips(
+        ds, ds.routelist[rquery], day) if trip.get("direction_id") != "1"])
+                   for rquery in ds.routelist), key=lambda rd: len(rd[1]))
+    with rti.app.test_request_context():
+        results["tripTimeTable"] = timeCalls(
+            lambda rd: rti.tripTimeTable(ds, rd[1], rd[0],
+                                         "outbound-timetable"),
+            route_days, repeats)
+        results["tripTimeTable (largest)"] = timeCalls(
+            lambda rd: rti.tripTimeTable(ds, rd[1], rd[0],
+                                         "outbound-timetable"),
+            [largest], repeats)
+
+    client = rti.app.test_client()
+    pages = [
+        ("stopsearch", "/search/?q={}", queries),
+        ("nearbyStops", "/stop/{}/nearby/", stops),
+        ("routeInfo", "/route/{}/", routes),
+        ("routeInfo (trip)", "/route/{}", trip_pages),
+        ("timetable (stop page)", "/stop/{}/", predicted[:SAMPLES]),
+        ("showAllVehicles", "/vehicles/", [None]),
+    ]
+    for name, pattern, items in pages:
+        if len(items) == 0:
+            continue
+        urls = [pattern.format(item) for item in items]
+        # One untimed pass to fill caches and check every page works
+        for url in urls:
+            getPage(client, url)
+        results[name] = timeCalls(lambda url: getPage(client, url), urls,
+                                  repeats)
+    results["updateAlerts"] = timeCalls(lambda item: rti.updateAlerts(True),
+                                        [None], repeats)
+    # /metrics has to keep working once an upstream call has failed outright
+    rti.upstream.record("positions", time.perf_counter(), 2, None)
+    results["showMetrics"] = timeCalls(lambda item: getPage(client,
+                                                            "/metrics"),
+                                       [None], repeats)
+
+    commit, dirty = gitCommit()
+    return {"commit": commit, "dirty": dirty,
+            "created": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(), "repeats": repeats,
+            "dataset": {"feed_version": ds.zipinfo["feed_version"],
+                        "stops": len(ds.stopinfo),
+                        "routes": len(ds.routelist),
+                        "trips": len(ds.trip_index),
+                        "stop_times": len(ds.trip_stop_times.time),
+                        "vehicles": len(rti.trip_positions),
+                        "alerts": len(rti.alertlist)},
+            "results": results}
+
+
+def compare(old, new):
+    print("{} -> {}".format(old["commit"][:10], new["commit"][:10]))
+    if old["dataset"] != new["dataset"]:
+        print("Warning: the runs used different datasets")
+    print("{:28s} {:>10s} {:>10s} {:>8s}".format("case", "old ms", "new ms",
+                                                  "change"))
+    regressed = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            print("{:28s} {:>10s} {:>10.3f}".format(name, "-",
+                                                    result["median_ms"]))
+            continue
+        before = old["results"][name]["median_ms"]
+        change = result["median_ms"] / before - 1 if before > 0 else 0
+        flag = ""
+        if change > REGRESSION:
+            flag = " slower"
+            regressed.append(name)
+        print("{:28s} {:>10.3f} {:>10.3f} {:>+7.1f}%{}".format(
+            name, before, result["median_ms"], change * 100, flag))
+    return regressed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        with open(sys.argv[2]) as f:
+            old = json.load(f)
+        with open(sys.argv[3]) as f:
+            new = json.load(f)
+        sys.exit(1 if len(compare(old, new)) > 0 else 0)
+    datadir = os.path.abspath(sys.argv[1])
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    report = runSuite(datadir, repeats)
+    outfile = (os.path.abspath(sys.argv[3]) if len(sys.argv) > 3 else
+               os.path.join(datadir, "results-{}{}.json".format(
+                   report["commit"][:10], "-dirty" if report["dirty"] else
+                   "")))
+    with open(outfile, "w") as f:
+        json.dump(report, f, indent=1)
+    print("{:28s} {:>8s} {:>10s} {:>10s}".format("case", "calls", "median ms",
+                                                  "p90 ms"))
+    for name, result in report["results"].items():
+        print("{:28s} {:>8d} {:>10.3f} {:>10.3f}".format(
+            name, result["calls"], result["median_ms"], result["p90_ms"]))
+    print("Wrote {}".format(outfile))
@@ -0,0 +1,173 @@
+"""Compare the table renderers in rti.py with flask_table.
+
+Loads a GTFS zip offline, then renders the largest route timetable (the
+route and day with the most trip x stop cells, all stops) and a vehicles
+page with a position for every trip running at midday. Each is built
+with flask_table and with rti's own renderers; the markup must match.
+
+usage: python bench/tables.py GTFS_full.zip [vehicles] [repeats]
+"""
+import csv
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+from flask_table import Table, Col, LinkCol, create_table
+
+from offline import importRti
+
+
+class SelfAnchorCol(Col):
+    def td_contents(self, item, attr_list):
+        return "<a href='#{}'>{}</a>".format(
+            item["rowid"], attr_list["text"]
+        )
+
+
+class TimeTableBase(Table):
+    # The flask_table grid tripTimeTable used to build
+    stop_id = LinkCol("Code", "timetable",
+                      url_kwargs=dict(stop="sms"), attr='stop_id')
+    names = Col("Stop")
+    anch = SelfAnchorCol("sdf", attr_list=dict(text="§"),
+                         td_html_attrs={"class": "ac"})
+    zone = Col("Zone", td_html_attrs={"class": "centrecol"})
+
+    def get_tr_attrs(self, item):
+        tratts = {"id": item["rowid"]}
+        if item.get("atp"):
+            tratts.update({"class": "timepoint"})
+        return tratts
+
+
+def flaskTableTbody(ds, tableID, trip_ids, start_times, rows):
+    tt_dict = []
+    for stop_id, sind, pin, anytp, times in rows:
+        inf = ds.stopinfo[sind]
+        sms = (inf["parent_station"] if inf["parent_station"] != "" else
+               inf["stop_id"])
+        item = {"stop_id": sms, "sms": sms, "names": inf["stop_name"],
+                "zone": inf["zone_id"], "atp": anytp,
+                "rowid": "{}-stop-{}".format(tableID, sms) if pin == 0 else
+                "{}-stop-{}-{}".format(tableID, sms, pin)}
+        item.update(("time" + tid, time) for tid, time in
+                    zip(trip_ids, times))
+        tt_dict.append(item)
+    table_spec = create_table(base=TimeTableBase)
+    for trip in trip_ids:
+        table_spec = table_spec.add_column(
+            "time" + trip, Col(start_times.get(trip)[:5],
+                               td_html_attrs={"class": "tcol"}))
+    return table_spec(tt_dict).tbody()
+
+
+def zipRows(zf, name):
+    with io.TextIOWrapper(zf.open(name), encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def handlerFor(zpath, nvehicles):
+    with zipfile.ZipFile(zpath) as zf:
+        feedinfo = zipRows(zf, "feed_info.txt")[-1]
+        trips = zipRows(zf, "trips.txt")
+        stops = zipRows(zf, "stops.txt")
+    now = int(time.time())
+    step = max(1, len(trips) // nvehicles)
+    positions = {"header": {"timestamp": now}, "entity": [
+        {"id": str(i), "vehicle": {
+            "trip": {"trip_id": trip["trip_id"],
+                     "direction_id": int(trip["direction_id"]),
+                     "route_id": trip["route_id"],
+                     "start_time": "{:02d}:{:02d}:00".format(6 + i % 16,
+                                                             i % 60)},
+            "position": {"bearing": i % 360,
+                         "latitude": float(stops[i % len(stops)]["stop_lat"]),
+                         "longitude": float(stops[i % len(stops)]["stop_lon"]),
+                         "speed": 5},
+            "vehicle": {"id": str(2000 + i)},
+            "timestamp": now}}
+        for i, trip in enumerate(trips[::step][:nvehicles])]}
+    answers = {"feed_info": [{"feed_version": feedinfo["feed_version"],
+                              "feed_start_date": feedinfo["feed_start_date"],
+                              "feed_end_date": feedinfo["feed_end_date"]}],
+               "vehiclepositions": positions}
+
+    def handler(url, params):
+        for key, answer in answers.items():
+            if key in url:
+                return 200, json.dumps(answer).encode("utf-8")
+        return None
+    return handler
+
+
+def timed(render, repeats):
+    times = []
+    for i in range(0, repeats):
+        starttime = time.perf_counter()
+        out = render()
+        times.append(time.perf_counter() - starttime)
+    return out, statistics.median(times) * 1000
+
+
+if __name__ == "__main__":
+    zpath = sys.argv[1]
+    nvehicles = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    workdir = tempfile.mkdtemp(prefix="rti-bench-")
+    shutil.copy(zpath, os.path.join(workdir, "GTFS_full.zip"))
+    rti = importRti(handlerFor(zpath, nvehicles), workdir)
+    ds = rti.data
+    if "feed_version" not in ds.zipinfo:
+        sys.exit("Could not load {}".format(zpath))
+    print("Waiting for the timetable prerender to finish")
+    while not rti.timetables.done:
+        time.sleep(0.5)
+
+    best = None
+    for rquery, routeinfo in ds.routelist.items():
+        trips = [ds.trip_index[t] for t in
+                 ds.routetrips.get(routeinfo["route_id"], [])]
+        for offset in range(0, ds.cal_days, 7):
+            day = ds.cal_start + rti.dt.timedelta(days=offset)
+            day_trips = [trip for trip in trips if rti.runsOn(
+                ds, ds.trip_serv.get(trip["trip_id"]), day)]
+            size = sum(len(ds.trip_stop_times.stops(trip["trip_id"])) for
+                       trip in day_trips)
+            if best is None or size > best[0]:
+                best = (size, rquery, day, day_trips)
+    size, rquery, day, day_trips = best
+    grid = rti.timetableGrid(ds, day_trips, False)
+    print("Largest timetable: route {} on {}, {} trips x {} rows".format(
+        rquery, day, len(grid[0]), len(grid[2])))
+
+    print("{:28s} {:>12s} {:>12s} {:>8s} {:>10s}".format(
+        "render", "flask_table", "rti", "speedup", "bytes"))
+    with rti.app.test_request_context():
+        old, oldms = timed(lambda: flaskTableTbody(
+            ds, "outbound-timetable", *grid), repeats)
+        new, newms = timed(lambda: rti.timetableHtml(
+            ds, rquery, "outbound-timetable", *grid), repeats)
+        print("{:28s} {:>10.2f}ms {:>10.2f}ms {:>7.1f}x {:>10d}".format(
+            "timetable body", oldms, newms, oldms / newms, len(new)))
+        if old not in new:
+            print("timetable markup differs")
+
+    # Swap flask_table's tbody back in to render the same page the old way
+    client = rti.app.test_client()
+    pages = {}
+    fasttbody = rti.FastTable.tbody
+    for name, tbody in (("flask_table", Table.tbody), ("rti", fasttbody)):
+        rti.FastTable.tbody = tbody
+        pages[name] = timed(lambda: client.get("/vehicles/").data, repeats)
+    print("{:28s} {:>10.2f}ms {:>10.2f}ms {:>7.1f}x {:>10d}".format(
+        "/vehicles/ ({} vehicles)".format(len(rti.trip_positions)),
+        pages["flask_table"][1], pages["rti"][1],
+        pages["flask_table"][1] / pages["rti"][1], len(pages["rti"][0])))
+    if pages["flask_table"][0] != pages["rti"][0]:
+        print("vehicles markup differs")
@@ -1,26 +1,54 @@
-from flask import Flask, render_template, request, redirect, send_from_directory, url_for
+import time
+# Startup phases are timed from here
+importstart = time.perf_counter()
+from flask import Flask, render_template, request, redirect, send_from_directory, url_for, jsonify, g
 from flask_apscheduler import APScheduler
-from flask_table import Table, Col, LinkCol, create_table
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from flask_table import Table, Col, LinkCol
+from markupsafe import escape
 from dateutil.parser import isoparse
 from dateutil.tz import gettz
-from math import cos, atan, pi, sqrt, log10, floor
+from math import cos, atan, pi, sqrt, log10, floor, isfinite
 from os.path import exists
 from io import TextIOWrapper as textwrap
 from sys import getsizeof
-from functools import cmp_to_key
+from array import array
+from functools import lru_cache
+from bisect import bisect_left
 import zipfile
+import hashlib
+import mmap
+import pickle
+import os
+import stat
+import gc
+import hmac
+import types
+import tracemalloc
+import threading
+import heapq
+import zlib
+import gzip
+import random
 import datetime as dt
-import time
 import requests
 import re
 import csv
 from urllib.parse import quote
 from fuzzywuzzy import fuzz
-import pandas as pd
-from numpy import argsort
+from fuzzywuzzy import utils as fuzzutils
+import numpy as np
 from collections import Counter
-from flask_caching import Cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pprint import pprint
+try:
+    from google.transit import gtfs_realtime_pb2
+except ImportError:
+    gtfs_realtime_pb2 = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 depStatus = {
     "onTime": "On time",
@@ -42,44 +70,108 @@ Rm2 = (6371.009 * 1000)**2
 
 patz = gettz("Pacific/Auckland")
 
-depurl = "https://api.opendata.metlink.org.nz/v1/stop-predictions"
-stoplisturl = "https://api.opendata.metlink.org.nz/v1/gtfs/stops"
-routelisturl = "https://api.opendata.metlink.org.nz/v1/gtfs/routes"
-feedinfourl = "https://api.opendata.metlink.org.nz/v1/gtfs/feed_info"
-stoptimesurl = "https://api.opendata.metlink.org.nz/v1/gtfs/stop_times"
-alertsurl = "https://api.opendata.metlink.org.nz/v1/gtfs-rt/servicealerts"
-positionurl = "https://api.opendata.metlink.org.nz/v1/gtfs-rt/vehiclepositions"
-zipurl = "https://static.opendata.metlink.org.nz/v1/gtfs/full.zip"
-tripupdatesurl = "https://api.opendata.metlink.org.nz/v1/gtfs-rt/tripupdates"
+# Base URLs can be pointed elsewhere, e.g. at bench/fakemetlink.py
+apiurl = os.environ.get("RTI_API_URL",
+                        "https://api.opendata.metlink.org.nz/v1").rstrip("/")
+staticurl = os.environ.get(
+    "RTI_STATIC_URL", "https://static.opendata.metlink.org.nz/v1").rstrip("/")
+
+depurl = apiurl + "/stop-predictions"
+stoplisturl = apiurl + "/gtfs/stops"
+routelisturl = apiurl + "/gtfs/routes"
+feedinfourl = apiurl + "/gtfs/feed_info"
+stoptimesurl = apiurl + "/gtfs/stop_times"
+alertsurl = apiurl + "/gtfs-rt/servicealerts"
+positionurl = apiurl + "/gtfs-rt/vehiclepositions"
+zipurl = staticurl + "/gtfs/full.zip"
+tripupdatesurl = apiurl + "/gtfs-rt/tripupdates"
+
+# Upstream endpoints: URL, timeout in seconds, attempts, and whether the
+# API key is sent
+endpoints = {
+    "predictions": (depurl, 20, 2, True),
+    "feedinfo": (feedinfourl, 10, 3, True),
+    "alerts": (alertsurl, 10, 3, True),
+    "positions": (positionurl, 10, 3, True),
+    "tripupdates": (tripupdatesurl, 10, 3, True),
+    "zip": (zipurl, 10, 3, False)
+}
+# GTFS-RT feeds can be read as "json" or "protobuf"; protobuf needs the
+# gtfs-realtime-bindings package
+REALTIME_FORMAT = "json"
+if REALTIME_FORMAT == "protobuf" and gtfs_realtime_pb2 is None:
+    print("gtfs-realtime-bindings not installed, reading realtime feeds as JSON")
+
+# First retry waits up to this many seconds, doubling each time
+UPSTREAM_BACKOFF = 0.5
+
+snapshotfile = "GTFS_full.snapshot"
+# Bump whenever the parsed layout of the dataset changes
+SNAPSHOT_VERSION = 8
+
+# Threads used to prerender route timetables after each load
+PRERENDER_WORKERS = 4
+
+# Seconds stop predictions are served from cache, and for how much longer
+# a stale copy is served while a refresh runs in the background
+PREDICTION_TTL = 15
+PREDICTION_STALE = 45
+
+# Stop pages are answered from the local ETA index "only", as a "fallback"
+# when the upstream call fails or takes over PREDICTION_WAIT seconds, or
+# never ("off"). Local answers list up to LOCAL_DEPARTURES departures in
+# the next LOCAL_HORIZON seconds.
+LOCAL_PREDICTIONS = "fallback"
+PREDICTION_WAIT = 3
+LOCAL_DEPARTURES = 20
+LOCAL_HORIZON = 3 * 3600
+
+# Side of a StopGrid cell in degrees, about 550m north-south
+GRID_CELL = 0.005
+# Nearby searches look no further than this many metres
+NEARBY_MAX = 20000
+
+# "standalone" loads and polls in every process. Alternatively one "poller"
+# process publishes the dataset and live state under SHARED_DIR, and the
+# "worker" processes serving requests attach to it read-only
+RTI_ROLE = os.environ.get("RTI_ROLE", "standalone")
+if RTI_ROLE not in ("standalone", "poller", "worker"):
+    raise ValueError("Unknown RTI_ROLE {!r}".format(RTI_ROLE))
+SHARED_DIR = os.environ.get("RTI_SHARED_DIR", "/dev/shm/rti")
+# Seconds between a worker's checks for newly published state
+SHARED_CHECK = 1.0
+
+# Seconds between polls of each realtime feed, as scheduled below; live
+# pages may be cached by browsers until the next poll is due
+POLL_INTERVALS = {"positions": 60, "tripupdates": 120, "alerts": 300}
+# HTML and JSON responses at least this size are compressed when the client
+# accepts it; br needs the brotli package, gzip is the fallback
+COMPRESS_MIN = 512
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Upper bounds in seconds of the latency histogram buckets on /metrics
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                  2.5, 5, 10, 30, 60)
+# The /admin/ pages want "Authorization: Bearer <RTI_ADMIN_TOKEN>", and are
+# not served at all when it is unset
+ADMIN_TOKEN = os.environ.get("RTI_ADMIN_TOKEN")
+# Memory reports kept, one taken after each dataset load (0 to stop taking
+# them)
+MEMORY_HISTORY = 20
+# Seconds between attempts to load a first dataset when warm-up could not,
+# and the Retry-After given to requests answered "warming up" meanwhile
+WARMUP_RETRY = 60
+WARMUP_RETRY_AFTER = 5
 
 dayShort = {1: 'M', 2: 'Tu', 3: 'W', 4: 'Th', 5: 'F', 6: 'Sa', 7: 'Su'}
 directions = {"N": "North", "NE": "North East", "E": "East",
               "SE": "South East", "S": "South", "SW": "South West",
               "W": "West", "NW": "North West"}
 
-stopinfo = []
-stopids = {}
 feedinfo = {}
-zipinfo = {}
-stopnames = {}
-routelist = {}
-servroute = {}
-triplist = []
-alltrips = []
 alertlist = []
-routetrips = {}
-trip_serv = {}
-caldates = {}
-agencies = {}
-trip_seq = {}
-trip_dir = {}
-trip_stop_times = {}
 trip_positions = {}
 trip_updates = {}
-trip_sid = {}
-stop_patterns = {}
-stoplastupdate = dt.datetime.now(patz) - dt.timedelta(days=14)
-routeslastupdate = dt.datetime.now(patz) - dt.timedelta(days=14)
 alertslastupdate = dt.datetime.now(patz) - dt.timedelta(seconds=60*20)
 positionlastupdate = dt.datetime.now(patz) - dt.timedelta(seconds=60*20)
 
@@ -98,6 +190,12 @@ def dictget(obj, levels, replace=None, replace_present=False):
     return t_obj
 
 
+@lru_cache(maxsize=4096)
+def localTime(timestamp):
+    # Realtime feeds repeat the same few timestamps for many entities
+    return dt.datetime.fromtimestamp(timestamp, patz)
+
+
 def servfromtrip(trip_id, ag_ids):
     for ag in ag_ids:
         agpos = trip_id.find("__" + ag + "__")
@@ -117,39 +215,784 @@ def servfromtrip(trip_id, ag_ids):
     return None
 
 
+def timeToSecs(tstr):
+    if tstr == "":
+        return -1
+    h, m, s = tstr.split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def secsToTime(secs):
+    if secs < 0:
+        return ""
+    return "{:02d}:{:02d}:{:02d}".format(secs // 3600, secs // 60 % 60,
+                                         secs % 60)
+
+
+class StopTimeStore:
+    # stop_times.txt as column arrays; trip i owns offsets[i]:offsets[i + 1]
+
+    def __init__(self):
+        self.trip_index = {}
+        self.stop_ids = []
+        self._stop_refs = {}
+        self._rtrip = array("i")
+        self._rstop = array("i")
+        self._rsind = array("i")
+        self._rtime = array("i")
+        self._rseq = array("i")
+        self._rtp = array("b")
+
+    def append(self, trip_id, stop_id, departure_time, stop_sequence,
+               timepoint, sind):
+        tind = self.trip_index.setdefault(trip_id, len(self.trip_index))
+        sref = self._stop_refs.get(stop_id)
+        if sref is None:
+            sref = self._stop_refs[stop_id] = len(self.stop_ids)
+            self.stop_ids.append(stop_id)
+        self._rtrip.append(tind)
+        self._rstop.append(sref)
+        self._rsind.append(-1 if sind is None else sind)
+        self._rtime.append(timeToSecs(departure_time))
+        self._rseq.append(int(stop_sequence))
+        self._rtp.append(timepoint)
+
+    def finish(self, nstops):
+        # Stable sort keeps file order within each trip
+        rtrip = np.frombuffer(self._rtrip, dtype=np.int32)
+        order = np.argsort(rtrip, kind="stable")
+        self.trip_ids = list(self.trip_index)
+        self.trip = rtrip[order]
+        self.stop_ref = np.frombuffer(self._rstop, dtype=np.int32)[order]
+        self.sind = np.frombuffer(self._rsind, dtype=np.int32)[order]
+        self.time = np.frombuffer(self._rtime, dtype=np.int32)[order]
+        self.seq = np.frombuffer(self._rseq, dtype=np.int32)[order]
+        self.tp = np.frombuffer(self._rtp, dtype=np.bool_)[order]
+        self.offsets = np.zeros(len(self.trip_index) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rtrip, minlength=len(self.trip_index)),
+                  out=self.offsets[1:])
+        departs = (self.sind >= 0) & (self.time >= 0)
+        departs[self.offsets[1:][self.offsets[1:] > self.offsets[:-1]] - 1] = \
+            False
+        rows = np.flatnonzero(departs)
+        self.stop_rows = rows[np.lexsort((self.time[rows], self.sind[rows]))]
+        self.stop_offsets = np.zeros(nstops + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.sind[self.stop_rows], minlength=nstops),
+                  out=self.stop_offsets[1:])
+        del self._rtrip, self._rstop, self._rsind, self._rtime, self._rseq
+        del self._rtp, self._stop_refs
+
+    def __len__(self):
+        return len(self.trip_index)
+
+    def __contains__(self, trip_id):
+        return trip_id in self.trip_index
+
+    def span(self, trip_id):
+        tind = self.trip_index[trip_id]
+        return int(self.offsets[tind]), int(self.offsets[tind + 1])
+
+    def stops(self, trip_id):
+        start, end = self.span(trip_id)
+        return [{"id": self.stop_ids[ref],
+                 "time": secsToTime(secs),
+                 "tp": tp,
+                 "seq": seq,
+                 "sind": None if sind < 0 else sind}
+                for ref, secs, tp, seq, sind in zip(
+                    self.stop_ref[start:end].tolist(),
+                    self.time[start:end].tolist(),
+                    self.tp[start:end].tolist(),
+                    self.seq[start:end].tolist(),
+                    self.sind[start:end].tolist())]
+
+    def first_time(self, trip_id):
+        return secsToTime(int(self.time[self.offsets[
+            self.trip_index[trip_id]]]))
+
+    def departures(self, sind, start, end):
+        # (trip_id, time) for each departure from sind in [start, end)
+        rows = self.stop_rows[self.stop_offsets[sind]:
+                              self.stop_offsets[sind + 1]]
+        times = self.time[rows]
+        lo, hi = np.searchsorted(times, [start, end])
+        return list(zip([self.trip_ids[tind] for tind in
+                         self.trip[rows[lo:hi]].tolist()],
+                        times[lo:hi].tolist()))
+
+    def nbytes(self):
+        return sum(a.nbytes for a in [self.stop_ref, self.sind, self.time,
+                                      self.seq, self.tp, self.offsets,
+                                      self.trip, self.stop_rows,
+                                      self.stop_offsets])
+
+
+def searchTokens(text):
+    # Same normalisation as fuzz.token_set_ratio() applies internally
+    return sorted(set(fuzzutils.full_process(text.lower(),
+                                             force_ascii=True).split()))
+
+
+def charCounts(text):
+    # Folding characters into 128 buckets can only overcount what two
+    # strings have in common, so the search bounds stay valid
+    return np.bincount(np.array([ord(char) % 128 for char in text],
+                                dtype=np.int64), minlength=128)
+
+
+class StopSearchIndex:
+    # Bounds fuzz.token_set_ratio() per name to skip hopeless ones
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.lengths = np.zeros(len(self.names), dtype=np.int32)
+        self.counts = np.zeros((len(self.names), 128), dtype=np.uint8)
+        postings = {}
+        for ind, name in enumerate(self.names):
+            tokens = searchTokens(name)
+            self.lengths[ind] = len(" ".join(tokens))
+            self.counts[ind] = charCounts(" ".join(tokens))
+            for token in tokens:
+                postings.setdefault(token, []).append(ind)
+        self.postings = {token: np.array(inds, dtype=np.int32) for token, inds
+                         in postings.items()}
+
+    def bounds(self, qtokens):
+        qlen = len(" ".join(qtokens))
+        shared = np.zeros(len(self.names), dtype=np.int32)
+        nshared = np.zeros(len(self.names), dtype=np.int32)
+        for token in qtokens:
+            if token in self.postings:
+                shared[self.postings[token]] += len(token)
+                nshared[self.postings[token]] += 1
+        shared += np.maximum(nshared - 1, 0)
+        common = np.minimum(self.counts, charCounts(" ".join(qtokens))).sum(
+            axis=1)
+        sectratio = np.divide(2 * shared, shared + np.minimum(self.lengths,
+                                                              qlen),
+                              out=np.zeros(len(self.names)),
+                              where=shared > 0)
+        fullratio = 2 * common / (self.lengths + qlen)
+        # Rounded up with some slack so that the bound is never below the
+        # score fuzzywuzzy rounds to
+        return np.ceil(100 * np.maximum(sectratio, fullratio) + 1e-6)
+
+    def search(self, query, limit=20, cutoff=40):
+        qlower = query.lower()
+        qtokens = searchTokens(qlower)
+        if len(qtokens) == 0 or len(self.names) == 0:
+            return []
+        bound = self.bounds(qtokens)
+        cands = np.nonzero(bound > cutoff)[0]
+        cands = cands[np.argsort(-bound[cands], kind="stable")]
+        ranked = []
+        topscores = []
+        for ind in cands.tolist():
+            if len(topscores) == limit and bound[ind] < topscores[0]:
+                break
+            score = fuzz.token_set_ratio(self.names[ind].lower(), qlower)
+            if score <= cutoff:
+                continue
+            ranked.append((ind, score))
+            if len(topscores) < limit:
+                heapq.heappush(topscores, score)
+            elif score > topscores[0]:
+                heapq.heapreplace(topscores, score)
+        ranked.sort(key=lambda a: (-a[1], a[0]))
+        return [(self.names[ind], score) for ind, score in ranked[:limit]]
+
+
+def planeDistance2(lat1, lon1, lat2, lon2):
+    rlat1 = pi/180 * lat1
+    rlon1 = pi/180 * lon1
+    rlat2 = pi/180 * lat2
+    rlon2 = pi/180 * lon2
+    pm = (rlat1 + rlat2)/2
+    dlat = rlat1 - rlat2
+    dlon = rlon1 - rlon2
+    return Rm2 * (dlat**2 + (cos(pm) * dlon)**2)
+
+
+def planeDistance2Array(lat, lon, lats, lons):
+    rlat1 = pi/180 * lat
+    rlon1 = pi/180 * lon
+    rlat2 = pi/180 * lats
+    rlon2 = pi/180 * lons
+    pm = (rlat1 + rlat2)/2
+    return Rm2 * ((rlat1 - rlat2)**2 + (np.cos(pm) * (rlon1 - rlon2))**2)
+
+
+def headingdeg(bearing):
+    br = bearing % 360
+    if br < 45*0.5:
+        return "N"
+    if br < 45*1.5:
+        return "NE"
+    if br < 45 * 2.5:
+        return "E"
+    if br < 45 * 3.5:
+        return "SE"
+    if br < 45 * 4.5:
+        return "S"
+    if br < 45 * 5.5:
+        return "SW"
+    if br < 45 * 6.5:
+        return "W"
+    if br < 45 * 7.5:
+        return "NW"
+    return "N"
+
+
+def heading(dlat, dlon):
+    if dlon == 0:
+        if dlat > 0:
+            return "N"
+        else:
+            return "S"
+    adeg = atan(dlat / dlon) * 180 / pi
+    if dlon > 0:
+        if adeg > 45*1.5:
+            return "N"
+        if adeg > 45*0.5:
+            return "NE"
+        if adeg > -45*0.5:
+            return "E"
+        if adeg > -45*1.5:
+            return "SE"
+        return "S"
+    else:
+        if adeg > 45*1.5:
+            return "S"
+        if adeg > 45*0.5:
+            return "SW"
+        if adeg > -45*0.5:
+            return "W"
+        if adeg > -45*1.5:
+            return "NW"
+        return "N"
+
+
+class StopGrid:
+    # Lat/lon grid of stops, searched in rings of cells outwards
+
+    def __init__(self, lats, lons, cell=GRID_CELL):
+        self.cell = cell
+        self.lats = np.array(lats, dtype=np.float64)
+        self.lons = np.array(lons, dtype=np.float64)
+        self.cells = {}
+        if len(self.lats) == 0:
+            return
+        ci = np.floor(self.lats / cell).astype(np.int64)
+        cj = np.floor(self.lons / cell).astype(np.int64)
+        self.extent = (ci.min(), ci.max(), cj.min(), cj.max())
+        order = np.lexsort((np.arange(len(ci)), cj, ci))
+        bounds = np.nonzero(np.diff(ci[order]) | np.diff(cj[order]))[0] + 1
+        for inds in np.split(order, bounds):
+            self.cells[(int(ci[inds[0]]), int(cj[inds[0]]))] = np.sort(inds)
+
+    def ring(self, ci, cj, r):
+        for di in range(-r, r + 1):
+            step = 1 if abs(di) == r else 2 * r
+            for dj in range(-r, r + 1, max(step, 1)):
+                if (ci + di, cj + dj) in self.cells:
+                    yield self.cells[(ci + di, cj + dj)]
+
+    def extentDistance2(self, lat, lon):
+        # Squared distance to the nearest point of the grid's cells
+        imin, imax, jmin, jmax = self.extent
+        return planeDistance2(lat, lon, min(max(lat, imin * self.cell),
+                                            (imax + 1) * self.cell),
+                              min(max(lon, jmin * self.cell),
+                                  (jmax + 1) * self.cell))
+
+    def search(self, lat, lon, k=None, radius=None, exclude=None,
+               mindist2=0):
+        # The ring count is bounded by radius, at most NEARBY_MAX
+        radius = NEARBY_MAX if radius is None else min(radius, NEARBY_MAX)
+        if (len(self.cells) == 0 or
+                self.extentDistance2(lat, lon) > radius**2):
+            return [], []
+        ci = int(floor(lat / self.cell))
+        cj = int(floor(lon / self.cell))
+        imin, imax, jmin, jmax = self.extent
+        lastring = max(ci - imin, imax - ci, cj - jmin, jmax - cj, 0)
+        found = []
+        for r in range(0, lastring + 1):
+            found.extend(self.ring(ci, cj, r))
+            if r == lastring:
+                break
+            # Anything outside this ring is at least r cells away
+            reach = r * self.cell * pi/180 * cos(min(abs(lat) + (r + 1) *
+                                                     self.cell, 89) * pi/180)
+            reach2 = Rm2 * reach**2
+            if radius**2 <= reach2:
+                break
+            if k is not None and len(found) > 0:
+                inds = np.concatenate(found)
+                d2 = planeDistance2Array(lat, lon, self.lats[inds],
+                                         self.lons[inds])
+                keep = d2 >= mindist2
+                if exclude is not None:
+                    keep &= inds != exclude
+                if keep.sum() >= k and np.sort(d2[keep])[k - 1] <= reach2:
+                    break
+        if len(found) == 0:
+            return [], []
+        inds = np.concatenate(found)
+        d2 = planeDistance2Array(lat, lon, self.lats[inds], self.lons[inds])
+        keep = d2 >= mindist2
+        if exclude is not None:
+            keep &= inds != exclude
+        keep &= d2 <= radius**2
+        inds, d2 = inds[keep], d2[keep]
+        order = np.lexsort((inds, d2))[:k]
+        return inds[order].tolist(), d2[order].tolist()
+
+
+class Dataset:
+    # One generation of the GTFS data, never modified once published
+
+    def __init__(self):
+        self.loaded = dt.datetime.now(patz) - dt.timedelta(days=14)
+        self.zipinfo = {}
+        self.agencies = {}
+        self.stopinfo = []
+        self.stopids = {}
+        self.stopnames = {}
+        self.stopsearch = StopSearchIndex([])
+        self.stopgrid = StopGrid([], [])
+        self.routelist = {}
+        self.servroute = {}
+        self.triplist = []
+        self.alltrips = set()
+        # trip_id -> trips.txt row, route_id -> [trip_id], and
+        # route_id -> [stop_pattern_id] in order of first appearance
+        self.trip_index = {}
+        self.routetrips = {}
+        self.route_patterns = {}
+        self.trip_serv = {}
+        self.trip_seq = {}
+        self.trip_dir = {}
+        self.trip_sid = {}
+        self.trip_stop_times = StopTimeStore()
+        # Service calendar: day offsets count from cal_start, serv_days
+        # holds a bitset of offsets per service_id, day_services a bitset
+        # of positions in serv_ids per offset, and route_adjacent a
+        # (previous, next) service-day array pair per route_id
+        self.cal_start = dt.date.today()
+        self.cal_days = 0
+        self.serv_ids = []
+        self.serv_days = {}
+        self.day_services = []
+        self.route_adjacent = {}
+        self.stop_patterns = {}
+
+
+data = Dataset()
+reloadlock = threading.Lock()
+loadstats = {"loads": 0, "seconds": 0.0}
+
+
+def adjacentDays(bits, ndays):
+    # Entry j describes day offset j - 1, so that offsets before and after
+    # the calendar (clamped to -1 and ndays) need no special casing
+    prevs = np.full(ndays + 2, -1, dtype=np.int16)
+    nexts = np.full(ndays + 2, -1, dtype=np.int16)
+    last = -1
+    for j in range(0, ndays + 2):
+        prevs[j] = last
+        if 1 <= j <= ndays and bits >> (j - 1) & 1:
+            last = j - 1
+    last = -1
+    for j in range(ndays + 1, -1, -1):
+        nexts[j] = last
+        if 1 <= j <= ndays and bits >> (j - 1) & 1:
+            last = j - 1
+    return prevs, nexts
+
+
+def runsOn(ds, service_id, date):
+    offset = (date - ds.cal_start).days
+    return offset >= 0 and ds.serv_days.get(service_id, 0) >> offset & 1 == 1
+
+
+def activeServices(ds, date):
+    offset = (date - ds.cal_start).days
+    if not 0 <= offset < ds.cal_days:
+        return []
+    bits = ds.day_services[offset]
+    return [service_id for sind, service_id in enumerate(ds.serv_ids) if
+            bits >> sind & 1]
+
+
+def adjacentServiceDates(ds, route_id, date):
+    if route_id not in ds.route_adjacent:
+        return None, None
+    prevs, nexts = ds.route_adjacent[route_id]
+    j = min(max((date - ds.cal_start).days, -1), ds.cal_days) + 1
+    return tuple(None if offset < 0 else
+                 ds.cal_start + dt.timedelta(days=int(offset))
+                 for offset in (prevs[j], nexts[j]))
+
+
+def serviceDates(ds, service_id):
+    bits = ds.serv_days.get(service_id)
+    if bits is None:
+        return None
+    start = dt.datetime.combine(ds.cal_start, dt.time())
+    return [start + dt.timedelta(days=offset) for offset in
+            range(0, bits.bit_length()) if bits >> offset & 1]
+
+
+def metricLabels(names, values):
+    return ",".join('{}="{}"'.format(name, str(value).replace(
+        "\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for
+        name, value in zip(names, values))
+
+
+def metricLine(name, labels, value):
+    return "{}{{{}}} {}".format(name, labels, value) if labels else \
+        "{} {}".format(name, value)
+
+
+def seriesOrder(item):
+    # Label values can mix types, e.g. status codes and "error"
+    return tuple(str(value) for value in item[0])
+
+
+class Histogram:
+    # Buckets are only made cumulative when rendered
+
+    def __init__(self, name, doc, labels, buckets=METRIC_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, key, value):
+        slot = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.series.get(key)
+            if entry is None:
+                entry = self.series[key] = [[0] * (len(self.buckets) + 1),
+                                            0.0]
+            entry[0][slot] += 1
+            entry[1] += value
+
+    def lines(self):
+        with self.lock:
+            series = [(key, list(counts), total) for key, (counts, total) in
+                      sorted(self.series.items(), key=seriesOrder)]
+        out = ["# HELP {} {}".format(self.name, self.doc),
+               "# TYPE {} histogram".format(self.name)]
+        for key, counts, total in series:
+            labels = metricLabels(self.labels, key)
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                out.append('{}_bucket{{{}{}le="{}"}} {}'.format(
+                    self.name, labels, "," if labels else "", bound, running))
+            out.append(metricLine(self.name + "_sum", labels, total))
+            out.append(metricLine(self.name + "_count", labels, running))
+        return out
+
+
+class Tally:
+
+    def __init__(self, name, doc, labels):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def add(self, key, amount=1):
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def lines(self):
+        with self.lock:
+            series = sorted(self.series.items(), key=seriesOrder)
+        return (["# HELP {} {}".format(self.name, self.doc),
+                 "# TYPE {} counter".format(self.name)] +
+                [metricLine(self.name, metricLabels(self.labels, key), count)
+                 for key, count in series])
+
+
+requestseconds = Histogram("rti_request_seconds",
+                           "Time to answer requests, by Flask endpoint.",
+                           ("endpoint",))
+requestcodes = Tally("rti_requests_total",
+                     "Responses by Flask endpoint and status code.",
+                     ("endpoint", "code"))
+upstreamseconds = Histogram("rti_upstream_seconds",
+                            "Time for Metlink calls including retries.",
+                            ("endpoint", "url"))
+upstreamcodes = Tally("rti_upstream_responses_total",
+                      "Final status of Metlink calls (error: no response).",
+                      ("endpoint", "code"))
+jobseconds = Histogram("rti_job_seconds",
+                       "Run time of scheduled jobs.", ("job",))
+jobevents = Tally("rti_job_events_total",
+                  "Scheduled job runs, errors, overlaps (skipped because "
+                  "the last run was still going) and missed runs.",
+                  ("job", "event"))
+
+
+class UpstreamClient:
+    # Retries errors, timeouts, 429 and 5xx with jittered backoff
+
+    def __init__(self, endpoints, backoff):
+        self.endpoints = endpoints
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                pool_maxsize=16)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"accept-encoding": "gzip"})
+        self.lock = threading.Lock()
+        self.timings = {name: {"calls": 0, "retries": 0, "errors": 0,
+                               "seconds": 0.0, "max": 0.0}
+                        for name in endpoints}
+
+    def get(self, name, accept=None, **kwargs):
+        url, timeout, attempts, withkey = self.endpoints[name]
+        reqheaders = headers if withkey else None
+        if accept is not None:
+            reqheaders = dict(reqheaders or {}, accept=accept)
+        starttime = time.perf_counter()
+        for attempt in range(0, attempts):
+            if attempt > 0:
+                time.sleep(random.uniform(0, self.backoff * 2**(attempt - 1)))
+            try:
+                req = self.session.get(url, timeout=timeout,
+                                       headers=reqheaders, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == attempts - 1:
+                    self.record(name, starttime, attempt, None)
+                    raise
+                continue
+            if ((req.status_code != 429 and req.status_code < 500) or
+                    attempt == attempts - 1):
+                self.record(name, starttime, attempt, req.status_code)
+                return req
+            req.close()
+
+    def record(self, name, starttime, retries, status):
+        # status is None when no response came back
+        elapsed = time.perf_counter() - starttime
+        with self.lock:
+            timing = self.timings[name]
+            timing["calls"] += 1
+            timing["retries"] += retries
+            timing["errors"] += status != 200
+            timing["seconds"] += elapsed
+            timing["max"] = max(timing["max"], elapsed)
+        upstreamseconds.observe((name, self.endpoints[name][0]), elapsed)
+        upstreamcodes.add((name, "error" if status is None else str(status)))
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(timing, mean=timing["seconds"] / timing["calls"]
+                               if timing["calls"] > 0 else 0)
+                    for name, timing in self.timings.items()}
+
+
+upstream = UpstreamClient(endpoints, UPSTREAM_BACKOFF)
+
+
 def downloadZipDataset():
     print("Downloading zip of GTFS metadata")
-    req = requests.get(zipurl, timeout=10)
+    req = upstream.get("zip", stream=True)
+    if req.status_code != 200:
+        print("Failed to download zip ({})".format(req.status_code))
+        return False
     with open("GTFS_full.zip", 'wb') as df:
         for chunk in req.iter_content(chunk_size=128):
             df.write(chunk)
         return True
     return False
 
+def zipDigest():
+    zhash = hashlib.sha256()
+    with open("GTFS_full.zip", "rb") as zf:
+        for chunk in iter(lambda: zf.read(1 << 20), b""):
+            zhash.update(chunk)
+    return zhash.hexdigest()
+
+
+def loadSnapshot(key):
+    if not exists(snapshotfile):
+        return None
+    try:
+        with open(snapshotfile, "rb") as sf:
+            if pickle.load(sf) != key:
+                print("Dataset snapshot is stale")
+                return None
+            return pickle.load(sf)
+    except Exception as e:
+        print("Failed to read dataset snapshot: {}".format(e))
+        return None
+
+
+def saveSnapshot(key, dataset):
+    try:
+        with open(snapshotfile + ".tmp", "wb") as sf:
+            pickle.dump(key, sf, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dataset, sf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshotfile + ".tmp", snapshotfile)
+    except Exception as e:
+        print("Failed to write dataset snapshot: {}".format(e))
+
+
+def sharedDirSafe():
+    # Workers unpickle what SHARED_DIR holds, so only we may write it
+    try:
+        st = os.lstat(SHARED_DIR)
+    except OSError:
+        return False
+    if (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+            st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) == 0):
+        return True
+    # Not under sharedlock, which syncShared() holds while attaching
+    sharedstats["refused"] += 1
+    if sharedstats["refused"] == 1:
+        print("Refusing to share state through {}: not a directory owned "
+              "by uid {} and writable only by it".format(SHARED_DIR,
+                                                        os.getuid()))
+    return False
+
+
+def publishShared(name, obj):
+    # Arrays are pickled out of band, so workers map them without a copy
+    if RTI_ROLE != "poller":
+        return
+    starttime = time.perf_counter()
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    layout = []
+    offset = len(payload)
+    for buf in buffers:
+        offset += -offset % 64
+        layout.append((offset, buf.raw().nbytes))
+        offset += buf.raw().nbytes
+    header = pickle.dumps((len(payload), layout), protocol=5)
+    # The scheduler threads publish live state concurrently
+    with publishlock:
+        if not writeShared(name, header, payload, layout, buffers):
+            return
+    with sharedlock:
+        sharedstats["publishes"] += 1
+        sharedstats["publish_seconds"] = time.perf_counter() - starttime
+        sharedstats["publish_bytes"][name] = offset + 8 + len(header)
+
+
+def writeShared(name, header, payload, layout, buffers):
+    # Call with publishlock held; generations are numbered in order
+    last = sharedstats["published"].get(name, name + ".0")
+    stamp = max(time.time_ns(), int(last.rsplit(".", 1)[1]) + 1)
+    generation = "{}.{}".format(name, stamp)
+    try:
+        os.makedirs(SHARED_DIR, mode=0o700, exist_ok=True)
+        if not sharedDirSafe():
+            return False
+        with open(os.path.join(SHARED_DIR, generation), "wb") as gf:
+            gf.write(len(header).to_bytes(8, "little"))
+            gf.write(header)
+            gf.write(payload)
+            for (offset, _), buf in zip(layout, buffers):
+                gf.seek(8 + len(header) + offset)
+                gf.write(buf.raw())
+        with open(os.path.join(SHARED_DIR, generation + ".ptr"), "w") as pf:
+            pf.write(generation)
+        os.replace(os.path.join(SHARED_DIR, generation + ".ptr"),
+                   os.path.join(SHARED_DIR, name))
+        # Workers still mapping an older generation keep it until they let go
+        for fname in os.listdir(SHARED_DIR):
+            older = fname[len(name) + 1:]
+            if (fname.startswith(name + ".") and older.isdigit() and
+                    int(older) < stamp):
+                os.remove(os.path.join(SHARED_DIR, fname))
+    except OSError as e:
+        print("Failed to publish {}: {}".format(name, e))
+        return False
+    sharedstats["published"][name] = generation
+    return True
+
+
+def attachShared(name, current):
+    # (generation, obj) if a newer generation is published, else None
+    if not sharedDirSafe():
+        return None
+    try:
+        with open(os.path.join(SHARED_DIR, name)) as pf:
+            generation = pf.read()
+        if generation == current:
+            return None
+        if (not generation.startswith(name + ".") or os.sep in generation or
+                (os.altsep is not None and os.altsep in generation)):
+            print("Ignoring bad generation name for {}".format(name))
+            return None
+        with open(os.path.join(SHARED_DIR, generation), "rb") as gf:
+            mapped = mmap.mmap(gf.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Not published yet, or replaced while we were opening it
+        return None
+    view = memoryview(mapped)
+    hlen = int.from_bytes(view[:8], "little")
+    plen, layout = pickle.loads(view[8:8 + hlen])
+    base = 8 + hlen
+    obj = pickle.loads(view[base:base + plen],
+                       buffers=[view[base + offset:base + offset + n] for
+                                offset, n in layout])
+    return generation, obj
+
+
+sharedlock = threading.Lock()
+publishlock = threading.Lock()
+sharedstats = {"role": RTI_ROLE, "published": {}, "publishes": 0,
+               "publish_seconds": 0.0, "publish_bytes": {}, "attached": {},
+               "attaches": 0, "attach_seconds": 0.0, "checked": 0.0,
+               "refused": 0}
+
+
 def loadZipDataset():
-    global triplist
-    global alltrips
-    global zipinfo
-    global routelist
-    global routetrips
-    global stopinfo
-    global stopids
-    global stopnames
-    global servroute
-    global routeslastupdate
-    global stoplastupdate
-    global trip_serv
-    global caldates
-    global agencies
-    global trip_seq
-    global trip_dir
-    global trip_sid
-    global trip_stop_times
-    global stop_patterns
+    global data
+    if not reloadlock.acquire(blocking=False):
+        print("Dataset load already in progress")
+        return False
+    try:
+        starttime = time.perf_counter()
+        ds = parseZipDataset()
+        if ds is None:
+            return False
+        loadstats["loads"] += 1
+        loadstats["seconds"] = time.perf_counter() - starttime
+        # Publish the new generation with a single reference swap; the old
+        # one is freed once the last in-flight request drops its reference
+        data = ds
+        del ds
+        gc.collect()
+        publishShared("dataset", data)
+        # The ETA index holds rows of the old dataset
+        updateEtas()
+        publishLive()
+        threading.Thread(target=afterLoad, args=(data,), daemon=True).start()
+        return True
+    finally:
+        reloadlock.release()
+
+
+def parseZipDataset():
     nowtime = dt.datetime.now(patz)
     print("Loading zip of metadata at {}".format(nowtime.strftime("%c")))
     if not exists("GTFS_full.zip"):
-        return False
+        return None
+    ds = Dataset()
+    ds.loaded = nowtime
     with zipfile.ZipFile("GTFS_full.zip") as z:
         znames = z.namelist()
         if not all(needed_file in znames for needed_file in ["feed_info.txt",
@@ -161,133 +1004,160 @@ def loadZipDataset():
                                                              "calendar_dates.txt",
                                                              "stop_patterns.txt",
                                                              "stop_pattern_trips.txt"]):
-            return False
+            return None
+
+        starttime = time.perf_counter()
+        with textwrap(z.open("feed_info.txt"), encoding="utf-8-sig") as feedfile:
+            feedrows = list(csv.DictReader(feedfile))
+        snapkey = {"version": SNAPSHOT_VERSION,
+                   "feed_version": feedrows[-1].get("feed_version") if
+                       len(feedrows) > 0 else None,
+                   "sha256": zipDigest()}
+        snapshot = loadSnapshot(snapkey)
+        if snapshot is not None:
+            snapshot.loaded = nowtime
+            print("Dataset snapshot {} loaded in {:.2f}s".format(
+                snapshot.zipinfo["feed_version"],
+                time.perf_counter() - starttime))
+            return snapshot
 
         with textwrap(z.open("agency.txt"), encoding="utf-8-sig") as agfile:
-            agencies = {}
             agrows = csv.DictReader(agfile)
             for row in agrows:
-                agencies[row["agency_id"]] = row
-        if len(agencies) == 0:
-            return False
+                ds.agencies[row["agency_id"]] = row
+        if len(ds.agencies) == 0:
+            return None
         print("done agencies")
 
         with textwrap(z.open("trips.txt"), encoding="utf-8-sig") as tripfile:
-            triplist = []
             triprows = csv.DictReader(tripfile)
             for row in triprows:
-                triplist.append(row)
-            alltrips = [trip["trip_id"] for trip in triplist]
-            trip_dir = {trip["trip_id"]: trip["direction_id"] for trip in
-                        triplist}
-        if len(triplist) == 0:
-            return False
+                ds.triplist.append(row)
+            ds.alltrips = set(trip["trip_id"] for trip in ds.triplist)
+            ds.trip_index = {trip["trip_id"]: trip for trip in ds.triplist}
+            ds.trip_dir = {trip["trip_id"]: trip["direction_id"] for trip in
+                           ds.triplist}
+        if len(ds.triplist) == 0:
+            return None
         print("done trips")
 
         with textwrap(z.open("stops.txt"), encoding="utf-8-sig") as stopfile:
-            stopinfo = []
             stoprows = csv.DictReader(stopfile)
             for row in stoprows:
                 row["stop_lat"] = float(row["stop_lat"])
                 row["stop_lon"] = float(row["stop_lon"])
-                stopinfo.append(row)
-            stopids = {x["stop_id"]: ind for ind, x in enumerate(stopinfo)}
-            stopnames = {x["stop_name"]: x["stop_id"] for x in stopinfo}
-        if len(stopinfo) == 0:
-            return False
-        else:
-            stoplastupdate = nowtime
+                ds.stopinfo.append(row)
+            ds.stopids = {x["stop_id"]: ind for ind, x in
+                          enumerate(ds.stopinfo)}
+            ds.stopnames = {x["stop_name"]: x["stop_id"] for x in ds.stopinfo}
+            ds.stopsearch = StopSearchIndex(ds.stopnames.keys())
+            ds.stopgrid = StopGrid([x["stop_lat"] for x in ds.stopinfo],
+                                   [x["stop_lon"] for x in ds.stopinfo])
+        if len(ds.stopinfo) == 0:
+            return None
         print("done stops")
 
         with textwrap(z.open("stop_times.txt"),
                       encoding="utf-8-sig") as tsfile:
             tsrows = csv.DictReader(tsfile)
-            trip_stop_times = {}
             for row in tsrows:
-                nval = {"id": row["stop_id"],
-                        "time": row["departure_time"],
-                        "tp": True if row["timepoint"] == "1" else False,
-                        "seq": row["stop_sequence"],
-                        "sind": stopids.get(row["stop_id"])}
-                if row["trip_id"] in trip_stop_times:
-                    trip_stop_times[row["trip_id"]].append(nval)
-                else:
-                    trip_stop_times[row["trip_id"]] = [nval]
-        print("done stop times")
+                ds.trip_stop_times.append(row["trip_id"], row["stop_id"],
+                                          row["departure_time"],
+                                          row["stop_sequence"],
+                                          row["timepoint"] == "1",
+                                          ds.stopids.get(row["stop_id"]))
+            ds.trip_stop_times.finish(len(ds.stopinfo))
+        print("done stop times ({} rows, {:.1f} MB)".format(
+            len(ds.trip_stop_times.time), ds.trip_stop_times.nbytes() / 1e6))
 
         with textwrap(z.open("routes.txt"), encoding="utf-8-sig") as routefile:
             routeinfo = []
             routerows = csv.DictReader(routefile)
             for row in routerows:
                 routeinfo.append(row)
-            routelist = {x["route_short_name"]: x for x in routeinfo}
-            servroute = {x["route_id"]: x["route_short_name"] for x in routeinfo}
-            routetrips = {r: [t["trip_id"] for t in triplist if t["route_id"]
-                              == r] for r in [rv["route_id"] for rv in
-                                              routeinfo]}
-        if len(routelist) == 0:
-            return False
-        else:
-            routeslastupdate = nowtime
+            ds.routelist = {x["route_short_name"]: x for x in routeinfo}
+            ds.servroute = {x["route_id"]: x["route_short_name"] for x in
+                            routeinfo}
+            ds.routetrips = {rv["route_id"]: [] for rv in routeinfo}
+            for trip in ds.triplist:
+                if trip["route_id"] in ds.routetrips:
+                    ds.routetrips[trip["route_id"]].append(trip["trip_id"])
+        if len(ds.routelist) == 0:
+            return None
         print("done routes")
 
         with textwrap(z.open(
             "calendar_dates.txt"), encoding="utf-8-sig") as calfile:
             calrows = csv.DictReader(calfile)
-            caldates = {}
+            servdates = {}
             for row in calrows:
                 if row["exception_type"] != "1":
                     continue
-                elif row["service_id"] in caldates:
-                    caldates[row["service_id"]].append(dt.datetime.strptime(row["date"],
-                                                                          "%Y%m%d"))
-                else:
-                    caldates[row["service_id"]] = [dt.datetime.strptime(row["date"], "%Y%m%d")]
-        if len(caldates) == 0:
-            return False
+                servdates.setdefault(row["service_id"], set()).add(
+                    dt.date(int(row["date"][:4]), int(row["date"][4:6]),
+                            int(row["date"][6:])))
+        if len(servdates) == 0:
+            return None
+        ds.cal_start = min(min(dates) for dates in servdates.values())
+        ds.cal_days = (max(max(dates) for dates in servdates.values()) -
+                       ds.cal_start).days + 1
+        ds.serv_ids = list(servdates.keys())
+        ds.day_services = [0] * ds.cal_days
+        for sind, service_id in enumerate(ds.serv_ids):
+            bits = 0
+            for date in servdates[service_id]:
+                offset = (date - ds.cal_start).days
+                bits |= 1 << offset
+                ds.day_services[offset] |= 1 << sind
+            ds.serv_days[service_id] = bits
+        del servdates
         print("done calendar")
 
         with textwrap(z.open(
             "stop_pattern_trips.txt"), encoding="utf-8-sig") as spfile:
-            trip_serv = {}
-            trip_seq = {}
-            trip_sid = {}
             sptrows = csv.DictReader(spfile)
             for row in sptrows:
-                trip_serv[row["trip_id"]] = servfromtrip(row["trip_id"],
-                                                         agencies.keys())
-                trip_seq[row["trip_id"]] = row["trip_sequence"]
-                trip_sid[row["trip_id"]] = row["stop_pattern_id"]
-        if len(trip_serv) == 0:
-            return False
+                ds.trip_serv[row["trip_id"]] = servfromtrip(
+                    row["trip_id"], ds.agencies.keys())
+                ds.trip_seq[row["trip_id"]] = row["trip_sequence"]
+                ds.trip_sid[row["trip_id"]] = row["stop_pattern_id"]
+        if len(ds.trip_serv) == 0:
+            return None
+        for route_id, rtrips in ds.routetrips.items():
+            ds.route_patterns[route_id] = list(dict.fromkeys(
+                ds.trip_sid[t] for t in rtrips if t in ds.trip_sid))
+            routebits = 0
+            for service_id in set(ds.trip_serv.get(t) for t in rtrips):
+                routebits |= ds.serv_days.get(service_id, 0)
+            ds.route_adjacent[route_id] = adjacentDays(routebits,
+                                                       ds.cal_days)
         print("done stop pattern/trips")
 
         with textwrap(z.open(
             "stop_patterns.txt"), encoding="utf-8-sig") as spfile:
-            stop_patterns = {}
             sptrows = csv.DictReader(spfile)
             for row in sptrows:
                 nval = {"id": row.get("stop_id"),
                         "seq": row.get("stop_sequence"),
-                        "sind": stopids.get(row.get("stop_id")),
+                        "sind": ds.stopids.get(row.get("stop_id")),
                         "timepoint": row.get("timepoint") == "1"}
-                if row["stop_pattern_id"] in stop_patterns:
-                    stop_patterns[row["stop_pattern_id"]].append(nval)
+                if row["stop_pattern_id"] in ds.stop_patterns:
+                    ds.stop_patterns[row["stop_pattern_id"]].append(nval)
                 else:
-                    stop_patterns[row["stop_pattern_id"]] = [nval]
-        if len(stop_patterns) == 0:
-            return False
+                    ds.stop_patterns[row["stop_pattern_id"]] = [nval]
+        if len(ds.stop_patterns) == 0:
+            return None
         print("done stop patterns")
 
-        with textwrap(z.open("feed_info.txt"), encoding="utf-8-sig") as feedfile:
-            feedrows = csv.DictReader(feedfile)
-            for row in feedrows:
-                zipinfo = row
+        for row in feedrows:
+            ds.zipinfo = row
 
-    if "feed_version" not in zipinfo:
-        return False
-    print("Zip file loaded at {}".format(dt.datetime.now(patz).strftime("%c")))
-    return True
+    if "feed_version" not in ds.zipinfo:
+        return None
+    print("Zip file loaded at {} in {:.2f}s".format(
+        dt.datetime.now(patz).strftime("%c"), time.perf_counter() - starttime))
+    saveSnapshot(snapkey, ds)
+    return ds
 
 
 def updateFeedInfo(force=False, force_download=False):
@@ -295,7 +1165,7 @@ def updateFeedInfo(force=False, force_download=False):
     nowtime = dt.datetime.now(patz)
     tstoday = nowtime.strftime("%Y%m%d")
     if force or "feed_end_date" not in feedinfo or feedinfo["feed_end_date"] < tstoday:
-        req = requests.get(feedinfourl, headers=headers, timeout=10)
+        req = upstream.get("feedinfo")
         if req.status_code != 200:
             print("Failed to update feed_info metadata at {}.".format(
                 nowtime.strftime("%c")))
@@ -306,7 +1176,7 @@ def updateFeedInfo(force=False, force_download=False):
         print("Updated feed_info metadata at {}, new expiry date: {}.".format(
             nowtime.strftime("%c"), feedinfo["feed_end_date"]))
     # If data file not previously loaded, load it
-    if "feed_version" not in zipinfo:
+    if "feed_version" not in data.zipinfo:
         # If the file doesn't exist, download it - stop on fail
         if not exists("GTFS_full.zip"):
             print("No metadata file, downloading")
@@ -315,6 +1185,7 @@ def updateFeedInfo(force=False, force_download=False):
         if not loadZipDataset():
             return
     # If data file is out of date, redownload it and reload it
+    zipinfo = data.zipinfo
     if (zipinfo["feed_start_date"] < feedinfo["feed_start_date"] or
         zipinfo["feed_end_date"] < feedinfo["feed_end_date"] or
         force_download):
@@ -324,75 +1195,190 @@ def updateFeedInfo(force=False, force_download=False):
         loadZipDataset()
 
 
+def fetchRealtime(name):
+    # Returns the decoded JSON, a FeedMessage, or None on failure
+    if REALTIME_FORMAT == "protobuf" and gtfs_realtime_pb2 is not None:
+        req = upstream.get(name, accept="application/x-protobuf")
+        if req.status_code != 200:
+            return None
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(req.content)
+        return feed
+    req = upstream.get(name)
+    if req.status_code != 200:
+        return None
+    return req.json()
+
+
+class AlertIndex:
+
+    def __init__(self, alerts):
+        self.alerts = alerts
+        self.stops = {}
+        self.routes = {}
+        self.trips = {}
+        for i, alert in enumerate(alerts):
+            for index, keys in ((self.stops, alert["stops"]),
+                                (self.routes, alert["routes"]),
+                                (self.trips, alert["trips"])):
+                for key in set(keys):
+                    index.setdefault(key, []).append(i)
+
+    def lookup(self, stops=(), routes=(), trips=()):
+        starttime = time.perf_counter()
+        found = set()
+        for index, keys in ((self.stops, stops), (self.routes, routes),
+                            (self.trips, trips)):
+            for key in keys:
+                found.update(index.get(key, ()))
+        rel_alerts = [self.alerts[i] for i in sorted(found)]
+        with alertstatslock:
+            alertstats["lookups"] += 1
+            alertstats["lookup_seconds"] += time.perf_counter() - starttime
+        return rel_alerts
+
+
+alertindex = AlertIndex([])
+alertstats = {"refreshes": 0, "refresh_seconds": 0.0, "lookups": 0,
+              "lookup_seconds": 0.0}
+alertstatslock = threading.Lock()
+
+
+def alertsFromJson(ds, talerts):
+    return [{
+        "effect": a["alert"].get("effect").lower().replace("_", "-") if "effect" in
+            a["alert"] else None,
+        "cause": a["alert"].get("cause").lower().replace("_", "-") if "cause" in a["alert"]
+            else None,
+        "severity": a["alert"].get("severity_level").lower().replace(
+            "_", "-") if "severity_level" in a["alert"] else None,
+        "desc":
+        a["alert"]["description_text"]["translation"][
+            0].get("text").replace("\r", " ").replace("\n", " ") if
+            "description_text" in a["alert"] and "translation" in a["alert"]["description_text"]
+            and len(a["alert"]["description_text"]["translation"]) > 0 else None,
+        "head": a["alert"]["header_text"]["translation"][
+            0].get("text").replace("\r", " ").replace("\n", " ") if
+            "header_text" in a["alert"] and "translation" in a["alert"]["header_text"]
+            and len(a["alert"]["header_text"]["translation"]) > 0 else None,
+        "routes": [ds.servroute[e["route_id"]] for e in a["alert"]["informed_entity"] if
+                   "route_id" in e and e["route_id"] in ds.servroute] if "informed_entity" in a["alert"] else [],
+        "stops": [e["stop_id"] for e in a["alert"]["informed_entity"] if
+                   "stop_id" in e] if "informed_entity" in a["alert"] else [],
+        "trips": [e["trip"].get("trip_id") for e in a["alert"]["informed_entity"] if
+                   "trip" in e and "trip_id" in e["trip"] and
+                  e["trip"]["trip_id"] in ds.alltrips] if "informed_entity" in a["alert"] else [],
+        "start":
+            dt.datetime.fromtimestamp(a["alert"]["active_period"][0][
+                "start"], patz)
+            if "active_period" in a["alert"] and
+            len(a["alert"]["active_period"]) > 0 and "start" in
+            a["alert"]["active_period"][0] else
+            None,
+        "end":
+            dt.datetime.fromtimestamp(a["alert"]["active_period"][0][
+                "end"], patz)
+            if "active_period" in a["alert"] and
+            len(a["alert"]["active_period"]) > 0 and "end" in
+            a["alert"]["active_period"][0] else
+            None,
+        "url": a["alert"]["url"]["translation"][0].get("text") if "url" in
+            a["alert"] and "translation" in a["alert"]["url"] and
+            len(a["alert"]["url"]["translation"]) > 0 else None,
+        "id": a.get("id"),
+        "timestamp": isoparse(a["timestamp"]) if "timestamp" in a else None
+        } for a in talerts["entity"] if "alert" in a
+    ]
+
+
+def protoText(translated):
+    if len(translated.translation) == 0:
+        return None
+    return translated.translation[0].text
+
+
+@lru_cache(maxsize=None)
+def protoEnumNames(messagetype, field):
+    return {value.number: value.name for value in
+            messagetype.DESCRIPTOR.fields_by_name[field].enum_type.values}
+
+
+def protoEnum(message, field):
+    if not message.HasField(field):
+        return None
+    return protoEnumNames(type(message), field)[getattr(message, field)]
+
+
+def alertsFromProto(ds, feed):
+    tlist = []
+    for entity in feed.entity:
+        if not entity.HasField("alert"):
+            continue
+        a = entity.alert
+        period = a.active_period[0] if len(a.active_period) > 0 else None
+        desc = protoText(a.description_text)
+        head = protoText(a.header_text)
+        tlist.append({
+            "effect": None if not a.HasField("effect") else
+                protoEnum(a, "effect").lower().replace("_", "-"),
+            "cause": None if not a.HasField("cause") else
+                protoEnum(a, "cause").lower().replace("_", "-"),
+            "severity": None if not a.HasField("severity_level") else
+                protoEnum(a, "severity_level").lower().replace("_", "-"),
+            "desc": None if desc is None else
+                desc.replace("\r", " ").replace("\n", " "),
+            "head": None if head is None else
+                head.replace("\r", " ").replace("\n", " "),
+            "routes": [ds.servroute[e.route_id] for e in a.informed_entity if
+                       e.HasField("route_id") and e.route_id in ds.servroute],
+            "stops": [e.stop_id for e in a.informed_entity if
+                      e.HasField("stop_id")],
+            "trips": [e.trip.trip_id for e in a.informed_entity if
+                      e.HasField("trip") and e.trip.HasField("trip_id") and
+                      e.trip.trip_id in ds.alltrips],
+            "start": dt.datetime.fromtimestamp(period.start, patz) if
+                period is not None and period.HasField("start") else None,
+            "end": dt.datetime.fromtimestamp(period.end, patz) if
+                period is not None and period.HasField("end") else None,
+            "url": protoText(a.url),
+            "id": entity.id,
+            # Metlink's JSON adds a per-alert timestamp; the protobuf has none
+            "timestamp": None
+        })
+    return tlist
+
+
 def updateAlerts(force=False):
     global alertlist
+    global alertindex
     global alertslastupdate
+    ds = data
     nowtime = dt.datetime.now(patz)
     if force or (nowtime - alertslastupdate).seconds >= 60 * 5:
-        req = requests.get(alertsurl, headers=headers, timeout=10)
-        if req.status_code != 200:
-            return
-        talerts = req.json()
-        if "entity" not in talerts:
+        talerts = fetchRealtime("alerts")
+        if talerts is None:
             return
-        alertlist = [{
-            "effect": a["alert"].get("effect").lower().replace("_", "-") if "effect" in
-                a["alert"] else None,
-            "cause": a["alert"].get("cause").lower().replace("_", "-") if "cause" in a["alert"]
-                else None,
-            "severity": a["alert"].get("severity_level").lower().replace(
-                "_", "-") if "severity_level" in a["alert"] else None,
-            "desc":
-            a["alert"]["description_text"]["translation"][
-                0].get("text").replace("\r", " ").replace("\n", " ") if
-                "description_text" in a["alert"] and "translation" in a["alert"]["description_text"]
-                and len(a["alert"]["description_text"]["translation"]) > 0 else None,
-            "head": a["alert"]["header_text"]["translation"][
-                0].get("text").replace("\r", " ").replace("\n", " ") if
-                "header_text" in a["alert"] and "translation" in a["alert"]["header_text"]
-                and len(a["alert"]["header_text"]["translation"]) > 0 else None,
-            "routes": [servroute[e["route_id"]] for e in a["alert"]["informed_entity"] if
-                       "route_id" in e and e["route_id"] in servroute] if "informed_entity" in a["alert"] else [],
-            "stops": [e["stop_id"] for e in a["alert"]["informed_entity"] if
-                       "stop_id" in e] if "informed_entity" in a["alert"] else [],
-            "trips": [e["trip"].get("trip_id") for e in a["alert"]["informed_entity"] if
-                       "trip" in e and "trip_id" in e["trip"] and
-                      e["trip"]["trip_id"] in alltrips] if "informed_entity" in a["alert"] else [],
-            "start":
-                dt.datetime.fromtimestamp(a["alert"]["active_period"][0][
-                    "start"], patz)
-                if "active_period" in a["alert"] and
-                len(a["alert"]["active_period"]) > 0 and "start" in
-                a["alert"]["active_period"][0] else
-                None,
-            "end":
-                dt.datetime.fromtimestamp(a["alert"]["active_period"][0][
-                    "end"], patz)
-                if "active_period" in a["alert"] and
-                len(a["alert"]["active_period"]) > 0 and "end" in
-                a["alert"]["active_period"][0] else
-                None,
-            "url": a["alert"]["url"]["translation"][0].get("text") if "url" in
-                a["alert"] and "translation" in a["alert"]["url"] and
-                len(a["alert"]["url"]["translation"]) > 0 else None,
-            "id": a.get("id"),
-            "timestamp": isoparse(a["timestamp"]) if "timestamp" in a else None
-            } for a in talerts["entity"] if "alert" in a
-        ]
+        starttime = time.perf_counter()
+        if isinstance(talerts, dict):
+            if "entity" not in talerts:
+                return
+            tlist = alertsFromJson(ds, talerts)
+        else:
+            tlist = alertsFromProto(ds, talerts)
+        alertindex = AlertIndex(tlist)
+        alertlist = tlist
         alertslastupdate = nowtime
+        with alertstatslock:
+            alertstats["refreshes"] += 1
+            alertstats["refresh_seconds"] = time.perf_counter() - starttime
+        publishLive()
 
 
-def updatePositions():
-    global trip_positions
-    global positionlastupdate
-    req = requests.get(positionurl, headers=headers, timeout=10)
-    if req.status_code != 200:
-        return
-    posdata = req.json()
+def positionsFromJson(posdata):
     if ("header" not in posdata or "entity" not in posdata or
         len(posdata.get("entity")) == 0 or "timestamp" not in
         posdata.get("header")):
-        return
+        return None
     datstamp = dt.datetime.fromtimestamp(posdata["header"]["timestamp"], patz)
     tpdict = {}
     for entity in posdata["entity"]:
@@ -416,8 +1402,8 @@ def updatePositions():
                 "speed": dictget(entity, ["vehicle", "position", "speed"], 0,
                               True),
                 "vehicle_id": dictget(entity, ["vehicle", "vehicle", "id"]),
-                "timestamp": dt.datetime.fromtimestamp(
-                    dictget(entity, ["vehicle", "timestamp"], 0), patz)
+                "timestamp": localTime(
+                    dictget(entity, ["vehicle", "timestamp"], 0))
             }
         except Exception as e:
             extime = dt.datetime.now(patz)
@@ -426,39 +1412,220 @@ def updatePositions():
             print(entity)
             print(e)
             print()
+    return datstamp, tpdict
+
+
+def positionsFromProto(feed):
+    if len(feed.entity) == 0 or not feed.header.HasField("timestamp"):
+        return None
+    datstamp = dt.datetime.fromtimestamp(feed.header.timestamp, patz)
+    tpdict = {}
+    for entity in feed.entity:
+        vehicle = entity.vehicle
+        trip = vehicle.trip
+        position = vehicle.position
+        if not trip.HasField("trip_id"):
+            extime = dt.datetime.now(patz)
+            print(("Error handling vehicle entity at {}:").format(
+                extime.strftime("%c %Z")))
+            print(entity)
+            print()
+            continue
+        tpdict[trip.trip_id] = {
+            "direction": trip.direction_id if trip.HasField("direction_id")
+                else None,
+            # Metlink's JSON gives numeric route ids as numbers
+            "route_id": (int(trip.route_id) if trip.route_id.isdigit() else
+                         trip.route_id) if trip.HasField("route_id") else None,
+            "start_time": trip.start_time if trip.HasField("start_time") else
+                trip.start_date,
+            "bearing": position.bearing,
+            "lat": position.latitude,
+            "lon": position.longitude,
+            "speed": position.speed,
+            "vehicle_id": vehicle.vehicle.id if vehicle.vehicle.HasField("id")
+                else None,
+            "timestamp": localTime(vehicle.timestamp)
+        }
+    return datstamp, tpdict
+
+
+class LiveStore:
+    # Latest entry per trip, kept until maxage old or its vehicle moves on
+
+    def __init__(self, vehiclekey, timekey, maxage):
+        self.vehiclekey = vehiclekey
+        self.timekey = timekey
+        self.maxage = maxage
+        self.trips = {}
+        self.vehicles = {}
+        self.expiry = []
+        self.polls = 0
+        self.pushed = 0
+
+    def merge(self, entries, now):
+        self.polls += 1
+        for trip_id, entry in entries.items():
+            self.upsert(trip_id, entry)
+        self.expire(now)
+
+    def upsert(self, trip_id, entry):
+        if trip_id in self.trips:
+            self.remove(trip_id)
+        vehicle_id = entry[self.vehiclekey]
+        if vehicle_id is not None:
+            # A vehicle on two trips in one poll keeps both
+            for previous in list(self.vehicles.get(vehicle_id, ())):
+                if self.trips[previous][1] != self.polls:
+                    self.remove(previous)
+            self.vehicles.setdefault(vehicle_id, set()).add(trip_id)
+        self.trips[trip_id] = (entry, self.polls)
+        self.pushed += 1
+        heapq.heappush(self.expiry, (entry[self.timekey], self.pushed,
+                                     trip_id))
+
+    def remove(self, trip_id):
+        entry, _ = self.trips.pop(trip_id)
+        vehicle_id = entry[self.vehiclekey]
+        if vehicle_id is not None:
+            self.vehicles[vehicle_id].discard(trip_id)
+            if len(self.vehicles[vehicle_id]) == 0:
+                del self.vehicles[vehicle_id]
+
+    def expire(self, now):
+        cutoff = now - self.maxage
+        current = []
+        while len(self.expiry) > 0 and self.expiry[0][0] <= cutoff:
+            record = heapq.heappop(self.expiry)
+            timestamp, _, trip_id = record
+            if trip_id not in self.trips:
+                continue
+            entry, poll = self.trips[trip_id]
+            if entry[self.timekey] != timestamp:
+                continue
+            if poll == self.polls:
+                current.append(record)
+            else:
+                self.remove(trip_id)
+        for record in current:
+            heapq.heappush(self.expiry, record)
+        if len(self.expiry) > 4 * len(self.trips) + 64:
+            self.expiry = [(entry[self.timekey], n, trip_id) for n, (trip_id,
+                           (entry, _)) in enumerate(self.trips.items())]
+            heapq.heapify(self.expiry)
+
+    def snapshot(self):
+        # Newest poll first, each poll in feed order
+        order = sorted(self.trips, key=lambda t: -self.trips[t][1])
+        return {trip_id: self.trips[trip_id][0] for trip_id in order}
+
+
+positionstore = LiveStore("vehicle_id", "timestamp", dt.timedelta(minutes=5))
+updatestore = LiveStore("vid", "ts", dt.timedelta(minutes=5))
+livestats = {name: {"polls": 0, "entries": 0, "last": 0.0, "max": 0.0,
+                     "at": 0.0}
+             for name in ("positions", "tripupdates")}
+
+
+def recordPoll(name, starttime, entries):
+    elapsed = time.perf_counter() - starttime
+    stats = livestats[name]
+    stats["polls"] += 1
+    stats["entries"] = entries
+    stats["last"] = elapsed
+    stats["max"] = max(stats["max"], elapsed)
+    stats["at"] = time.time()
+
+
+def updatePositions():
+    global trip_positions
+    global positionlastupdate
+    starttime = time.perf_counter()
+    posdata = fetchRealtime("positions")
+    if posdata is None:
+        return
+    if isinstance(posdata, dict):
+        parsed = positionsFromJson(posdata)
+    else:
+        parsed = positionsFromProto(posdata)
+    if parsed is None:
+        return
+    datstamp, tpdict = parsed
     if len(tpdict) > 0:
-        seenveh = [tpdict[t]["vehicle_id"] for t in tpdict]
-        keepovers = {t: trip_positions[t] for t in trip_positions if t not in
-                     tpdict and (datstamp -
-                                 trip_positions[t]["timestamp"]).seconds
-                     < 60*5 and trip_positions[t]["vehicle_id"] not in seenveh}
-        if len(keepovers) > 0:
-            tpdict.update(keepovers)
+        positionstore.merge(tpdict, datstamp)
+        tpdict = positionstore.snapshot()
+        matchNearestStops(data, tpdict)
         positionlastupdate = datstamp
         trip_positions = tpdict
-
-
-def updateTripUpdates():
-    global trip_updates
-    req = requests.get(tripupdatesurl, headers=headers, timeout=10)
-    if req.status_code != 200:
+        recordPoll("positions", starttime, len(tpdict))
+        updateEtas()
+        publishLive()
+
+
+def matchNearestStops(ds, tpdict):
+    # Sets "nearest" to the closest stop on the vehicle's own trip
+    store = ds.trip_stop_times
+    tids = []
+    segs = []
+    for tid in tpdict:
+        tpdict[tid]["nearest"] = None
+        if tid not in store:
+            continue
+        start, end = store.span(tid)
+        pos = np.arange(start, end)
+        pos = pos[store.sind[start:end] >= 0]
+        if len(pos) > 0:
+            tids.append(tid)
+            segs.append(pos)
+    if len(tids) == 0:
         return
-    updata = req.json()
+    lengths = np.array([len(seg) for seg in segs])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    pos = np.concatenate(segs)
+    sinds = store.sind[pos]
+    vlat = np.repeat([tpdict[t]["lat"] for t in tids], lengths)
+    vlon = np.repeat([tpdict[t]["lon"] for t in tids], lengths)
+    slat = ds.stopgrid.lats[sinds]
+    slon = ds.stopgrid.lons[sinds]
+    dist2 = planeDistance2Array(slat, slon, vlat, vlon)
+    group = np.repeat(np.arange(len(tids)), lengths)
+    ismin = dist2 == np.repeat(np.minimum.reduceat(dist2, starts), lengths)
+    firsts = np.flatnonzero(ismin)
+    firsts = firsts[np.unique(group[firsts], return_index=True)[1]]
+    for tid, i in zip(tids, firsts.tolist()):
+        stop = ds.stopinfo[sinds[i]]
+        dlat = tpdict[tid]["lat"] - stop["stop_lat"]
+        dlon = tpdict[tid]["lon"] - stop["stop_lon"]
+        tpdict[tid]["nearest"] = {
+            "stop_id": stop["stop_id"],
+            "name": stop["stop_name"],
+            "dist2": float(dist2[i]),
+            "heading": heading(dlat, dlon),
+            "progress": int(pos[i] - store.span(tid)[0])
+        }
+
+
+def tripUpdatesFromJson(updata):
     if ("header" not in updata or "entity" not in updata or
         len(updata.get("entity")) == 0 or "timestamp" not in
         updata.get("header")):
-        return
+        return None
     datstamp = dt.datetime.fromtimestamp(updata["header"]["timestamp"], patz)
     updict = {}
     for entity in updata["entity"]:
         try:
             tup = entity.get("trip_update")
             tid = tup.get("trip").get("trip_id")
-            delay = tup.get("stop_time_update").get("arrival").get("delay")
+            # Metlink sends a single object; the spec allows a list
+            stus = tup.get("stop_time_update")
+            if not isinstance(stus, list):
+                stus = [stus]
+            delay = stus[0].get("arrival").get("delay")
             s_r = tup.get("trip").get("schedule_relationship")
-            tstamp = dt.datetime.fromtimestamp(tup.get("timestamp"), patz)
+            tstamp = localTime(tup.get("timestamp"))
             vid = tup.get("vehicle").get("id")
-            updict[tid] = {"delay": delay, "sr": s_r, "ts": tstamp, "vid": vid}
+            updict[tid] = {"delay": delay, "sr": s_r, "ts": tstamp, "vid": vid,
+                           "stus": stopUpdatesFromJson(stus)}
         except Exception as e:
             extime = dt.datetime.now(patz)
             print(("Error handling update entity at {}:").format(
@@ -466,22 +1633,277 @@ def updateTripUpdates():
             print(entity)
             print(e)
             print()
-    if len(updict) > 0:
-        seenveh = [updict[t]["vid"] for t in updict]
-        keepovers = {t: trip_updates[t] for t in trip_updates if t not in
-                     updict and (datstamp -
-                                 trip_updates[t]["ts"]).seconds
-                     < 60*5 and trip_updates[t]["vid"] not in seenveh}
-        if len(keepovers) > 0:
-            updict.update(keepovers)
-        trip_updates = updict
+    return datstamp, updict
+
+
+def stopUpdatesFromJson(stus):
+    # (stop_sequence, stop_id, delay, time) per predicted stop, preferring
+    # the departure event; any of them may be None
+    rv = []
+    for stu in stus:
+        if stu.get("schedule_relationship") in ("SKIPPED", "NO_DATA"):
+            continue
+        event = stu.get("departure") or stu.get("arrival") or {}
+        rv.append((stu.get("stop_sequence"), stu.get("stop_id"),
+                   event.get("delay"), event.get("time")))
+    return rv
+
+
+def stopUpdatesFromProto(updates):
+    rv = []
+    for stu in updates:
+        if protoEnum(stu, "schedule_relationship") in ("SKIPPED", "NO_DATA"):
+            continue
+        event = (stu.departure if stu.HasField("departure") else
+                 stu.arrival if stu.HasField("arrival") else None)
+        rv.append((stu.stop_sequence if stu.HasField("stop_sequence") else
+                   None,
+                   stu.stop_id if stu.HasField("stop_id") else None,
+                   event.delay if event is not None and
+                   event.HasField("delay") else None,
+                   event.time if event is not None and
+                   event.HasField("time") else None))
+    return rv
+
+
+def tripUpdatesFromProto(feed):
+    if len(feed.entity) == 0 or not feed.header.HasField("timestamp"):
+        return None
+    datstamp = dt.datetime.fromtimestamp(feed.header.timestamp, patz)
+    updict = {}
+    for entity in feed.entity:
+        tup = entity.trip_update
+        updates = tup.stop_time_update
+        arrival = updates[0].arrival if len(updates) > 0 else None
+        if (arrival is None or not arrival.HasField("delay") or
+                not tup.HasField("timestamp") or
+                not tup.HasField("vehicle")):
+            extime = dt.datetime.now(patz)
+            print(("Error handling update entity at {}:").format(
+                extime.strftime("%c %Z")))
+            print(entity)
+            print()
+            continue
+        updict[tup.trip.trip_id] = {
+            "delay": arrival.delay,
+            "sr": protoEnum(tup.trip, "schedule_relationship"),
+            "ts": localTime(tup.timestamp),
+            "vid": tup.vehicle.id if tup.vehicle.HasField("id") else None,
+            "stus": stopUpdatesFromProto(updates)
+        }
+    return datstamp, updict
+
 
+def updateTripUpdates():
+    global trip_updates
+    starttime = time.perf_counter()
+    updata = fetchRealtime("tripupdates")
+    if updata is None:
+        return
+    if isinstance(updata, dict):
+        parsed = tripUpdatesFromJson(updata)
+    else:
+        parsed = tripUpdatesFromProto(updata)
+    if parsed is None:
+        return
+    datstamp, updict = parsed
+    if len(updict) > 0:
+        updatestore.merge(updict, datstamp)
+        trip_updates = updatestore.snapshot()
+        recordPoll("tripupdates", starttime, len(trip_updates))
+        updateEtas()
+        publishLive()
+
+
+@lru_cache(maxsize=64)
+def serviceDayStart(date):
+    # GTFS times count from noon minus 12h, not midnight, on DST changes
+    return dt.datetime.combine(date, dt.time(12), patz).timestamp() - 43200
+
+
+class EtaIndex:
+    # Live departure estimates by stop, valid for the feed it was built on
+
+    def __init__(self, ds, updates, positions, now):
+        starttime = time.perf_counter()
+        store = ds.trip_stop_times
+        self.built = now
+        # By feed version rather than reference, as workers get a copy
+        self.feed_version = ds.zipinfo.get("feed_version")
+        self.trip_ids = []
+        self.vehicles = []
+        self.cancelled = set()
+        bases = []
+        starts = []
+        firsts = []
+        ends = []
+        marks = []
+        for tid in dict.fromkeys(list(updates) + list(positions)):
+            update = updates.get(tid)
+            position = positions.get(tid)
+            if tid not in store:
+                continue
+            if update is not None and update["sr"] in ("CANCELED",
+                                                       "CANCELLED"):
+                self.cancelled.add(tid)
+                continue
+            start, end = store.span(tid)
+            nearest = position.get("nearest") if position is not None \
+                else None
+            if nearest is not None and nearest["progress"] >= end - start:
+                # Matched against an earlier dataset
+                nearest = None
+            first = start if nearest is None else start + nearest["progress"]
+            # (row, delay, time) with exactly one of delay and time set
+            tmarks = []
+            if update is not None:
+                reference = update["ts"].timestamp()
+                for seq, stop_id, delay, when in update.get("stus", ()):
+                    if seq is not None:
+                        hits = np.flatnonzero(store.seq[start:end] == seq)
+                    elif stop_id in ds.stopids:
+                        hits = np.flatnonzero(store.sind[start:end] ==
+                                              ds.stopids[stop_id])
+                    else:
+                        continue
+                    if len(hits) > 0 and store.time[start + hits[0]] >= 0 \
+                            and (delay is not None or when is not None):
+                        tmarks.append((start + int(hits[0]), delay, when))
+            elif nearest is not None and store.time[first] >= 0:
+                reference = position["timestamp"].timestamp()
+                tmarks.append((first, None, reference))
+            if len(tmarks) == 0:
+                continue
+            # Pick the service day that puts the first mark closest to when
+            # it was reported; trips after midnight belong to yesterday
+            row, delay, when = tmarks[0]
+            today = now.date()
+            days = [day for day in (today - dt.timedelta(days=1), today) if
+                    runsOn(ds, ds.trip_serv.get(tid), day)]
+            if len(days) == 0:
+                days = [today]
+            target = when if when is not None else reference - delay
+            base = min((serviceDayStart(day) for day in days), key=lambda b:
+                       abs(b + int(store.time[row]) - target))
+            for row, delay, when in tmarks:
+                marks.append((row, delay if delay is not None else
+                              round(when - base) - int(store.time[row])))
+            self.trip_ids.append(tid)
+            self.vehicles.append(update["vid"] if update is not None else
+                                 position["vehicle_id"])
+            bases.append(base)
+            starts.append(start)
+            firsts.append(first)
+            ends.append(end)
+        self.offsets = np.zeros(len(ds.stopinfo) + 1, dtype=np.int64)
+        self.expected = np.zeros(0, dtype=np.int64)
+        self.sched = np.zeros(0, dtype=np.int64)
+        self.trip = np.zeros(0, dtype=np.int32)
+        if len(self.trip_ids) > 0:
+            marks.sort()
+            mrows = np.array([m[0] for m in marks], dtype=np.int64)
+            mdelays = np.array([m[1] for m in marks], dtype=np.int64)
+            lengths = np.array(ends) - np.array(firsts)
+            group = np.repeat(np.arange(len(self.trip_ids)), lengths)
+            rows = np.concatenate([np.arange(f, e) for f, e in
+                                   zip(firsts, ends)])
+            # Latest mark at or before each row, if it is on the same trip
+            k = np.searchsorted(mrows, rows, side="right") - 1
+            keep = (k >= 0) & (mrows[np.maximum(k, 0)] >=
+                               np.array(starts)[group])
+            keep &= (store.sind[rows] >= 0) & (store.time[rows] >= 0)
+            keep &= rows < np.array(ends)[group] - 1
+            rows, group, k = rows[keep], group[keep], k[keep]
+            sched = np.array(bases, dtype=np.int64)[group] + store.time[rows]
+            expected = sched + mdelays[k]
+            sinds = store.sind[rows]
+            order = np.lexsort((expected, sinds))
+            self.expected = expected[order]
+            self.sched = sched[order]
+            self.trip = group[order].astype(np.int32)
+            np.cumsum(np.bincount(sinds, minlength=len(ds.stopinfo)),
+                      out=self.offsets[1:])
+        self.seconds = time.perf_counter() - starttime
+
+    def departures(self, sind, after):
+        # (expected, scheduled, trip_id, vehicle_id) from sind, expected
+        # no earlier than after
+        start, end = self.offsets[sind], self.offsets[sind + 1]
+        start += np.searchsorted(self.expected[start:end], after)
+        return [(expected, sched, self.trip_ids[tind], self.vehicles[tind])
+                for expected, sched, tind in zip(
+                    self.expected[start:end].tolist(),
+                    self.sched[start:end].tolist(),
+                    self.trip[start:end].tolist())]
+
+    def matches(self, ds):
+        return self.feed_version == ds.zipinfo.get("feed_version")
+
+    def stats(self):
+        return {"built": self.built.isoformat(), "trips": len(self.trip_ids),
+                "rows": len(self.expected), "seconds": self.seconds}
+
+
+etaindex = EtaIndex(data, {}, {}, dt.datetime.now(patz))
+
+
+def updateEtas():
+    global etaindex
+    etaindex = EtaIndex(data, trip_updates, trip_positions,
+                        dt.datetime.now(patz))
+
+
+def publishLive():
+    publishShared("live", {"trip_positions": trip_positions,
+                           "positionlastupdate": positionlastupdate,
+                           "trip_updates": trip_updates,
+                           "etaindex": etaindex,
+                           "alertlist": alertlist,
+                           "alertindex": alertindex,
+                           "alertslastupdate": alertslastupdate,
+                           "alertstats": alertstats,
+                           "livestats": livestats})
+
+
+def syncShared():
+    # Before each worker request, at most every SHARED_CHECK seconds
+    global data, timetables, trip_positions, positionlastupdate, trip_updates
+    global etaindex
+    global alertlist, alertindex, alertslastupdate, alertstats, livestats
+    now = time.monotonic()
+    if now - sharedstats["checked"] < SHARED_CHECK:
+        return
+    if not sharedlock.acquire(blocking=False):
+        return
+    try:
+        sharedstats["checked"] = now
+        starttime = time.perf_counter()
+        attached = sharedstats["attached"]
+        for name in ("dataset", "timetables", "live"):
+            rv = attachShared(name, attached.get(name))
+            if rv is None:
+                continue
+            attached[name], obj = rv
+            if name == "dataset":
+                data = obj
+            elif name == "timetables":
+                timetables = obj
+            else:
+                trip_positions = obj["trip_positions"]
+                positionlastupdate = obj["positionlastupdate"]
+                trip_updates = obj["trip_updates"]
+                etaindex = obj["etaindex"]
+                alertlist = obj["alertlist"]
+                alertindex = obj["alertindex"]
+                alertslastupdate = obj["alertslastupdate"]
+                alertstats = obj["alertstats"]
+                livestats = obj["livestats"]
+            sharedstats["attaches"] += 1
+            sharedstats["attach_seconds"] = time.perf_counter() - starttime
+    finally:
+        sharedlock.release()
 
 
-updateFeedInfo(True)
-updateAlerts(True)
-updatePositions()
-updateTripUpdates()
 
 def routeCodeKey(rc):
     if len(rc) < 2:
@@ -502,75 +1924,14 @@ def routeCodeKey(rc):
             return rc
 
 
-def sortedRouteCodes():
-    rcodes = list(routelist.keys())
+def sortedRouteCodes(ds):
+    rcodes = list(ds.routelist.keys())
     if rcodes is None or len(rcodes) == 0:
         return None
     rcodes.sort(key=routeCodeKey)
     return rcodes
 
 
-def planeDistance2(lat1, lon1, lat2, lon2):
-    rlat1 = pi/180 * lat1
-    rlon1 = pi/180 * lon1
-    rlat2 = pi/180 * lat2
-    rlon2 = pi/180 * lon2
-    pm = (rlat1 + rlat2)/2
-    dlat = rlat1 - rlat2
-    dlon = rlon1 - rlon2
-    return Rm2 * (dlat**2 + (cos(pm) * dlon)**2)
-
-
-def headingdeg(bearing):
-    br = bearing % 360
-    if br < 45*0.5:
-        return "N"
-    if br < 45*1.5:
-        return "NE"
-    if br < 45 * 2.5:
-        return "E"
-    if br < 45 * 3.5:
-        return "SE"
-    if br < 45 * 4.5:
-        return "S"
-    if br < 45 * 5.5:
-        return "SW"
-    if br < 45 * 6.5:
-        return "W"
-    if br < 45 * 7.5:
-        return "NW"
-    return "N"
-
-
-def heading(dlat, dlon):
-    if dlon == 0:
-        if dlat > 0:
-            return "N"
-        else:
-            return "S"
-    adeg = atan(dlat / dlon) * 180 / pi
-    if dlon > 0:
-        if adeg > 45*1.5:
-            return "N"
-        if adeg > 45*0.5:
-            return "NE"
-        if adeg > -45*0.5:
-            return "E"
-        if adeg > -45*1.5:
-            return "SE"
-        return "S"
-    else:
-        if adeg > 45*1.5:
-            return "S"
-        if adeg > 45*0.5:
-            return "SW"
-        if adeg > -45*0.5:
-            return "W"
-        if adeg > -45*1.5:
-            return "NW"
-        return "N"
-
-
 def footerData():
     return {
         "alerts": len(alertlist),
@@ -579,16 +1940,24 @@ def footerData():
 
 
 def prettyDistance(dist, fig=1):
+    if dist <= 0:
+        return 0
     return floor(round(dist, fig - 1 -floor(log10(dist))))
 
 
-def tripTimeTable(tripData, routeCode, tableID, timepoints_only = False):
+def tripTimeTable(ds, tripData, routeCode, tableID, timepoints_only = False):
     if len(tripData) == 0:
         return None
+    return timetableHtml(ds, routeCode, tableID,
+                         *timetableGrid(ds, tripData, timepoints_only))
+
+
+def timetableGrid(ds, tripData, timepoints_only):
+    # (trip_ids, start times, [(stop_id, sind, pin, anytp, times)])
     trip_ids = [trip["trip_id"] for trip in tripData]
 
-    trip_times = {tid: trip_stop_times[tid] for tid in trip_ids if tid in
-                  trip_stop_times}
+    trip_times = {tid: ds.trip_stop_times.stops(tid) for tid in trip_ids if tid
+                  in ds.trip_stop_times}
     dupes = set()
     for tid in trip_times:
         counter = dict(Counter([x["sind"] for x in
@@ -609,84 +1978,99 @@ def tripTimeTable(tripData, routeCode, tableID, timepoints_only = False):
     start_times = {tid: trip_times[tid][0].get("time") for tid in trip_times}
     trip_ids = [tid for tid in sorted(trip_ids, key=lambda x:
                                       start_times.get(x)) if tid in
-                trip_stop_times]
-    long_d = [{
-        "trip_id": trip_id,
-        "stop_id": stopt.get("id"),
-        "pin": stopt.get("pin"),
-        "sind": stopt.get("sind"),
-        "seq": stopt.get("seq"),
-        "time": stopt.get("time"),
-        "tp": stopt.get("tp")}
-        for trip_id in trip_times for stopt in trip_times[trip_id] if
-        stopt.get("tp") or not timepoints_only]
-    trip_long = pd.DataFrame(long_d)
-    trip_p = trip_long.pivot(index = ["stop_id", "sind", "pin"],
-                             columns = "trip_id",
-                             values = ["seq", "time", "tp"])
-
-
-    #trip_p.sort_values(list(zip(["time"] * len(trip_ids), trip_ids)),
-    #                   key=cmp_to_key(cmpttrows), inplace=True)
-    for trip_id in trip_ids:
-        trip_p[("time", trip_id)] = trip_p[("time", trip_id)].fillna('')
-        trip_p[("tp", trip_id)] = trip_p[("tp", trip_id)].fillna(False)
-    seqcols = trip_p.loc[:, [("seq", trip_id) for trip_id in trip_ids]]
-    trip_p["orderer"] = seqcols.apply(lambda x: max(
-        [int(y) for y in x if not pd.isna(y)]), axis=1)
-    trip_p["atp"] = trip_p.loc[:, [("tp", trip_id) for trip_id in
-                                   trip_ids]].apply(any, axis=1)
-
-    trip_p.sort_values(["orderer", "pin"], inplace=True)
-    trip_p.reset_index(inplace=True)
-    trip_p.columns = [''.join(col).strip() for col in trip_p.columns.values]
-
-    relcols = ["time" + tid for tid in trip_ids]
-
-    def cmpttrows(rowi1, rowi2):
-        row1 = trip_p.loc[:, relcols].iloc[rowi1].replace('', pd.NA)
-        row2 = trip_p.loc[:, relcols].iloc[rowi2].replace('', pd.NA)
-        if any(row1 > row2):
-            return 1
-        elif any(row1 < row2):
-            return -1
-        else:
-            fr1 = min([x for x, q in enumerate(row1) if q is not pd.NA])
-            fr2 = min([x for x, q in enumerate(row2) if q is not pd.NA])
-            if fr1 > fr2:
-                return 1
-            elif fr1 < fr2:
-                return -1
+                ds.trip_stop_times]
+    ncols = len(trip_ids)
+
+    # One row per stop visit, keyed as (stop_id, sind, pin)
+    rowkeys = {}
+    cells = []
+    for col, tid in enumerate(trip_ids):
+        for stopt in trip_times[tid]:
+            if stopt["tp"] or not timepoints_only:
+                key = (stopt["id"], stopt["sind"], stopt["pin"])
+                row = rowkeys.setdefault(key, len(rowkeys))
+                cells.append((row, col, stopt))
+    nrows = len(rowkeys)
+    times = [[''] * ncols for _ in range(nrows)]
+    atp = [False] * nrows
+    orderer = [0] * nrows
+    for row, col, stopt in cells:
+        times[row][col] = stopt["time"]
+        atp[row] = atp[row] or stopt["tp"]
+        orderer[row] = max(orderer[row], stopt["seq"])
+    keys = list(rowkeys)
+    rank = [0] * nrows
+    for pos, row in enumerate(sorted(range(nrows), key=lambda x:
+                                     (orderer[x], keys[x][2], keys[x]))):
+        rank[row] = pos
+
+    # Each trip orders the rows it has a time for; rows that no trip
+    # orders go by the first trip serving them, then by stop sequence.
+    first = [ncols] * nrows
+    after = [[] for _ in range(nrows)]
+    indeg = [0] * nrows
+    for col in range(ncols):
+        timed = sorted((times[row][col], row) for row in range(nrows) if
+                       times[row][col] != '')
+        groups = []
+        for stime, row in timed:
+            first[row] = min(first[row], col)
+            if len(groups) > 0 and groups[-1][0] == stime:
+                groups[-1][1].append(row)
             else:
-                return 0
-
-    excols = list(range(0, trip_p.shape[0]))
-    excols.sort(key=cmp_to_key(cmpttrows))
-    trip_p["fullsort"] = argsort(excols)
-    trip_p.sort_values("fullsort", inplace=True)
-    trip_p["names"] = [stopinfo[sid]["stop_name"] for sid in trip_p["sind"]]
-    trip_p["sms"] = [stopinfo[sid]["parent_station"] if
-                     stopinfo[sid]["parent_station"] != "" else
-                     stopinfo[sid]["stop_id"] for sid in trip_p["sind"]]
-    trip_p["stop_id"] = trip_p["sms"]
-    trip_p["zone"] = [stopinfo[sid]["zone_id"] for sid in trip_p["sind"]]
-    trip_p["rowid"] = trip_p.apply(lambda x:
-                                   "{}-stop-{}".format(tableID, x["sms"]) if
-                                      x["pin"] == 0 else
-                                      "{}-stop-{}-{}".format(tableID,
-                                                             x["sms"],
-                                                          x["pin"]),
-                                      axis=1)
-    tt_dict = trip_p.to_dict('records')
-
-    table_spec = create_table(base=TimeTableBase)
-
-    for trip in trip_ids:
-        table_spec = table_spec.add_column("time" + trip,
-                                           Col(start_times.get(trip)[:5],
-                                               td_html_attrs = {"class": "tcol"}))
-    tt_draft = table_spec(tt_dict)
-    tbody = tt_draft.tbody()
+                groups.append((stime, [row]))
+        for (_, prevs), (_, nexts) in zip(groups, groups[1:]):
+            for prev in prevs:
+                for nxt in nexts:
+                    after[prev].append(nxt)
+                    indeg[nxt] += 1
+    ready = [(first[row], rank[row], row) for row in range(nrows) if
+             indeg[row] == 0]
+    heapq.heapify(ready)
+    order = []
+    placed = [False] * nrows
+    while len(order) < nrows:
+        if len(ready) == 0:
+            # Trips disagree on the order; take the earliest remaining
+            row = min((x for x in range(nrows) if not placed[x]),
+                      key=lambda x: (first[x], rank[x]))
+            indeg[row] = 0
+        else:
+            row = heapq.heappop(ready)[2]
+            if placed[row]:
+                continue
+        placed[row] = True
+        order.append(row)
+        for nxt in after[row]:
+            indeg[nxt] -= 1
+            if indeg[nxt] == 0 and not placed[nxt]:
+                heapq.heappush(ready, (first[nxt], rank[nxt], nxt))
+
+    return trip_ids, start_times, [keys[row] + (atp[row], times[row]) for row
+                                   in order]
+
+
+def timetableHtml(ds, routeCode, tableID, trip_ids, start_times, rows):
+    # Same markup as a flask_table grid of stop columns then one "tcol"
+    # column per trip; the times are secsToTime() output, safe unescaped
+    trs = []
+    for stop_id, sind, pin, anytp, times in rows:
+        inf = ds.stopinfo[sind]
+        sms = (inf["parent_station"] if inf["parent_station"] != "" else
+               inf["stop_id"])
+        rowid = ("{}-stop-{}".format(tableID, sms) if pin == 0 else
+                 "{}-stop-{}-{}".format(tableID, sms, pin))
+        trs.append("".join([
+            '<tr class="timepoint" id="' if anytp else '<tr id="',
+            escape(rowid), '"><td><a href="',
+            escape(url_for("timetable", stop=sms)), '">', escape(sms),
+            "</a></td><td>", escape(inf["stop_name"]),
+            "</td><td class=\"ac\"><a href='#", rowid, "'>§</a></td>",
+            '<td class="centrecol">', escape(inf["zone_id"]),
+            '</td><td class="tcol">',
+            '</td><td class="tcol">'.join(times), "</td></tr>"]))
+    tbody = "<tbody>\n{}\n</tbody>".format("\n".join(trs)) if len(trs) > 0 \
+        else ""
     theader = "<th>Code</th>\n<th>Stop</th><th></th>\n<th>Zone</th>\n" + "\n".join([
                 "<th><a href='/route/{}/?trip={}'>{}</a></th>".format(
                     quote(routeCode, safe=""), quote(tid, safe=""),
@@ -697,7 +2081,193 @@ def tripTimeTable(tripData, routeCode, tableID, timepoints_only = False):
     return(ttable)
 
 
-class TimeTable(Table):
+class TimetableStore:
+    # Compressed table HTML, shared by days running the same services
+
+    def __init__(self, feed_version):
+        self.feed_version = feed_version
+        self.days = {}
+        self.tables = {}
+        self.done = False
+
+    def get(self, rquery, offset, tponly):
+        key = self.days.get((rquery, offset))
+        entry = self.tables.get((rquery, key, tponly))
+        if entry is None:
+            return None
+        return tuple(None if table is None else
+                     zlib.decompress(table).decode("utf-8")
+                     for table in entry)
+
+    def nbytes(self):
+        return sum(len(table) for entry in self.tables.values() for table in
+                   entry if table is not None)
+
+    def __getstate__(self):
+        # Pickle the tables as spans of one array, which publishShared()
+        # can hand to workers without a copy
+        state = self.__dict__.copy()
+        chunks = []
+        spans = {}
+        offset = 0
+        for key, entry in self.tables.items():
+            span = []
+            for table in entry:
+                if table is None:
+                    span.append(None)
+                    continue
+                chunks.append(table)
+                span.append((offset, offset + len(table)))
+                offset += len(table)
+            spans[key] = tuple(span)
+        state["tables"] = spans
+        state["blob"] = np.frombuffer(b"".join(chunks), dtype=np.uint8)
+        return state
+
+    def __setstate__(self, state):
+        blob = state.pop("blob")
+        state["tables"] = {key: tuple(None if span is None else
+                                      blob[span[0]:span[1]] for span in spans)
+                           for key, spans in state["tables"].items()}
+        self.__dict__.update(state)
+
+
+timetables = TimetableStore(None)
+
+
+def routeDayTrips(ds, routeinfo, date):
+    return [ds.trip_index[t] for t in
+            ds.routetrips.get(routeinfo["route_id"], []) if
+            runsOn(ds, ds.trip_serv.get(t), date)]
+
+
+def routeDayTables(ds, rquery, day_trips, tponly):
+    # Outbound trips
+    out_trips = [trip for trip in day_trips if trip.get("direction_id") != "1"]
+    out_table = tripTimeTable(ds, out_trips, rquery, "outbound-timetable", tponly)
+    # Inbound trips
+    in_trips = [trip for trip in day_trips if trip.get("direction_id") == "1"]
+    in_table = tripTimeTable(ds, in_trips, rquery, "inbound-timetable", tponly)
+    return out_table, in_table
+
+
+def prerenderJob(ds, rquery, services, tponly):
+    routeinfo = ds.routelist[rquery]
+    day_trips = [ds.trip_index[t] for t in
+                 ds.routetrips.get(routeinfo["route_id"], []) if
+                 ds.trip_serv.get(t) in services]
+    with app.test_request_context():
+        tables = routeDayTables(ds, rquery, day_trips, tponly)
+    return tuple(None if table is None else zlib.compress(table.encode("utf-8"))
+                 for table in tables)
+
+
+def prerenderTimetables(ds):
+    global timetables
+    starttime = time.perf_counter()
+    store = TimetableStore(ds.zipinfo.get("feed_version"))
+    jobs = set()
+    for rquery, routeinfo in ds.routelist.items():
+        rservs = sorted(set(ds.trip_serv.get(t) for t in
+                            ds.routetrips.get(routeinfo["route_id"], []) if
+                            ds.trip_serv.get(t) in ds.serv_days))
+        for offset in range(0, ds.cal_days):
+            key = tuple(sid for sid in rservs if
+                        ds.serv_days[sid] >> offset & 1)
+            store.days[(rquery, offset)] = key
+            jobs.update((rquery, key, tponly) for tponly in (True, False))
+    timetables = store
+    print("Prerendering {} timetables for feed {}".format(
+        len(jobs), store.feed_version))
+    with ThreadPoolExecutor(max_workers=PRERENDER_WORKERS) as pool:
+        futures = {pool.submit(prerenderJob, ds, job[0], set(job[1]),
+                               job[2]): job for job in jobs}
+        for n, future in enumerate(as_completed(futures), 1):
+            if data is not ds:
+                for other in futures:
+                    other.cancel()
+                print("Prerender of feed {} abandoned, dataset reloaded".format(
+                    store.feed_version))
+                return
+            try:
+                store.tables[futures[future]] = future.result()
+            except Exception as e:
+                print("Error prerendering {}:".format(futures[future]))
+                print(e)
+            if n % 500 == 0:
+                print("Prerendered {}/{} timetables".format(n, len(futures)))
+    store.done = True
+    publishShared("timetables", store)
+    print("Prerendered {} timetables in {:.2f}s ({:.1f} MB compressed)".format(
+        len(store.tables), time.perf_counter() - starttime,
+        store.nbytes() / 1e6))
+
+
+def afterLoad(ds):
+    starttime = time.perf_counter()
+    prerenderTimetables(ds)
+    if timetables.done and "timetables" not in startupstats["phases"]:
+        recordPhase("timetables", starttime, True)
+    if MEMORY_HISTORY > 0 and data is ds:
+        recordMemory("load")
+
+
+def htmlAttrs(attrs):
+    return "".join(' {}="{}"'.format(escape(name), escape(value)) for
+                   name, value in sorted(attrs.items()))
+
+
+def tdRenderer(key, col):
+    # Function from an item to the <td> flask_table would give it
+    start = "<td{}>".format(htmlAttrs(col.td_html_attrs))
+    if type(col) is Col and len(col.get_attr_list(key)) == 1:
+        name = col.get_attr_list(key)[0]
+
+        def td(item, urls):
+            value = item[name]
+            return "{}{}</td>".format(start, escape("" if value is None else
+                                                     value))
+        return td
+    if type(col) is LinkCol and len(col.anchor_attrs) == 0:
+        attr_list = col.get_attr_list(None)
+
+        def td(item, urls):
+            # urls memoises url_for across the rows of one render
+            kwargs = col.url_kwargs(item)
+            ukey = (key, tuple(sorted(kwargs.items())))
+            url = urls.get(ukey)
+            if url is None:
+                url = urls[ukey] = escape(url_for(col.endpoint, **kwargs))
+            return '{}<a href="{}">{}</a></td>'.format(
+                start, url, escape(col.text(item, attr_list)))
+        return td
+    return lambda item, urls: col.td(item, key)
+
+
+class FastTable(Table):
+    # Same markup as Table, with each column's cell rendering prepared once
+
+    @classmethod
+    def renderers(cls):
+        if "_renderers" not in cls.__dict__:
+            cls._renderers = [tdRenderer(key, col) for key, col in
+                              cls._cols.items() if col.show]
+        return cls._renderers
+
+    def tbody(self):
+        tds = self.renderers()
+        rowattrs = type(self).get_tr_attrs is not Table.get_tr_attrs
+        urls = {}
+        trs = ["<tr{}>{}</tr>".format(
+                   htmlAttrs(self.get_tr_attrs(item)) if rowattrs else "",
+                   "".join([td(item, urls) for td in tds]))
+               for item in self.items]
+        if len(trs) == 0:
+            return ""
+        return "<tbody>\n{}\n</tbody>".format("\n".join(trs))
+
+
+class TimeTable(FastTable):
     routeCol = LinkCol("Route", "routeInfo", th_html_attrs={"title": "Route"},
                     url_kwargs=dict(rquery="rname", trip="trip_id"),
                        attr='route')
@@ -709,7 +2279,7 @@ class TimeTable(Table):
     classes = ["cleantable"]
 
 
-class StopTable(Table):
+class StopTable(FastTable):
     code = LinkCol("Code", "timetable", url_kwargs=dict(stop="sms"),
                    attr='code')
     stop = Col("Stop")
@@ -718,7 +2288,7 @@ class StopTable(Table):
     classes = ["cleantable"]
 
 
-class StopTimeTable(Table):
+class StopTimeTable(FastTable):
     code = LinkCol("Code", "timetable",
                    url_kwargs=dict(stop="sms"),
                    attr='code')
@@ -739,7 +2309,7 @@ class StopTimeTable(Table):
         return trattrs
 
 
-class LocationTable(Table):
+class LocationTable(FastTable):
     code = LinkCol("Code", "timetable", url_kwargs=dict(stop="sms"),
                    attr='code')
     stop = Col("Stop")
@@ -749,14 +2319,14 @@ class LocationTable(Table):
     classes = ["cleantable"]
 
 
-class DateTable(Table):
+class DateTable(FastTable):
     day = Col("Day")
     date = Col("Date", td_html_attrs = {"class": "datecol"})
     table_id = "datetable"
     classes = ["cleantable"]
 
 
-class TripTable(Table):
+class TripTable(FastTable):
     vehcol = LinkCol("Vehicle ID", "routeInfo",
                      url_kwargs=dict(rquery="rname", trip="trip_id"),
                      attr="vehicle",
@@ -773,28 +2343,7 @@ class TripTable(Table):
     classes = ["cleantable"]
 
 
-class SelfAnchorCol(Col):
-    def td_contents(self, item, attr_list):
-        return "<a href='#{}'>{}</a>".format(
-            item["rowid"], attr_list["text"]
-        )
-
-class TimeTableBase(Table):
-    stop_id = LinkCol("Code", "timetable",
-                      url_kwargs=dict(stop="sms"), attr='stop_id')
-    names = Col("Stop")
-    anch = SelfAnchorCol("sdf", attr_list = dict(text="§"),
-                         td_html_attrs = {"class": "ac"})
-    zone = Col("Zone", td_html_attrs = {"class": "centrecol"})
-    
-    def get_tr_attrs(self, item):
-        tratts = {"id": item["rowid"]}
-        if item.get("atp"):
-            tratts.update({"class": "timepoint"})
-        return tratts
-
-
-class VehicleTable(Table):
+class VehicleTable(FastTable):
     routecol = LinkCol("Route", "routeInfo",
                        url_kwargs=dict(rquery="rname"),
                        attr="route",
@@ -811,6 +2360,8 @@ class VehicleTable(Table):
                     th_html_attrs={"title":
                                    "Time of departure from initial stop"},
                     td_html_attrs={"class": "centrecol"})
+    near = Col("Near",
+               th_html_attrs={"title": "Nearest stop on the trip"})
     status = Col("Status",
                     th_html_attrs={"title":
                                    "Status"})
@@ -819,23 +2370,132 @@ class VehicleTable(Table):
     classes = ["cleantable"]
 
 
-cache = Cache(config={'CACHE_TYPE': 'FileSystemCache',
-                      'CACHE_DIR': '/tmp/RTI-cache/',
-                      'CACHE_THRESHOLD': 50})
 app = Flask(__name__)
 scheduler = APScheduler()
 scheduler.init_app(app)
-scheduler.start()
-cache.init_app(app)
-
-app.apscheduler.add_job(func=updateFeedInfo, trigger="cron", args=[True, True],
-                        minute='11', hour='3', id="ufeedinfo")
-app.apscheduler.add_job(func=updateAlerts, trigger="cron", args=[True],
-                        minute='*/5', id="ualerts")
-app.apscheduler.add_job(func=updatePositions, trigger="cron", minute="*",
-                        id="upos")
-app.apscheduler.add_job(func=updateTripUpdates, trigger="cron", minute="*/2",
-                        id="utrip")
+
+
+@app.before_request
+def requestStarted():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def requestFinished(response):
+    # Registered first, so it runs after every other after_request hook
+    endpoint = request.endpoint or "none"
+    if "started" in g:
+        requestseconds.observe((endpoint,), time.perf_counter() - g.started)
+    requestcodes.add((endpoint, response.status_code))
+    return response
+
+
+if RTI_ROLE == "worker":
+    app.before_request(syncShared)
+
+# Endpoints that answer before the dataset is loaded
+warmendpoints = {"static", "static_page", "showHealth", "showReady",
+                 "showStats", "showMetrics", "adminMemory",
+                 "adminMemoryTrace"}
+warmingpage = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+               '<meta http-equiv="refresh" content="{}">'
+               '<title>Warming up</title></head><body><p>The timetables are '
+               'still loading; this page will retry in a few seconds.</p>'
+               '</body></html>\n').format(WARMUP_RETRY_AFTER)
+
+
+@app.before_request
+def warmingUp():
+    # Until the first dataset is in, pages that need it get a cheap 503
+    if "feed_version" in data.zipinfo or request.endpoint in warmendpoints:
+        return None
+    if request.path.startswith("/api/"):
+        response = jsonify({"error": "Warming up"})
+        response.status_code = 503
+    else:
+        response = app.response_class(warmingpage, status=503,
+                                      mimetype="text/html")
+    response.headers["Retry-After"] = str(WARMUP_RETRY_AFTER)
+    return response
+
+
+def pageTag():
+    # Weak ETag for pages that only change with the feed and live state
+    ds = data
+    endpoint = request.endpoint
+    if endpoint not in ("routeInfo", "nearbyStops", "nearbyLocation",
+                        "stopsearch", "routeTimetable", "apiRoute",
+                        "apiTimetable"):
+        return None
+    if "feed_version" not in ds.zipinfo:
+        return None
+    ra = request.args
+    parts = [ds.zipinfo["feed_version"], endpoint,
+             sorted((request.view_args or {}).items()),
+             sorted(ra.items(multi=True))]
+    if endpoint in ("routeInfo", "apiRoute"):
+        if "trip" in ra and ra["trip"] != "" and ra["trip"] != "none":
+            return None
+        # The route page also lists its vehicles and alerts
+        parts += [positionlastupdate, alertslastupdate]
+    elif endpoint in ("routeTimetable", "apiTimetable"):
+        parts.append(dt.datetime.now(patz).date())
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def freshFor(updated, interval):
+    # Seconds until data last updated at updated is due a refresh
+    age = (dt.datetime.now(patz) - updated).total_seconds()
+    return int(min(max(interval - age, 0), interval))
+
+
+@app.before_request
+def notModified():
+    # Answer revalidations before the handler does any work
+    g.etag = pageTag() if request.method in ("GET", "HEAD") else None
+    if g.etag is not None and request.if_none_match.contains_weak(g.etag):
+        response = app.response_class(status=304)
+        response.set_etag(g.etag, weak=True)
+        response.cache_control.no_cache = True
+        # As the 200 it stands for, which compressResponse() marks
+        response.vary.add("Accept-Encoding")
+        return response
+    return None
+
+
+@app.after_request
+def cacheHeaders(response):
+    if response.status_code != 200:
+        return response
+    if g.get("etag") is not None:
+        response.set_etag(g.etag, weak=True)
+    if g.get("maxage") is not None:
+        response.cache_control.max_age = g.maxage
+    elif g.get("etag") is not None:
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.after_request
+def compressResponse(response):
+    # Runs before cacheHeaders; the weak ETag still holds for either body
+    if (response.status_code != 200 or response.direct_passthrough or
+            "Content-Encoding" in response.headers or
+            response.mimetype not in ("text/html", "application/json")):
+        return response
+    response.vary.add("Accept-Encoding")
+    accepted = request.accept_encodings
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN:
+        return response
+    if brotli is not None and accepted["br"] > 0:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"] > 0:
+        response.set_data(gzip.compress(body, GZIP_LEVEL, mtime=0))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
 
 def stopExtract(code, name):
     z = re.match("{} - (.*)".format(code), name)
@@ -861,6 +2521,155 @@ def statusString(service):
         return status
 
 
+def fetchPredictions(stop):
+    req = upstream.get("predictions", params={"stop_id": stop})
+    return req.status_code, req.json() if req.status_code == 200 else None
+
+
+class PredictionCache:
+    # Misses share one call; stale entries are served while one refreshes
+
+    def __init__(self, fetch, ttl, stale):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale = stale
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.inflight = {}
+        self.purged = time.monotonic()
+        self.counts = {"hits": 0, "stale": 0, "misses": 0, "coalesced": 0,
+                       "upstream": 0, "errors": 0}
+
+    def get(self, key, timeout=None):
+        lead = False
+        with self.lock:
+            now = time.monotonic()
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.counts["hits"] += 1
+                return entry
+            if entry is not None and now - entry[0] < self.ttl + self.stale:
+                self.counts["stale"] += 1
+                if key not in self.inflight:
+                    self.inflight[key] = flight = {"done": threading.Event()}
+                    threading.Thread(target=self.refresh, args=(key, flight),
+                                     daemon=True).start()
+                return entry
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.counts["coalesced"] += 1
+            else:
+                self.counts["misses"] += 1
+                self.inflight[key] = flight = {"done": threading.Event()}
+                lead = True
+        if lead and timeout is None:
+            self.refresh(key, flight)
+        elif lead:
+            threading.Thread(target=self.refresh, args=(key, flight),
+                             daemon=True).start()
+        if not flight["done"].wait(timeout):
+            return None
+        if "error" in flight:
+            raise flight["error"]
+        return flight["entry"]
+
+    def refresh(self, key, flight):
+        try:
+            flight["entry"] = ((time.monotonic(), dt.datetime.now(patz)) +
+                               self.fetch(key))
+        except Exception as e:
+            flight["error"] = e
+        with self.lock:
+            self.counts["upstream"] += 1
+            if "error" in flight:
+                self.counts["errors"] += 1
+            else:
+                self.entries[key] = flight["entry"]
+            del self.inflight[key]
+            self.purge()
+        flight["done"].set()
+
+    def purge(self):
+        now = time.monotonic()
+        if now - self.purged < self.ttl + self.stale:
+            return
+        self.purged = now
+        self.entries = {k: v for k, v in self.entries.items() if
+                        now - v[0] < self.ttl + self.stale}
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, entries=len(self.entries),
+                        inflight=len(self.inflight))
+
+
+predictions = PredictionCache(fetchPredictions, PREDICTION_TTL,
+                              PREDICTION_STALE)
+localstats = {"answers": 0, "fallbacks": 0}
+
+
+def localDepartures(ds, eta, stop, now):
+    # A stop-predictions answer from the ETA index and timetable alone
+    sind = ds.stopids[stop]
+    nowts = now.timestamp()
+    rows = []
+    live = set()
+    cancelled = set()
+    # Until it is rebuilt after a reload, the index describes another feed
+    if eta.matches(ds):
+        rows = [(expected, trip_id, sched, expected, vid) for expected, sched,
+                trip_id, vid in eta.departures(sind, nowts - 30) if trip_id
+                in ds.trip_index]
+        live = set(eta.trip_ids)
+        cancelled = eta.cancelled
+    for day in (now.date() - dt.timedelta(days=1), now.date()):
+        services = set(activeServices(ds, day))
+        base = serviceDayStart(day)
+        for trip_id, secs in ds.trip_stop_times.departures(
+                sind, nowts - base - 30, nowts - base + LOCAL_HORIZON):
+            if trip_id not in live and ds.trip_serv.get(trip_id) in services:
+                rows.append((base + secs, trip_id, base + secs, None, None))
+    rows.sort()
+    departures = []
+    for _, trip_id, sched, expected, vid in rows[:LOCAL_DEPARTURES]:
+        trip = ds.trip_index[trip_id]
+        delay = None if expected is None else expected - sched
+        departures.append({
+            "stop_id": stop,
+            "service_id": ds.servroute.get(trip["route_id"], ""),
+            "destination": {"name": trip.get("trip_headsign", "")},
+            "trip_id": trip_id,
+            "vehicle_id": vid,
+            "departure": {
+                "aimed": dt.datetime.fromtimestamp(sched, patz).isoformat(),
+                "expected": None if expected is None else
+                    dt.datetime.fromtimestamp(expected, patz).isoformat()},
+            "status": "cancelled" if trip_id in cancelled else None if
+                delay is None else "ontime" if abs(delay) < 60 else
+                "delayed" if delay > 0 else "early"})
+    return {"farezone": ds.stopinfo[sind]["zone_id"],
+            "departures": departures}
+
+
+def stopPredictions(ds, stop):
+    # (fetched, status, response) from upstream or the local ETA index
+    local = LOCAL_PREDICTIONS != "off" and stop in ds.stopids
+    if not local or LOCAL_PREDICTIONS != "only":
+        try:
+            entry = predictions.get(stop, PREDICTION_WAIT if local else None)
+        except requests.RequestException:
+            if not local:
+                raise
+            entry = None
+        if entry is not None and (not local or entry[2] < 500):
+            return entry[1:]
+        localstats["fallbacks"] += 1
+    localstats["answers"] += 1
+    eta = etaindex
+    return eta.built, 200, localDepartures(ds, eta, stop,
+                                           dt.datetime.now(patz))
+
+
 def validDates(dates):
     if dates is None or len(dates) == 0:
         return None
@@ -891,6 +2700,18 @@ def validDates(dates):
     }
 
 
+def nearbyRows(ds, lat, lon, inds, dist2s):
+    return [{"code": x["stop_id"],
+             "sms": x["parent_station"] if x["parent_station"] != "" else
+             x["stop_id"],
+             "stop": x["stop_name"],
+             "zone": x["zone_id"],
+             "distance": "{}m {}".format(
+                 prettyDistance(sqrt(dist2)),
+                 heading(x["stop_lat"] - lat, x["stop_lon"] - lon))}
+            for x, dist2 in zip([ds.stopinfo[ind] for ind in inds], dist2s)]
+
+
 @app.route("/robots.txt")
 def static_page():
     return send_from_directory(app.static_folder, request.path[1:])
@@ -898,7 +2719,7 @@ def static_page():
 
 @app.route("/")
 def rti():
-    return render_template("main.html", routes=sortedRouteCodes(),
+    return render_template("main.html", routes=sortedRouteCodes(data),
                            footer=footerData())
 
 
@@ -913,20 +2734,19 @@ def Search():
 
 @app.route("/stop/<string:stop>/")
 def timetable(stop):
-    req = requests.get(depurl, params={"stop_id": stop}, headers=headers,
-                       timeout=20)
-    if req.status_code != 200:
-        if stop in stopids:
-            parent = stopinfo[stopids[stop]]["parent_station"]
+    ds = data
+    fetched, status, rv = stopPredictions(ds, stop)
+    if status != 200:
+        if stop in ds.stopids:
+            parent = ds.stopinfo[ds.stopids[stop]]["parent_station"]
             if parent != "":
                 return redirect("/stop/{}/".format(parent.strip()), 302, None)
         return render_template("nostop.html",
-                               error=req.status_code,
+                               error=status,
                                footer=footerData())
     stopname = "Unknown Stop"
-    if stop in stopids:
-        stopname = stopinfo[stopids[stop]]["stop_name"]
-    rv = req.json()
+    if stop in ds.stopids:
+        stopname = ds.stopinfo[ds.stopids[stop]]["stop_name"]
     lastup = dt.datetime.now(patz)
     if "departures" in rv:
         ttdat = [{"route": s["service_id"], "rname": s["service_id"],
@@ -944,153 +2764,150 @@ def timetable(stop):
         tTable = TimeTable(ttdat)
         seen_routes = [t["route"] for t in ttdat]
         seen_trips = [t["trip_id"] for t in ttdat]
-        rel_alerts = [a for a in alertlist if
-                      stop in a["stops"] or
-                      any([x in a["routes"] for x in seen_routes]) or
-                      any([x in a["trips"] for x in seen_trips])]
+        rel_alerts = alertindex.lookup(stops=[stop], routes=seen_routes,
+                                       trips=seen_trips)
     else:
-        if stop in stopids:
+        if stop in ds.stopids:
             print(stop)
-            parent = stopinfo[stopids[stop]]["parent_stop"]
+            parent = ds.stopinfo[ds.stopids[stop]]["parent_stop"]
             print(parent)
             if parent != "":
                 return redirect("/stop/{}/".format(parent.strip()), 302, None)
         ttdat = []
         rel_alerts = []
+    g.maxage = freshFor(fetched, PREDICTION_TTL)
     return render_template("stop.html", stopnumber=stop,
                            stopname=stopname,
                            zone=rv["farezone"] if "farezone" in rv else "?",
-                           lup=lastup.strftime("%H:%M:%S, %A %B %-d"),
+                           lup=fetched.strftime("%H:%M:%S, %A %B %-d"),
                            table=tTable if len(ttdat) > 0 else None,
                            alerts=rel_alerts,
                            footer=footerData())
 
 
+@app.route("/stats/")
+def showStats():
+    return jsonify({"predictions": predictions.stats(),
+                    "upstream": upstream.stats(),
+                    "alerts": dict(alertstats, count=len(alertlist)),
+                    "live": livestats,
+                    "eta": dict(etaindex.stats(), **localstats),
+                    "shared": sharedstats,
+                    "startup": startupstats})
+
+
 @app.route("/search/")
 def stopsearch():
+    ds = data
     query = request.args["q"].strip() if "q" in request.args else ""
     if query == "":
         return render_template("badsearch.html",
-                               lup=stoplastupdate.strftime("%A %B %-d"),
+                               lup=ds.loaded.strftime("%A %B %-d"),
                                footer=footerData())
-    qlower = query.lower()
-    ranknames = [(name, fuzz.token_set_ratio(name.lower(), qlower)) for name in
-               list(stopnames.keys())]
-    toprank = [tup for tup in ranknames if tup[1] > 40]
+    toprank = ds.stopsearch.search(query)
     if len(toprank) == 0:
         return render_template("badsearch.html", footer=footerData())
-    toprank.sort(reverse=True, key=lambda a: a[1])
-    stdat = [{"code": stopnames[name], "sms": stopinfo[stopids[stopnames[name]]]["parent_station"] if
-              stopinfo[stopids[stopnames[name]]]["parent_station"] != "" else stopnames[name], "stop":
+    stdat = [{"code": ds.stopnames[name], "sms": ds.stopinfo[ds.stopids[ds.stopnames[name]]]["parent_station"] if
+              ds.stopinfo[ds.stopids[ds.stopnames[name]]]["parent_station"] != "" else ds.stopnames[name], "stop":
               name, "zone":
-              stopinfo[stopids[stopnames[name]]]["zone_id"]}
+              ds.stopinfo[ds.stopids[ds.stopnames[name]]]["zone_id"]}
              for name, ratio in toprank[:20]]
     sTable = StopTable(stdat)
     return render_template("search.html", searchstring=query,
                            numres=len(stdat),
-                           lup=stoplastupdate.strftime("%A %B %-d"),
+                           lup=ds.loaded.strftime("%A %B %-d"),
                            table=sTable if len(stdat) > 0 else "",
                            footer=footerData())
 
 
 @app.route("/route/")
 def ttSearch():
+    ds = data
     ra = request.args
     if "trip" in ra:
-        thisroute = [x["route_id"] for x in triplist if x["trip_id"] ==
-                     ra["trip"]]
-        if len(thisroute) > 0:
-            return redirect("/route/{}/?trip={}".format(servroute[thisroute[0]],
-                                                        ra["trip"]))
+        thistrip = ds.trip_index.get(ra["trip"])
+        if thistrip is not None:
+            return redirect("/route/{}/?trip={}".format(
+                ds.servroute[thistrip["route_id"]], ra["trip"]))
     if "r" in ra:
         return redirect("/route/{}/".format(ra["r"].strip()), 302, None)
     else:
         return redirect("/", 303, None)
 
 
+def routeStops(ds, route_spats):
+    # Stop info along each of the route's patterns in turn, or None
+    inds = []
+    for spat in enumerate(route_spats):
+        inds.extend([(sp["sind"], spat[0]) for sp in
+                     ds.stop_patterns[spat[1]]])
+    if len(inds) == 0:
+        return None
+    rmv = []
+    for i in range(0, len(inds) - 1):
+        if inds[i][0] == inds[i + 1][0]:
+            rmv.append(i)
+
+    in2 = [ev[1] for ev in enumerate(inds) if ev[0] not in rmv]
+
+    return [ds.stopinfo[i[0]] for i in in2 if i[0] is not None]
+
+
 @app.route("/route/<string:rquery>/")
 def routeInfo(rquery):
-    if rquery == "" or rquery not in routelist:
+    ds = data
+    if rquery == "" or rquery not in ds.routelist:
         return render_template("badroute.html", error="No such route",
-                               lup=routeslastupdate.strftime("%A %B %-d"),
-                               routes=sortedRouteCodes(), footer=footerData())
-    routeinfo = routelist[rquery]
+                               lup=ds.loaded.strftime("%A %B %-d"),
+                               routes=sortedRouteCodes(ds), footer=footerData())
+    routeinfo = ds.routelist[rquery]
     ra = request.args
     rtrip = ("trip" in ra and ra["trip"] != "" and ra["trip"] != "none")
     ttrip = None
-    route_trips = [x["trip_id"] for x in triplist if x["route_id"] ==
-                   routeinfo["route_id"]]
-    route_spats = set([trip_sid[t] for t in route_trips])
+    route_spats = ds.route_patterns.get(routeinfo["route_id"], [])
     slist = []
-    thistripinfo = []
     if rtrip:
         ttrip = ra["trip"]
-        thistripinfo = [x for x in triplist if x["route_id"] ==
-                     routeinfo["route_id"] and x["trip_id"] == ttrip]
-        rtrip = len(thistripinfo) > 0 and ttrip in trip_stop_times
+        thistripinfo = ds.trip_index.get(ttrip)
+        rtrip = (thistripinfo is not None and
+                 thistripinfo["route_id"] == routeinfo["route_id"] and
+                 ttrip in ds.trip_stop_times)
     if rtrip:
         slist = [{"stop_id": s["id"],
                   "time": s["time"],
                   "tp": s["tp"],
-                  "inf": stopinfo[s["sind"]] if s["sind"] is
+                  "inf": ds.stopinfo[s["sind"]] if s["sind"] is
                   not None else None} for s in
-                 trip_stop_times[ttrip]]
+                 ds.trip_stop_times.stops(ttrip)]
     route_code = routeinfo["route_short_name"]
     route_name = routeinfo["route_long_name"]
-    inds = []
-    for spat in enumerate(route_spats):
-        inds.extend([(sp["sind"], spat[0]) for sp in
-                     stop_patterns[spat[1]]])
-    if len(inds) == 0:
+    rv = routeStops(ds, route_spats)
+    if rv is None:
         return render_template("badroute.html", error="No stops in route",
-                               routes=sortedRouteCodes(),
-                               lup=routeslastupdate.strftime("%A %B %-d"),
+                               routes=sortedRouteCodes(ds),
+                               lup=ds.loaded.strftime("%A %B %-d"),
                                footer=footerData())
-    rmv = []
-    for i in range(0, len(inds) - 1):
-        if inds[i][0] == inds[i + 1][0]:
-            rmv.append(i)
-
-    in2 = [ev[1] for ev in enumerate(inds) if ev[0] not in rmv]
-
-    rv = [stopinfo[i[0]] if i[0] is not None else None for i in in2]
-    for r in enumerate(rv):
-        if rv[r[0]] is not None:
-            rv[r[0]]["pattern"] = in2[r[0]][1] + 1
-    rv = [r for r in rv if r is not None]
     if rtrip:
-        dates = caldates.get(trip_serv.get(ttrip))
+        dates = serviceDates(ds, ds.trip_serv.get(ttrip))
         vdates = validDates(dates)
         datetable = None
         #if dates is not None and len(dates) > 0:
         #    datetable = DateTable([{"day": date.strftime("%A"), "date":
         #                            date.strftime("%-d %B %Y")} for date in
         #                           dates])
-        tripstops = [s.get("inf") for s in slist if
-                     s.get("inf") is not None]
         vehdata = None
         a_vid = None
         vehposdat = trip_positions.get(ttrip)
-        if vehposdat is not None and len(tripstops) > 0:
-            can_stops = [{"id": stop["stop_id"], "name": stop["stop_name"],
-                          "dlat": vehposdat["lat"] - stop["stop_lat"],
-                          "dlon": vehposdat["lon"] - stop["stop_lon"],
-                          "dist2": planeDistance2(stop["stop_lat"],
-                                                  stop["stop_lon"],
-                                                  vehposdat["lat"],
-                                                  vehposdat["lon"])}
-                          for stop in tripstops]
-            can_stops.sort(key=lambda x: x["dist2"])
-            c_stop = can_stops[0]
+        if vehposdat is not None and vehposdat.get("nearest") is not None:
+            c_stop = vehposdat["nearest"]
             a_vid = vehposdat["vehicle_id"]
             vehdata = {
                 "dtime": (dt.datetime.now(patz) -
                           vehposdat["timestamp"]).seconds,
                 "ob_time": vehposdat["timestamp"],
                 "s_dist": prettyDistance(sqrt(c_stop["dist2"])),
-                "s_head": directions.get(heading(c_stop["dlat"],
-                                                 c_stop["dlon"])),
-                "s_id": c_stop["id"],
+                "s_head": directions.get(c_stop["heading"]),
+                "s_id": c_stop["stop_id"],
                 "s_name": c_stop["name"],
                 "bearing": directions.get(headingdeg(vehposdat["bearing"]))
             }
@@ -1108,7 +2925,7 @@ def routeInfo(rquery):
                              "s" if round(abs(delay) / 60) != 1 else "",
                              "early" if delay < 0 else "late")
             }
-        direction = "Outbound" if trip_dir[ttrip] == "0" else "Inbound"
+        direction = "Outbound" if ds.trip_dir[ttrip] == "0" else "Inbound"
         rstopsdat = [{"code": stop["stop_id"],
                       "sms": stop["inf"]["parent_station"] if
                           stop["inf"] is not None and
@@ -1123,12 +2940,12 @@ def routeInfo(rquery):
                       "nearest": stop["stop_id"] == vehdata["s_id"] if vehdata
                      is not None else False} for stop in slist]
         rTable = StopTimeTable(rstopsdat)
-        rel_alerts = [alert for alert in alertlist if ttrip in
-                      alert["trips"] or route_code in alert["routes"]]
+        rel_alerts = alertindex.lookup(routes=[route_code], trips=[ttrip])
+        g.maxage = freshFor(positionlastupdate, POLL_INTERVALS["positions"])
         return render_template("trip.html", code=route_code, name=route_name,
                                table=rTable if len(rstopsdat) > 0 else "",
                                direction=direction,
-                               routes=sortedRouteCodes(),
+                               routes=sortedRouteCodes(ds),
                                footer=footerData(), alerts = rel_alerts,
                                valid_dates=vdates, datetable=datetable,
                                v_pos=vehdata, v_upd=veh_tup, vehicle=a_vid)
@@ -1138,13 +2955,13 @@ def routeInfo(rquery):
                       stop["parent_station"] != "" else stop["stop_id"],
                       "stop": stop["stop_name"],
                       "zone": stop["zone_id"]} for stop in rv]
-        rtrips = routetrips.get(routeinfo["route_id"])
+        rtrips = ds.routetrips.get(routeinfo["route_id"])
         triptab = None
         if rtrips is not None and len(rtrips) > 0:
             tripsdat = [{"rname": rquery,
                          "trip_id": t,
-                         "seq": trip_seq[t],
-                         "direction": "Outbound" if (trip_dir[t] ==
+                         "seq": ds.trip_seq[t],
+                         "direction": "Outbound" if (ds.trip_dir[t] ==
                                                      "0") else "Inbound",
                          "vehicle": trip_positions[t]["vehicle_id"],
                          "departed":
@@ -1156,15 +2973,14 @@ def routeInfo(rquery):
                               else 0)
                 triptab = TripTable(tripsdat)
         all_stops = [s["code"] for s in rstopsdat]
-        rel_alerts = [alert for alert in alertlist if route_code in
-                      alert["routes"] or any([x in alert["stops"] for x in
-                                              all_stops])]
+        rel_alerts = alertindex.lookup(stops=all_stops, routes=[route_code])
         rTable = StopTable(rstopsdat)
+        g.maxage = freshFor(positionlastupdate, POLL_INTERVALS["positions"])
         return render_template("route.html", code=route_code, name=route_name,
                                table=rTable if len(rstopsdat) > 0 else "",
-                               lup=routeslastupdate.strftime("%A %B %-d"),
+                               lup=ds.loaded.strftime("%A %B %-d"),
                                trips=triptab,
-                               routes=sortedRouteCodes(),
+                               routes=sortedRouteCodes(ds),
                                footer=footerData(), alerts = rel_alerts)
 
 
@@ -1179,11 +2995,11 @@ def ttabse():
 
 
 @app.route("/timetable/<string:rquery>/")
-@cache.cached(timeout=3600, query_string=True)
 def routeTimetable(rquery):
-    if rquery == "" or rquery not in routelist:
+    ds = data
+    if rquery == "" or rquery not in ds.routelist:
         return redirect("/", 303, None)
-    routeinfo = routelist[rquery]
+    routeinfo = ds.routelist[rquery]
     route_name = routeinfo["route_long_name"]
     ra = request.args
     tponly = "stops" not in ra or ra["stops"] != "all"
@@ -1192,27 +3008,15 @@ def routeTimetable(rquery):
         ttdate = dt.datetime.strptime(ra["date"], "%Y-%m-%d").date()
     except:
         ttdate = todaydate
-    route_trips = [x for x in triplist if x["route_id"] ==
-                   routeinfo["route_id"]]
-    day_trips = [trip for trip in route_trips if
-                 caldates.get(trip_serv.get(trip["trip_id"])) is not None and
-                 ttdate in [cdate.date() for cdate in
-                            caldates.get(trip_serv.get(trip["trip_id"]))]]
-    alldates = [caldates.get(trip_serv.get(trip["trip_id"])) for trip in
-                route_trips if trip_serv.get(trip["trip_id"]) in caldates]
-    alldates = [cdate.date() for tripdays in alldates for cdate in tripdays]
-    alldates = list(set(alldates))
-    alldates.sort()
-    prevdates = [tripday for tripday in alldates if tripday < ttdate]
-    ldate = None if len(prevdates) == 0 else max(prevdates)
-    folldates = [tripday for tripday in alldates if tripday > ttdate]
-    ndate = None if len(folldates) == 0 else min(folldates)
-    # Outbound trips
-    out_trips = [trip for trip in day_trips if trip.get("direction_id") != "1"]
-    out_table = tripTimeTable(out_trips, rquery, "outbound-timetable", tponly)
-    # Inbound trips
-    in_trips = [trip for trip in day_trips if trip.get("direction_id") == "1"]
-    in_table = tripTimeTable(in_trips, rquery, "inbound-timetable", tponly)
+    ldate, ndate = adjacentServiceDates(ds, routeinfo["route_id"], ttdate)
+    store = timetables
+    tables = None
+    if store.feed_version == ds.zipinfo.get("feed_version"):
+        tables = store.get(rquery, (ttdate - ds.cal_start).days, tponly)
+    if tables is None:
+        tables = routeDayTables(ds, rquery, routeDayTrips(ds, routeinfo,
+                                                          ttdate), tponly)
+    out_table, in_table = tables
     return render_template("timetable.html", code=rquery,
                            ttdate=ttdate,
                            todaydate=todaydate,
@@ -1222,54 +3026,75 @@ def routeTimetable(rquery):
                            ldate=ldate,
                            ndate=ndate,
                            tponly=tponly,
-                           routes=sortedRouteCodes(),
+                           routes=sortedRouteCodes(ds),
                            footer=footerData())
 
 
 @app.route("/stop/<string:stop>/nearby/")
 def nearbyStops(stop):
-    if stop == "" or stop not in stopids:
+    ds = data
+    if stop == "" or stop not in ds.stopids:
         return render_template("badnearby.html",
                                error = "Stop not found",
-                               lup=stoplastupdate.strftime("%A %B %-d"),
+                               lup=ds.loaded.strftime("%A %B %-d"),
                                footer=footerData())
-    thisstop = stopinfo[stopids[stop]]
-    stopDistances = [{"id": x["stop_id"],
-                      "parent": x["parent_station"],
-                      "name": x["stop_name"],
-                      "zone": x["zone_id"],
-                      "dlat": x["stop_lat"] - thisstop["stop_lat"],
-                      "dlon": x["stop_lon"] - thisstop["stop_lon"],
-                      "dist2": planeDistance2(thisstop["stop_lat"],
-                                              thisstop["stop_lon"],
-                                              x["stop_lat"],
-                                              x["stop_lon"])}
-                     for x in stopinfo if x["stop_id"] != stop]
-    stopDistances = [x for x in stopDistances if x["dist2"] >= 1]
-    if len(stopDistances) == 0:
+    thisstop = ds.stopinfo[ds.stopids[stop]]
+    inds, dist2s = ds.stopgrid.search(thisstop["stop_lat"],
+                                      thisstop["stop_lon"], k=20,
+                                      exclude=ds.stopids[stop], mindist2=1)
+    if len(inds) == 0:
         return render_template("badnearby.html",
                                error = "No nearby stops found",
-                               lup=stoplastupdate.strftime("%A %B %-d"),
+                               lup=ds.loaded.strftime("%A %B %-d"),
                                footer=footerData())
-    stopDistances.sort(key=lambda x: x["dist2"])
-    nstopsDat = [{"code": x["id"],
-                  "sms": x["parent"] if x["parent"] != "" else
-                  x["id"],
-                  "stop": x["name"],
-                  "zone": x["zone"],
-                  "distance": "{}m {}".format(
-                      prettyDistance(sqrt(x["dist2"])),
-                      heading(x["dlat"], x["dlon"]))} for x in
-                 stopDistances[:20]]
+    nstopsDat = nearbyRows(ds, thisstop["stop_lat"], thisstop["stop_lon"],
+                           inds, dist2s)
     nTable = LocationTable(nstopsDat)
     return render_template("nearby.html", code=stop,
                            name=thisstop["stop_name"],
                            zone=thisstop["zone_id"],
-                           lup=stoplastupdate.strftime("%A %B %-d"),
+                           lup=ds.loaded.strftime("%A %B %-d"),
                            table=nTable, footer=footerData())
 
+@app.route("/nearby/")
+def nearbyLocation():
+    ds = data
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius = (float(request.args["radius"]) if "radius" in request.args
+                  else None)
+    except (KeyError, ValueError):
+        radius = lat = lon = float("nan")
+    if (not isfinite(lat) or not isfinite(lon) or abs(lat) > 90 or
+            abs(lon) > 180 or (radius is not None and
+                               not (isfinite(radius) and radius >= 0))):
+        return render_template("badnearby.html",
+                               error = "Location not understood",
+                               lup=ds.loaded.strftime("%A %B %-d"),
+                               footer=footerData())
+    if (len(ds.stopgrid.cells) == 0 or
+            ds.stopgrid.extentDistance2(lat, lon) > NEARBY_MAX**2):
+        return render_template("badnearby.html",
+                               error = "Location is too far from any stop",
+                               lup=ds.loaded.strftime("%A %B %-d"),
+                               footer=footerData())
+    inds, dist2s = ds.stopgrid.search(lat, lon, k=20, radius=radius)
+    if len(inds) == 0:
+        return render_template("badnearby.html",
+                               error = "No nearby stops found",
+                               lup=ds.loaded.strftime("%A %B %-d"),
+                               footer=footerData())
+    nTable = LocationTable(nearbyRows(ds, lat, lon, inds, dist2s))
+    return render_template("location.html", lat=round(lat, 5),
+                           lon=round(lon, 5),
+                           lup=ds.loaded.strftime("%A %B %-d"),
+                           table=nTable, footer=footerData())
+
+
 @app.route("/alerts/")
 def showAllAlerts():
+    g.maxage = freshFor(alertslastupdate, POLL_INTERVALS["alerts"])
     return render_template("alerts.html", alerts=alertlist,
                            lup=alertslastupdate,
                            footer=footerData())
@@ -1277,15 +3102,18 @@ def showAllAlerts():
 
 @app.route("/vehicles/")
 def showAllVehicles():
-    vehdat = [{"rname": servroute.get(str(trip_positions[t]["route_id"])) if 
-               str(trip_positions[t]["route_id"]) in servroute else "",
-                 "route": servroute.get(str(trip_positions[t]["route_id"])) if 
-               str(trip_positions[t]["route_id"]) in servroute else "",
+    ds = data
+    vehdat = [{"rname": ds.servroute.get(str(trip_positions[t]["route_id"])) if 
+               str(trip_positions[t]["route_id"]) in ds.servroute else "",
+                 "route": ds.servroute.get(str(trip_positions[t]["route_id"])) if 
+               str(trip_positions[t]["route_id"]) in ds.servroute else "",
                  "trip_id": t,
                  "direction": "Outbound" if (trip_positions[t]["direction"] ==
                                              0) else "Inbound",
                  "vehicle": trip_positions[t]["vehicle_id"],
                  "departed": trip_positions[t]["start_time"],
+                 "near": trip_positions[t]["nearest"]["name"] if
+                   trip_positions[t].get("nearest") is not None else "",
                  "delay": 0 if t not in trip_updates else
                    trip_updates[t]["delay"],
                  "status": "" if t not in trip_updates else (
@@ -1322,13 +3150,526 @@ def showAllVehicles():
                                      "early" if med < 0 else "late"))}
 
 
+    g.maxage = freshFor(positionlastupdate, POLL_INTERVALS["positions"])
     return render_template("vehicles.html", table=vehtab,
                            lup=positionlastupdate, stats=stats,
                            footer=fdat)
 
 
+def epochSecs(when):
+    return None if when is None else int(when.timestamp())
+
+
+def apiFields(rows):
+    # ?fields=a,b keeps only those keys of each row
+    if "fields" not in request.args:
+        return rows
+    keep = set(request.args["fields"].split(","))
+    return [{key: value for key, value in row.items() if key in keep} for
+            row in rows]
+
+
+def apiAlerts(alerts):
+    return [{"id": a["id"], "h": a["head"], "d": a["desc"],
+             "ef": a["effect"], "s": epochSecs(a["start"]),
+             "e": epochSecs(a["end"])} for a in alerts]
+
+
+def apiError(error, status):
+    return jsonify({"error": error}), status
+
+
+def apiVehicle(ds, tid, pos):
+    near = pos.get("nearest")
+    update = trip_updates.get(tid)
+    return {"r": ds.servroute.get(str(pos["route_id"]), ""), "t": tid,
+            "v": pos["vehicle_id"], "dir": pos["direction"],
+            "dep": pos["start_time"],
+            "la": round(pos["lat"], 5), "lo": round(pos["lon"], 5),
+            "near": near["stop_id"] if near is not None else None,
+            "dl": update["delay"] if update is not None else None,
+            "ts": epochSecs(pos["timestamp"])}
+
+
+# JSON API for small clients. Field names are kept short; each endpoint
+# documents its row fields, and ?fields= selects among them.
+
+@app.route("/api/v1/stop/<string:stop>")
+def apiStop(stop):
+    # r route, h destination, t trip_id, a/e aimed/expected, st status
+    ds = data
+    fetched, status, rv = stopPredictions(ds, stop)
+    if status != 200:
+        return apiError("No departures for stop", status)
+    inf = ds.stopinfo[ds.stopids[stop]] if stop in ds.stopids else None
+    deps = [{"r": s["service_id"], "h": s["destination"]["name"],
+             "t": s["trip_id"] if "trip_id" in s and s["trip_id"] != False
+                 and s["trip_id"] != "false" else None,
+             "a": epochSecs(isoparse(s["departure"]["aimed"])),
+             "e": None if s["departure"]["expected"] is None else
+                 epochSecs(isoparse(s["departure"]["expected"])),
+             "st": s["status"]} for s in rv.get("departures", [])]
+    rel_alerts = alertindex.lookup(stops=[stop],
+                                   routes=[d["r"] for d in deps],
+                                   trips=[d["t"] for d in deps])
+    g.maxage = freshFor(fetched, PREDICTION_TTL)
+    return jsonify({"id": stop,
+                    "n": inf["stop_name"] if inf is not None else None,
+                    "z": rv.get("farezone"), "up": epochSecs(fetched),
+                    "d": apiFields(deps), "al": apiAlerts(rel_alerts)})
+
+
+@app.route("/api/v1/route/<string:rquery>")
+def apiRoute(rquery):
+    # Stops: id, n name, z zone, and with ?trip= tm time, tp timepoint
+    ds = data
+    if rquery not in ds.routelist:
+        return apiError("No such route", 404)
+    routeinfo = ds.routelist[rquery]
+    ra = request.args
+    ttrip = ra.get("trip", "")
+    if ttrip != "" and ttrip != "none":
+        thistripinfo = ds.trip_index.get(ttrip)
+        if (thistripinfo is None or
+                thistripinfo["route_id"] != routeinfo["route_id"] or
+                ttrip not in ds.trip_stop_times):
+            return apiError("No such trip on route", 404)
+        stops = [{"id": s["id"],
+                  "n": ds.stopinfo[s["sind"]]["stop_name"] if s["sind"] is
+                      not None else "",
+                  "z": ds.stopinfo[s["sind"]]["zone_id"] if s["sind"] is
+                      not None else "",
+                  "tm": s["time"], "tp": s["tp"]} for s in
+                 ds.trip_stop_times.stops(ttrip)]
+        vehicles = ([apiVehicle(ds, ttrip, trip_positions[ttrip])] if
+                    ttrip in trip_positions else [])
+        rel_alerts = alertindex.lookup(routes=[rquery], trips=[ttrip])
+    else:
+        rv = routeStops(ds, ds.route_patterns.get(routeinfo["route_id"], []))
+        stops = [{"id": stop["stop_id"], "n": stop["stop_name"],
+                  "z": stop["zone_id"]} for stop in rv or []]
+        vehicles = [apiVehicle(ds, t, trip_positions[t]) for t in
+                    ds.routetrips.get(routeinfo["route_id"], []) if t in
+                    trip_positions]
+        rel_alerts = alertindex.lookup(stops=[s["id"] for s in stops],
+                                       routes=[rquery])
+    g.maxage = freshFor(positionlastupdate, POLL_INTERVALS["positions"])
+    return jsonify({"r": rquery, "n": routeinfo["route_long_name"],
+                    "s": apiFields(stops), "v": vehicles,
+                    "al": apiAlerts(rel_alerts)})
+
+
+@app.route("/api/v1/vehicles")
+def apiVehicles():
+    # r, t, v vehicle, dir, dep start, la/lo, near stop, dl delay, ts
+    ds = data
+    positions = trip_positions
+    g.maxage = freshFor(positionlastupdate, POLL_INTERVALS["positions"])
+    return jsonify({"up": epochSecs(positionlastupdate),
+                    "v": apiFields([apiVehicle(ds, t, pos) for t, pos in
+                                    positions.items()])})
+
+
+@app.route("/api/v1/timetable/<string:rquery>")
+def apiTimetable(rquery):
+    # Per direction t trips, st starts; stops id, n, z, tp, tm times
+    ds = data
+    if rquery not in ds.routelist:
+        return apiError("No such route", 404)
+    routeinfo = ds.routelist[rquery]
+    ra = request.args
+    tponly = "stops" not in ra or ra["stops"] != "all"
+    try:
+        ttdate = dt.datetime.strptime(ra["date"], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        ttdate = dt.datetime.now(patz).date()
+    day_trips = routeDayTrips(ds, routeinfo, ttdate)
+    dirs = []
+    for direction in ("0", "1"):
+        trips = [trip for trip in day_trips if
+                 (trip.get("direction_id") == "1") == (direction == "1")]
+        if len(trips) == 0:
+            continue
+        trip_ids, start_times, rows = timetableGrid(ds, trips, tponly)
+        dirs.append({"dir": int(direction), "t": trip_ids,
+                     "st": [start_times[tid] for tid in trip_ids],
+                     "s": apiFields([
+                         {"id": stop_id, "n": ds.stopinfo[sind]["stop_name"],
+                          "z": ds.stopinfo[sind]["zone_id"], "tp": anytp,
+                          "tm": times} for stop_id, sind, pin, anytp, times
+                         in rows])})
+    return jsonify({"r": rquery, "date": ttdate.isoformat(), "d": dirs})
+
+
+def metricSamples(name, doc, kind, labels, samples):
+    return (["# HELP {} {}".format(name, doc),
+             "# TYPE {} {}".format(name, kind)] +
+            [metricLine(name, metricLabels(labels, key), value) for
+             key, value in samples])
+
+
+@app.route("/metrics")
+def showMetrics():
+    # Gauges are read at scrape time
+    ds = data
+    now = time.time()
+    lines = []
+    for metric in (requestseconds, requestcodes, upstreamseconds,
+                   upstreamcodes, jobseconds, jobevents):
+        lines.extend(metric.lines())
+    lines.extend(metricSamples(
+        "rti_live_entries", "Entries in each live store.", "gauge",
+        ("store",), [(("trip_positions",), len(trip_positions)),
+                     (("trip_updates",), len(trip_updates)),
+                     (("alertlist",), len(alertlist))]))
+    updated = [(("trip_positions",), positionlastupdate.timestamp()),
+               (("alertlist",), alertslastupdate.timestamp())]
+    if livestats["tripupdates"]["at"] > 0:
+        updated.append((("trip_updates",), livestats["tripupdates"]["at"]))
+    lines.extend(metricSamples(
+        "rti_live_age_seconds", "Seconds since each live store's data was "
+        "current.", "gauge", ("store",),
+        [(key, round(now - when, 3)) for key, when in updated]))
+    lines.extend(metricSamples(
+        "rti_dataset_entities", "Size of the loaded GTFS dataset.", "gauge",
+        ("kind",), [(("stops",), len(ds.stopinfo)),
+                    (("routes",), len(ds.routelist)),
+                    (("trips",), len(ds.trip_index)),
+                    (("timetables",), len(timetables.tables))]))
+    if "feed_version" in ds.zipinfo:
+        lines.extend(metricSamples(
+            "rti_dataset_age_seconds", "Seconds since the dataset was "
+            "loaded.", "gauge", ("feed_version",),
+            [((ds.zipinfo["feed_version"],),
+              round(now - ds.loaded.timestamp(), 3))]))
+    lines.extend(metricSamples(
+        "rti_dataset_load_seconds", "Time the last dataset load took in this "
+        "process.", "gauge", (), [((), loadstats["seconds"])]))
+    cachestats = predictions.stats()
+    lines.extend(metricSamples(
+        "rti_prediction_cache_total", "Stop prediction lookups by outcome.",
+        "counter", ("outcome",),
+        [((outcome,), cachestats[outcome]) for outcome in
+         ("hits", "stale", "misses", "coalesced")] +
+        [(("local",), localstats["answers"])]))
+    lines.extend(metricSamples(
+        "rti_startup_phase_seconds", "Time each startup phase took.",
+        "gauge", ("phase",), [((name,), phase["seconds"]) for name, phase in
+                              list(startupstats["phases"].items())]))
+    lines.extend(metricSamples(
+        "rti_prediction_cache_entries", "Stops held in the prediction cache.",
+        "gauge", (), [((), cachestats["entries"])]))
+    return app.response_class("\n".join(lines) + "\n",
+                              mimetype="text/plain; version=0.0.4")
+
+
+def deepSize(obj, seen):
+    # Bytes reachable from obj and not in seen; mapped files count as ~0
+    size = 0
+    stack = [obj]
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType,
+                                           types.FunctionType,
+                                           types.MethodType,
+                                           types.BuiltinFunctionType)):
+            continue
+        seen.add(id(o))
+        size += getsizeof(o)
+        # Copied first, as the live stores can change under us
+        if isinstance(o, dict):
+            stack.extend(list(o.keys()))
+            stack.extend(list(o.values()))
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(list(o))
+        elif isinstance(o, np.ndarray):
+            # A view's buffer is its base, down to the memoryview of a
+            # snapshot's bytes or of a mapped file
+            if o.base is not None:
+                stack.append(o.base)
+        elif isinstance(o, memoryview):
+            stack.append(o.obj)
+        elif hasattr(o, "__dict__"):
+            stack.append(vars(o))
+    return size
+
+
+def processMemory():
+    # Resident and peak memory in bytes, where /proc has them
+    fields = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM", "RssAnon", "RssFile",
+                            "RssShmem"):
+                    fields[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return fields
+
+
+def memoryReport():
+    # Objects shared between structures count towards the first measured
+    starttime = time.perf_counter()
+    ds = data
+    seen = set()
+    dataset = {name: deepSize(value, seen) for name, value in
+               list(vars(ds).items())}
+    live = {name: deepSize(value, seen) for name, value in (
+        ("trip_positions", trip_positions), ("trip_updates", trip_updates),
+        ("positionstore", positionstore), ("updatestore", updatestore),
+        ("etaindex", etaindex), ("alertlist", alertlist),
+        ("alertindex", alertindex), ("predictions", predictions),
+        ("timetables", timetables))}
+    return {"taken": dt.datetime.now(patz).isoformat(timespec="seconds"),
+            "feed_version": ds.zipinfo.get("feed_version"),
+            "loads": loadstats["loads"], "role": RTI_ROLE,
+            "dataset": dataset, "dataset_bytes": sum(dataset.values()),
+            "live": live, "live_bytes": sum(live.values()),
+            "process": processMemory(),
+            "seconds": round(time.perf_counter() - starttime, 3)}
+
+
+memhistory = []
+memorylock = threading.Lock()
+
+
+def recordMemory(trigger):
+    report = dict(memoryReport(), trigger=trigger)
+    with memorylock:
+        memhistory.append(report)
+        del memhistory[:-MEMORY_HISTORY]
+    print("Memory after {}: dataset {:.1f} MB, live {:.1f} MB".format(
+        trigger, report["dataset_bytes"] / 1e6, report["live_bytes"] / 1e6))
+    return report
+
+
+def traceMemory(action, top):
+    # Frees of objects allocated before tracing started are not seen
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        before = tracemalloc.take_snapshot()
+        if hasattr(tracemalloc, "reset_peak"):
+            # Python 3.9+; otherwise the peak can predate action()
+            tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        starttime = time.perf_counter()
+        result = action()
+        elapsed = time.perf_counter() - starttime
+        peak = tracemalloc.get_traced_memory()[1] - base
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    stats = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), "lineno")
+    return {"result": result, "seconds": round(elapsed, 3),
+            "peak_bytes": peak,
+            "net_bytes": sum(stat.size_diff for stat in stats),
+            "top": [{"where": str(stat.traceback[0]),
+                     "size_diff": stat.size_diff,
+                     "count_diff": stat.count_diff} for stat in stats[:top]]}
+
+
+def adminDenied():
+    # A response refusing the request, or None if it may go ahead
+    if ADMIN_TOKEN is None:
+        return apiError("Not found", 404)
+    supplied = request.headers.get("Authorization", "").encode("utf-8")
+    if not hmac.compare_digest(supplied, "Bearer {}".format(
+            ADMIN_TOKEN).encode("utf-8")):
+        return apiError("Forbidden", 403)
+    return None
 
-if __name__ == "__main__":
-    app.run()
 
+@app.route("/admin/memory")
+def adminMemory():
+    denied = adminDenied()
+    if denied is not None:
+        return denied
+    with memorylock:
+        history = list(memhistory)
+    return jsonify({"current": memoryReport(), "history": history})
 
+
+@app.route("/admin/memory/trace", methods=["POST"])
+def adminMemoryTrace():
+    # ?what=reload or ?what=render&route=[&date=&stops=all], ?top=
+    denied = adminDenied()
+    if denied is not None:
+        return denied
+    ds = data
+    ra = request.args
+    try:
+        top = int(ra.get("top", 25))
+    except ValueError:
+        return apiError("Bad top", 400)
+    what = ra.get("what")
+    if what == "reload":
+        if RTI_ROLE == "worker":
+            return apiError("Workers do not load the dataset", 409)
+        return jsonify(dict(traceMemory(loadZipDataset, top), what=what))
+    if what != "render":
+        return apiError("what must be reload or render", 400)
+    rquery = ra.get("route")
+    if rquery not in ds.routelist:
+        return apiError("No such route", 404)
+    try:
+        ttdate = dt.datetime.strptime(ra["date"], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        ttdate = dt.datetime.now(patz).date()
+    tponly = ra.get("stops") != "all"
+
+    def render():
+        tables = routeDayTables(ds, rquery, routeDayTrips(
+            ds, ds.routelist[rquery], ttdate), tponly)
+        return sum(len(table) for table in tables if table is not None)
+    return jsonify(dict(traceMemory(render, top), what=what, route=rquery,
+                        date=ttdate.isoformat()))
+
+
+startupstats = {"phases": {}, "ready": None, "attempts": 0}
+warmedup = threading.Event()
+
+
+def recordPhase(name, starttime, ok):
+    now = time.perf_counter()
+    startupstats["phases"][name] = {"seconds": round(now - starttime, 3),
+                                    "ok": ok,
+                                    "at": round(now - importstart, 3)}
+
+
+def startupPhase(name, func, *args):
+    # One warm-up step; failures are logged and left to the next poll
+    starttime = time.perf_counter()
+    try:
+        ok = func(*args) is not False
+    except Exception as e:
+        print("Warm-up {} failed: {}".format(name, e))
+        ok = False
+    recordPhase(name, starttime, ok)
+    return ok
+
+
+def loadFirstDataset():
+    startupstats["attempts"] += 1
+    try:
+        updateFeedInfo(True)
+    except requests.RequestException as e:
+        print("Could not reach Metlink: {}".format(e))
+    # Without Metlink, serve whatever zip is already here
+    if "feed_version" not in data.zipinfo and exists("GTFS_full.zip"):
+        loadZipDataset()
+    if "feed_version" not in data.zipinfo:
+        return False
+    startupstats["ready"] = round(time.perf_counter() - importstart, 3)
+    return True
+
+
+def schedulePolls():
+    app.apscheduler.add_job(func=timedJob("ualerts", updateAlerts),
+                            trigger="cron", args=[True], minute='*/5',
+                            id="ualerts")
+    app.apscheduler.add_job(func=timedJob("upos", updatePositions),
+                            trigger="cron", minute="*", id="upos")
+    app.apscheduler.add_job(func=timedJob("utrip", updateTripUpdates),
+                            trigger="cron", minute="*/2", id="utrip")
+
+
+def warmUp():
+    # Polls are scheduled after the first ones here; LiveStore isn't locked
+    startupPhase("dataset", loadFirstDataset)
+    startupPhase("alerts", updateAlerts, True)
+    startupPhase("positions", updatePositions)
+    startupPhase("tripupdates", updateTripUpdates)
+    schedulePolls()
+    warmedup.set()
+    while "feed_version" not in data.zipinfo:
+        time.sleep(WARMUP_RETRY)
+        startupPhase("dataset", loadFirstDataset)
+
+
+def readiness():
+    ds = data
+    store = timetables
+    return {"dataset": "feed_version" in ds.zipinfo,
+            "timetables": (store.done and store.feed_version is not None and
+                           store.feed_version == ds.zipinfo.get(
+                               "feed_version")),
+            "alerts": alertstats["refreshes"] > 0,
+            "positions": livestats["positions"]["polls"] > 0,
+            "tripupdates": livestats["tripupdates"]["polls"] > 0}
+
+
+@app.route("/healthz")
+def showHealth():
+    # Always 200, with what is loaded and the startup phase timings
+    return jsonify({"status": "ok", "role": RTI_ROLE,
+                    "uptime": round(time.perf_counter() - importstart, 3),
+                    "components": readiness(), "startup": startupstats})
+
+
+@app.route("/readyz")
+def showReady():
+    # 200 once the dataset is in; live feeds aren't waited for
+    components = readiness()
+    ready = components["dataset"]
+    return jsonify({"ready": ready, "components": components,
+                    "feed_version": data.zipinfo.get("feed_version")}), (
+        200 if ready else 503)
+
+
+def timedJob(jobid, func):
+    # Scheduled job wrapper recording run time and errors for /metrics
+    def run(*args, **kwargs):
+        starttime = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            jobevents.add((jobid, "error"))
+            raise
+        finally:
+            jobseconds.observe((jobid,), time.perf_counter() - starttime)
+            jobevents.add((jobid, "run"))
+    return run
+
+
+def jobSkipped(event):
+    # A run is skipped as an overlap if the last one is still going
+    jobevents.add((event.job_id, "overlap" if event.code ==
+                   EVENT_JOB_MAX_INSTANCES else "missed"))
+
+
+# Start polling once every route is registered, so prerendering can build
+# links
+recordPhase("import", importstart, True)
+if RTI_ROLE == "worker":
+    # No polling here; the poller process publishes everything
+    starttime = time.perf_counter()
+    syncShared()
+    recordPhase("attach", starttime, True)
+    warmedup.set()
+else:
+    scheduler.start()
+    scheduler.add_listener(jobSkipped,
+                           EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+    app.apscheduler.add_job(func=timedJob("ufeedinfo", updateFeedInfo),
+                            trigger="cron", args=[True, True], minute='11',
+                            hour='3', id="ufeedinfo")
+    # Load in the background, so the server can take requests at once;
+    # the realtime polls are scheduled once it has done its own
+    threading.Thread(target=warmUp, daemon=True).start()
+
+
+if __name__ == "__main__":
+    if RTI_ROLE == "poller":
+        # Only the scheduler threads have work to do
+        while True:
+            time.sleep(3600)
+    app.run()